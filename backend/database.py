@@ -4,7 +4,7 @@ import sys
 from pathlib import Path
 from datetime import datetime
 
-from sqlalchemy import JSON, DateTime, ForeignKey, Integer, String, UniqueConstraint, create_engine, Column, Boolean
+from sqlalchemy import JSON, DateTime, Float, ForeignKey, Integer, String, UniqueConstraint, create_engine, Column, Boolean
 from sqlalchemy.orm import declarative_base, sessionmaker
 
 
@@ -51,6 +51,7 @@ class Paper(Base):
     pdf_path = Column(String, nullable=True)   # 服务器侧保存的 PDF 路径
     pages_dir = Column(String, nullable=True)  # 渲染后的页面目录
     page_count = Column(Integer, nullable=True)
+    pages_version = Column(String, nullable=True)  # 页面图片版本号：每次渲染更新，用于图片 URL 的 ?v=
     year_token = Column(String, nullable=True, index=True)   # e.g. "25"
     season_token = Column(String, nullable=True, index=True) # m|s|w
     done = Column(Boolean, nullable=False, default=False)  # 标记是否已完成
@@ -162,6 +163,39 @@ class QuestionSection(Base):
     )
 
 
+class QuestionHash(Base):
+    """题目截图的感知哈希（dHash），用于发现重复标注/重复上传的题目。"""
+    __tablename__ = "question_hashes"
+
+    question_id = Column(Integer, ForeignKey("questions.id"), primary_key=True)
+    dhash = Column(String, nullable=False)      # 128-bit hex（横向 + 纵向梯度各 64 位）
+    boxes_sig = Column(String, nullable=False)  # 框选签名：框没变就不用重算
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class ExportJob(Base):
+    """导出任务：请求、排队、进度和结果。多个服务进程共享同一张表，重启后排队中的任务继续执行。"""
+    __tablename__ = "export_jobs"
+
+    id = Column(String, primary_key=True)  # job_<毫秒时间戳>
+    status = Column(String, nullable=False, index=True)  # queued | processing | done | error | cancelled
+    request = Column(JSON, nullable=False)  # ExportRequest
+    priority = Column(Integer, nullable=False, default=0)
+    cost = Column(Integer, nullable=False, default=0)  # 估算页数，短任务优先
+    queued_at = Column(Float, nullable=False)  # epoch 秒，排队老化按它计算
+    worker = Column(String, nullable=True)  # 领取该任务的进程/线程（host:pid:token）
+    heartbeat_at = Column(Float, nullable=True)
+    phase = Column(String, nullable=True)
+    progress = Column(JSON, nullable=True)
+    image = Column(JSON, nullable=True)
+    path = Column(String, nullable=True)
+    filename = Column(String, nullable=True)
+    saved_copy_path = Column(String, nullable=True)
+    size_bytes = Column(Integer, nullable=True)
+    msg = Column(String, nullable=True)
+    finished_at = Column(Float, nullable=True)
+
+
 def init_db():
     Base.metadata.create_all(bind=engine)
 
@@ -173,6 +207,8 @@ def init_db():
                 conn.exec_driver_sql("ALTER TABLE papers ADD COLUMN year_token VARCHAR")
             if "season_token" not in cols:
                 conn.exec_driver_sql("ALTER TABLE papers ADD COLUMN season_token VARCHAR")
+            if "pages_version" not in cols:
+                conn.exec_driver_sql("ALTER TABLE papers ADD COLUMN pages_version VARCHAR")
 
             conn.exec_driver_sql(
                 """
@@ -215,6 +251,19 @@ def init_db():
         # If index creation fails, keep running.
         pass
 
+    # Full-text index over question/answer text (rowid = questions.id).
+    # Kept separate: SQLite builds without FTS5 just run without text search.
+    try:
+        with engine.begin() as conn:
+            conn.exec_driver_sql(
+                """
+                CREATE VIRTUAL TABLE IF NOT EXISTS question_fts
+                USING fts5(question_text, answer_text, tokenize='porter unicode61')
+                """
+            )
+    except Exception:
+        pass
+
     # Legacy data migration: section -> question_sections
     try:
         with SessionLocal() as db:
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import multiprocessing
 import os
 import sys
 from contextlib import asynccontextmanager
@@ -20,6 +21,10 @@ if __package__ is None or __package__ == "":
         sys.path.insert(0, str(_ROOT))
 
 from backend.database import init_db
+from backend.services.facet_index import facet_index
+from backend.services.similarity import similarity_index
+from backend.services.question_hash import question_hash_index
+from backend.services.page_assets import page_assets
 from backend.config import DATA_DIR, UI_DIR
 from backend.routers import admin, papers, questions, sections, stats, export, cie_import
 
@@ -27,6 +32,12 @@ from backend.routers import admin, papers, questions, sections, stats, export, c
 @asynccontextmanager
 async def lifespan(_: FastAPI):
     init_db()
+    page_assets.load()
+    facet_index.start()
+    similarity_index.start()
+    question_hash_index.start()
+    # 重启前排队（或做到一半）的导出任务从 export_jobs 表继续
+    export.export_scheduler.start()
     yield
 
 
@@ -103,6 +114,8 @@ def _run_uvicorn() -> None:
 
 
 if __name__ == "__main__":
+    # 打包后的 exe 里，导出分片进程也从这里启动
+    multiprocessing.freeze_support()
     _run_uvicorn()
 
 
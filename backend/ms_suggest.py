@@ -0,0 +1,224 @@
+from __future__ import annotations
+
+import re
+from pathlib import Path
+
+import fitz
+
+from backend.auto_suggest import (
+    _CTRL_CHAR_RE,
+    Marker,
+    _extract_markers_from_lines,
+    _extract_text_lines,
+    _page_footer_y,
+)
+
+
+# 评分表的表头行：“Question | Answer | Marks | Guidance”
+_HEADER_RE = re.compile(r"^\s*question(?:\s+(?:number|no\.?))?\s*$", flags=re.IGNORECASE)
+_HEADER_INLINE_RE = re.compile(r"^\s*question\b.{0,40}\b(?:answer|marks?)\b", flags=re.IGNORECASE)
+
+# 题号列很窄，只在左侧找题号
+_MS_LEFT_LIMIT = 0.2
+# 相邻两道大题的题号最多跳几个（更大的跳跃多半是表格里的数字，不是题号）
+_MAX_QUESTION_JUMP = 5
+_PAD = 0.006
+
+
+def _line_text(ln) -> str:
+    return _CTRL_CHAR_RE.sub("", str(ln.text or "")).strip()
+
+
+def _table_header_y(lines, ph: float) -> float | None:
+    """Bottom (normalized) of the mark-scheme table header row, None if the page has no table."""
+    best: float | None = None
+    for ln in lines:
+        t = _line_text(ln)
+        if _HEADER_RE.match(t) or _HEADER_INLINE_RE.match(t):
+            y = float(ln.y1) / ph
+            if best is None or y < best:
+                best = y
+    return best
+
+
+def _page_extent(page: fitz.Page, top: float, bottom: float) -> tuple[float, float, float] | None:
+    """(x0, x1, last content y) of the text between top and bottom (normalized)."""
+    pw = float(page.rect.width or 0)
+    ph = float(page.rect.height or 0)
+    if pw <= 0 or ph <= 0:
+        return None
+    x0 = x1 = y_last = None
+    for b in page.get_text("blocks") or []:
+        if len(b) < 5 or not str(b[4]).strip():
+            continue
+        by0, by1 = float(b[1]) / ph, float(b[3]) / ph
+        if by1 <= top or by0 >= bottom:
+            continue
+        bx0, bx1 = float(b[0]) / pw, float(b[2]) / pw
+        x0 = bx0 if x0 is None else min(x0, bx0)
+        x1 = bx1 if x1 is None else max(x1, bx1)
+        y_last = by1 if y_last is None else max(y_last, by1)
+    if x0 is None:
+        return None
+    return x0, x1, min(bottom, y_last)
+
+
+def _text_rows(page: fitz.Page, top: float, bottom: float) -> list[float]:
+    """Vertical centres (normalized) of the words between top and bottom."""
+    ph = float(page.rect.height or 0)
+    if ph <= 0:
+        return []
+    rows = []
+    for w in page.get_text("words") or []:
+        if len(w) < 5 or not str(w[4]).strip():
+            continue
+        y = (float(w[1]) + float(w[3])) / 2 / ph
+        if top < y < bottom:
+            rows.append(y)
+    return sorted(rows)
+
+
+def _question_starts(markers: list[Marker]) -> list[Marker]:
+    """First row of each question, keeping question numbers increasing."""
+    starts: list[Marker] = []
+    current = 0
+    for m in sorted(markers, key=lambda m: (m.page, m.y)):
+        if m.kind != "Q" or not str(m.val or "").isdigit():
+            continue
+        n = int(m.val)
+        if current < n <= current + _MAX_QUESTION_JUMP:
+            starts.append(m)
+            current = n
+    return starts
+
+
+def suggest_answer_boxes_from_ms(pdf_path: Path, page_count: int) -> tuple[dict[str, list[dict]], str | None]:
+    """Question number -> proposed answer boxes, read from the mark-scheme table rows.
+
+    Only pages with a "Question" table header are parsed, so the cover and
+    generic marking principles pages (numbered bullets) are skipped. Each
+    question spans from its first row to the first row of the next question,
+    split into one box per page; a continuation page with no text above the
+    next question's first row gets no box.
+    """
+    try:
+        doc = fitz.open(str(pdf_path))
+    except Exception as e:
+        return {}, f"PDF读取失败：{type(e).__name__}"
+
+    try:
+        pages: dict[int, dict] = {}
+        markers: list[Marker] = []
+        max_pages = min(int(page_count or 0) or int(doc.page_count or 0), int(doc.page_count or 0))
+        for page_num in range(1, max_pages + 1):
+            p = doc[page_num - 1]
+            pw = float(p.rect.width or 0)
+            ph = float(p.rect.height or 0)
+            if pw <= 0 or ph <= 0:
+                continue
+            lines = _extract_text_lines(p, left_limit_ratio=_MS_LEFT_LIMIT)
+            header_y = _table_header_y(lines, ph)
+            if header_y is None:
+                continue
+            footer_y = _page_footer_y(p) or 0.97
+            extent = _page_extent(p, header_y, footer_y)
+            if extent is None:
+                continue
+            pages[page_num] = {
+                "top": header_y,
+                "x0": extent[0],
+                "x1": extent[1],
+                "bottom": extent[2],
+                "rows": _text_rows(p, header_y, footer_y),
+            }
+            markers.extend(
+                m
+                for m in _extract_markers_from_lines(lines, page_num=page_num, page_h=ph, page_w=pw)
+                if header_y <= m.y < footer_y
+            )
+    finally:
+        doc.close()
+
+    if not pages:
+        return {}, "未找到评分表（没有 Question 表头）"
+    starts = _question_starts(markers)
+    if not starts:
+        return {}, "评分表中未识别到题号"
+
+    table_pages = sorted(pages)
+    last_page = table_pages[-1]
+    out: dict[str, list[dict]] = {}
+    for i, start in enumerate(starts):
+        nxt = starts[i + 1] if i + 1 < len(starts) else None
+        end_page = nxt.page if nxt is not None else last_page
+        boxes: list[dict] = []
+        for page_num in table_pages:
+            if page_num < start.page or page_num > end_page:
+                continue
+            info = pages[page_num]
+            y0 = start.y - _PAD if page_num == start.page else info["top"]
+            if nxt is not None and page_num == nxt.page:
+                y1 = nxt.y - _PAD
+                # 下一题紧接在表头下面：这一页没有本题的续行，不出空框
+                if page_num != start.page and not any(y0 < y < nxt.y for y in info["rows"]):
+                    continue
+            else:
+                y1 = info["bottom"] + _PAD
+            if y1 - y0 < 0.01:
+                continue
+            boxes.append(
+                {
+                    "page": int(page_num),
+                    "bbox": [
+                        round(max(0.0, info["x0"] - _PAD), 4),
+                        round(max(0.0, y0), 4),
+                        round(min(1.0, info["x1"] + _PAD), 4),
+                        round(min(1.0, y1), 4),
+                    ],
+                }
+            )
+        if boxes:
+            out.setdefault(str(start.val), boxes)
+    return out, None
+
+
+def question_labels_from_qp(pdf_path: Path, first_boxes: dict[int, tuple[int, list]]) -> dict[int, str]:
+    """question id -> printed question number, read from the QP marker at the top of its first box.
+
+    `first_boxes`: question id -> (page, normalized bbox) of the question's first box.
+    """
+    by_page: dict[int, list[int]] = {}
+    for qid, (page_num, _) in first_boxes.items():
+        by_page.setdefault(int(page_num), []).append(qid)
+    try:
+        doc = fitz.open(str(pdf_path))
+    except Exception:
+        return {}
+
+    out: dict[int, str] = {}
+    try:
+        for page_num, qids in by_page.items():
+            if page_num < 1 or page_num > doc.page_count:
+                continue
+            p = doc[page_num - 1]
+            pw = float(p.rect.width or 0)
+            ph = float(p.rect.height or 0)
+            if pw <= 0 or ph <= 0:
+                continue
+            q_markers = [
+                m
+                for m in _extract_markers_from_lines(
+                    _extract_text_lines(p, left_limit_ratio=0.28), page_num=page_num, page_h=ph, page_w=pw
+                )
+                if m.kind == "Q" and str(m.val or "").isdigit()
+            ]
+            for qid in qids:
+                _, bbox = first_boxes[qid]
+                y0, y1 = float(bbox[1]), float(bbox[3])
+                # 题号一般就在框的顶部（框选时会留一点边距）
+                inside = [m for m in q_markers if y0 - 0.02 <= m.y <= y1]
+                if inside:
+                    out[qid] = str(min(inside, key=lambda m: abs(m.y - y0)).val)
+    finally:
+        doc.close()
+    return out
@@ -12,6 +12,7 @@ if __package__ is None or __package__ == "":
         sys.path.insert(0, str(_ROOT))
 
 from backend.database import Answer, AnswerBox, Paper, Question, QuestionBox, SectionDef, SessionLocal
+from backend.services.question_text import clear_question_text
 
 
 def _safe_unlink(p: Path) -> None:
@@ -43,6 +44,7 @@ def purge_all(*, wipe_sections: bool, wipe_files: bool) -> None:
         db.query(AnswerBox).delete(synchronize_session=False)
         db.query(Answer).delete(synchronize_session=False)
         db.query(QuestionBox).delete(synchronize_session=False)
+        clear_question_text(db)
         db.query(Question).delete(synchronize_session=False)
         if wipe_sections:
             db.query(SectionDef).delete(synchronize_session=False)
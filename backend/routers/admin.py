@@ -5,6 +5,10 @@ from backend.database import SessionLocal, Paper, Question, QuestionBox, Answer,
 from backend.schemas.schemas import PurgeAllRequest
 from backend.config import PDF_DIR, PAGE_DIR
 from backend.dependencies import get_db
+from backend.services.crop_cache import crop_cache, fragment_cache
+from backend.services.facet_index import facet_index
+from backend.services import question_text
+from backend.services.page_assets import page_assets
 
 router = APIRouter(tags=["admin"])
 
@@ -14,15 +18,20 @@ def admin_purge_all(payload: PurgeAllRequest, db: Session = Depends(get_db)):
     if payload.confirm1 != "DELETE_ALL" or payload.confirm2 != "I_UNDERSTAND":
         raise HTTPException(status_code=400, detail="confirmation mismatch")
 
+    facet_index.touch_all(db)
     # DB: delete children first
     db.query(AnswerBox).delete(synchronize_session=False)
     db.query(Answer).delete(synchronize_session=False)
     db.query(QuestionBox).delete(synchronize_session=False)
+    question_text.clear_question_text(db)
     db.query(Question).delete(synchronize_session=False)
     if payload.wipe_sections:
         db.query(SectionDef).delete(synchronize_session=False)
     db.query(Paper).delete(synchronize_session=False)
     db.commit()
+    page_assets.clear()
+    crop_cache.clear()
+    fragment_cache.clear()
 
     # Files: wipe pdfs/pages
     try:
@@ -17,6 +17,7 @@ from sqlalchemy.orm import Session
 from pydantic import BaseModel
 
 from backend.database import Paper
+from backend.services.page_assets import page_assets
 from backend.dependencies import get_db
 from backend.config import PDF_DIR, PAGE_DIR, MAX_UPLOAD_BYTES
 from backend.services.paper_utils import (
@@ -233,6 +234,7 @@ async def import_from_url(request: ImportRequest, db: Session = Depends(get_db))
         paper.pdf_path = str(pdf_path)
         paper.pages_dir = str(page_output_dir)
         paper.page_count = int(rendered_pages)
+        page_assets.mark_rendered(paper, rendered_pages)
         
         # Detect if it's answer paper
         detected = detect_is_answer_by_pdf_text(pdf_path)
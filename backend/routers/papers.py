@@ -9,7 +9,7 @@ from sqlalchemy import func
 
 from backend.database import Paper, Question, Answer, QuestionBox, AnswerBox, SectionDef
 from backend.dependencies import get_db
-from backend.schemas.schemas import AutoSuggestRequest, PaperUpdate
+from backend.schemas.schemas import AnswerSuggestRequest, AnswerUpsert, AutoSuggestRequest, PaperUpdate
 from backend.config import PDF_DIR, PAGE_DIR, MAX_UPLOAD_BYTES
 from backend.utils import _with_cache_bust, _file_mtime_token
 from backend.services.paper_utils import (
@@ -24,6 +24,11 @@ from backend.services.paper_utils import (
     extract_year_from_filename
 )
 from backend.auto_suggest import suggest_question_boxes_from_pdf
+from backend.ms_suggest import question_labels_from_qp, suggest_answer_boxes_from_ms
+from backend.services.facet_index import facet_index
+from backend.services import question_text
+from backend.services.page_assets import page_assets, page_image_url
+from backend.routers.questions import _upsert_answer_rows
 
 router = APIRouter()
 
@@ -95,6 +100,7 @@ def upload_pdf(
     paper.pdf_path = str(pdf_path)
     paper.pages_dir = str(page_output_dir)
     paper.page_count = int(rendered_pages)
+    page_assets.mark_rendered(paper, rendered_pages)
 
     # Heuristic correction
     detected = detect_is_answer_by_pdf_text(pdf_path)
@@ -190,6 +196,7 @@ def upload_pdfs(
         paper.pdf_path = str(pdf_path)
         paper.pages_dir = str(page_output_dir)
         paper.page_count = int(rendered_pages)
+        page_assets.mark_rendered(paper, rendered_pages)
 
         detected = detect_is_answer_by_pdf_text(pdf_path)
         if detected is not None and bool(paper.is_answer) != bool(detected):
@@ -371,6 +378,97 @@ def manual_auto_suggest(paper_id: int, req: AutoSuggestRequest, db: Session = De
     }
 
 
+@router.post("/papers/{paper_id}/answer_suggest")
+def answer_suggest_from_ms(paper_id: int, req: AnswerSuggestRequest, db: Session = Depends(get_db)):
+    """Propose answer boxes on the paired MS for every question of a QP (optionally save them)."""
+
+    paper = db.query(Paper).filter(Paper.id == int(paper_id)).one_or_none()
+    if paper is None:
+        raise HTTPException(status_code=404, detail="paper not found")
+    if bool(paper.is_answer):
+        raise HTTPException(status_code=400, detail="pass the question paper id, not the answer paper")
+    ms_id = int(req.ms_paper_id or paper.paired_paper_id or 0)
+    ms = db.query(Paper).filter(Paper.id == ms_id).one_or_none() if ms_id else None
+    if ms is None:
+        raise HTTPException(status_code=400, detail="paper has no paired ms paper")
+
+    qp_pdf = Path(str(paper.pdf_path or "")).resolve() if paper.pdf_path else None
+    ms_pdf = Path(str(ms.pdf_path or "")).resolve() if ms.pdf_path else None
+    if qp_pdf is None or not qp_pdf.exists() or ms_pdf is None or not ms_pdf.exists():
+        raise HTTPException(status_code=400, detail="paper has no readable pdf_path")
+    ms_pages_path = PAGE_DIR / f"paper_{ms.id}"
+
+    first_boxes: dict[int, tuple[int, list]] = {}
+    for qid, page, bbox in (
+        db.query(QuestionBox.question_id, QuestionBox.page, QuestionBox.bbox)
+        .filter(QuestionBox.paper_id == int(paper_id))
+        .order_by(QuestionBox.question_id, QuestionBox.page, QuestionBox.id)
+        .all()
+    ):
+        first_boxes.setdefault(int(qid), (int(page), bbox))
+    questions = (
+        db.query(Question)
+        .filter(Question.paper_id == int(paper_id), Question.id.in_(list(first_boxes) or [-1]))
+        .all()
+    )
+    questions.sort(key=lambda q: (first_boxes[q.id][0], float(first_boxes[q.id][1][1])))
+
+    labels = question_labels_from_qp(qp_pdf, first_boxes)
+    ms_boxes, warn = suggest_answer_boxes_from_ms(ms_pdf, int(ms.page_count or 0))
+    answered = {
+        int(qid): int(ms_pid)
+        for qid, ms_pid in db.query(Answer.question_id, Answer.ms_paper_id)
+        .filter(Answer.question_id.in_([q.id for q in questions] or [-1]))
+        .all()
+    }
+
+    suggestions: list[dict] = []
+    applied: list[int] = []
+    for q in questions:
+        label = labels.get(q.id)
+        boxes = [
+            b for b in (ms_boxes.get(label) or [])
+            if (ms_pages_path / f"page_{b['page']}.png").exists()
+        ] if label else []
+        item = {
+            "question_id": q.id,
+            "question_no": q.question_no,
+            "label": label,
+            "boxes": boxes,
+            "has_answer": q.id in answered,
+            "applied": False,
+        }
+        if req.apply and boxes and (q.id not in answered or req.overwrite):
+            # 与手动保存答案走同一条路径：校验、按框 diff、刷新题目文字
+            a = db.query(Answer).filter(Answer.question_id == q.id).one_or_none()
+            payload = AnswerUpsert(
+                ms_paper_id=ms.id,
+                notes=a.notes if a is not None else None,
+                boxes=[{"page": b["page"], "bbox": b["bbox"]} for b in boxes],
+            )
+            try:
+                _, _, changed = _upsert_answer_rows(db, q.id, payload, a)
+            except HTTPException as e:
+                item["error"] = str(e.detail)
+            else:
+                item["applied"] = True
+                if changed:
+                    applied.append(q.id)
+        suggestions.append(item)
+
+    if applied:
+        db.commit()
+
+    return {
+        "paper_id": int(paper_id),
+        "ms_paper_id": ms.id,
+        "suggestions": suggestions,
+        "matched": sum(1 for it in suggestions if it["boxes"]),
+        "applied": sum(1 for it in suggestions if it["applied"]),
+        "warning": warn,
+    }
+
+
 @router.get("/answer_papers")
 def list_answer_papers(db: Session = Depends(get_db)):
     papers = db.query(Paper).filter(Paper.is_answer == True).order_by(Paper.id.desc()).all()
@@ -477,6 +575,7 @@ def update_paper(paper_id: int, payload: PaperUpdate, db: Session = Depends(get_
     if "exam_code" in data:
         paper.exam_code = data["exam_code"]
         _set_paper_tokens(paper)
+        facet_index.touch_papers(db, [paper.id])
     if "done" in data and data["done"] is not None:
         paper.done = bool(data["done"])
 
@@ -503,6 +602,7 @@ def delete_paper(paper_id: int, db: Session = Depends(get_db)):
         paper = db.query(Paper).filter(Paper.id == pid).one_or_none()
         if paper is None:
             return
+        facet_index.touch_papers(db, [pid])
 
         # answers linked to this paper (as ms)
         ans_ms = db.query(Answer).filter(Answer.ms_paper_id == pid).all()
@@ -510,6 +610,7 @@ def delete_paper(paper_id: int, db: Session = Depends(get_db)):
             ans_ids = [a.id for a in ans_ms]
             db.query(AnswerBox).filter(AnswerBox.answer_id.in_(ans_ids)).delete(synchronize_session=False)
             db.query(Answer).filter(Answer.id.in_(ans_ids)).delete(synchronize_session=False)
+            question_text.refresh_question_text(db, [a.question_id for a in ans_ms])
 
         # answers linked to questions in this paper (as qp)
         q_ids = [qid for (qid,) in db.query(Question.id).filter(Question.paper_id == pid).all()]
@@ -521,9 +622,11 @@ def delete_paper(paper_id: int, db: Session = Depends(get_db)):
                 db.query(Answer).filter(Answer.id.in_(aq_ids)).delete(synchronize_session=False)
 
         db.query(QuestionBox).filter(QuestionBox.paper_id == pid).delete(synchronize_session=False)
+        question_text.delete_question_text(db, q_ids)
         db.query(Question).filter(Question.paper_id == pid).delete(synchronize_session=False)
         db.delete(paper)
         db.commit()
+        page_assets.forget(pid)
 
         pdf_path = PDF_DIR / f"paper_{pid}.pdf"
         pages_dir = PAGE_DIR / f"paper_{pid}"
@@ -559,6 +662,12 @@ def delete_paper(paper_id: int, db: Session = Depends(get_db)):
 
 @router.get("/papers/{paper_id}/pages")
 def list_pages(paper_id: int):
+    page_count = page_assets.page_count(paper_id)
+    if page_count:
+        # 渲染时已记录页数和版本号，不用扫目录
+        pages = [{"page": n, "image_url": page_image_url(paper_id, n)} for n in range(1, page_count + 1)]
+        return {"paper_id": paper_id, "pages": pages}
+
     pages_path = PAGE_DIR / f"paper_{paper_id}"
     if not pages_path.exists():
         raise HTTPException(status_code=404, detail="pages not found")
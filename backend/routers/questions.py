@@ -1,6 +1,10 @@
+import hashlib
+import json
 import re
+from pathlib import Path
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy import or_, func
+from pydantic import ValidationError
+from sqlalchemy import Integer, String, and_, case, cast, delete, func, insert, literal, or_, select, union, union_all, update
 from sqlalchemy.orm import Session
 from backend.database import Question, QuestionBox, Paper, Answer, AnswerBox, QuestionSection
 from backend.schemas.schemas import (
@@ -9,11 +13,20 @@ from backend.schemas.schemas import (
     QuestionBoxesReplace,
     AnswerUpsert,
     QuestionSearchRequest,
+    QuestionPositionRequest,
     QuestionsBatchUpdate,
+    SectionSuggestRequest,
+    MutationBatch,
 )
 from backend.dependencies import get_db
 from backend.config import PAGE_DIR
-from backend.utils import _with_cache_bust, _file_mtime_token
+from backend.services.search_cache import search_cache, data_generation
+from backend.services.facet_index import facet_index
+from backend.services import question_text
+from backend.services.similarity import similarity_index
+from backend.services.section_suggest import suggest_sections
+from backend.services.question_hash import question_hash_index
+from backend.services.page_assets import page_image_url
 
 router = APIRouter(tags=["questions"])
 
@@ -43,17 +56,65 @@ def _extract_year_season(source: str) -> tuple[str | None, str | None]:
         return None, None
     return m.group(2), m.group(1).lower()
 
+def _boxes_version(boxes) -> str:
+    """Content hash of (page, bbox) pairs in read order (page, then id/payload order)."""
+    pairs = sorted(([int(page), [float(v) for v in bbox]] for page, bbox in boxes), key=lambda p: p[0])
+    return hashlib.sha1(json.dumps(pairs, separators=(",", ":")).encode()).hexdigest()[:16]
+
+
+def _sync_box_rows(db: Session, existing: list, incoming, pages_path: Path, new_row) -> tuple[list, bool]:
+    """Diff incoming boxes against stored rows in place; returns (rows in read order, changed).
+
+    Incoming boxes are sorted by page (stable) and paired position-wise with the
+    stored rows (ordered by page, id): row i is UPDATEd only if it differs, extra
+    boxes are INSERTed and leftover rows DELETEd. Row ids therefore stay in read
+    order, and nudging one box costs a single UPDATE.
+    """
+    rows: list = []
+    changed = False
+    for i, box in enumerate(sorted(incoming, key=lambda b: int(b.page))):
+        bbox = [float(v) for v in box.bbox]
+        img = str(pages_path / f"page_{box.page}.png")
+        if i < len(existing):
+            r = existing[i]
+            if int(r.page) != int(box.page) or [float(v) for v in (r.bbox or [])] != bbox or r.image_path != img:
+                r.page, r.bbox, r.image_path = int(box.page), bbox, img
+                changed = True
+        else:
+            r = new_row(int(box.page), bbox, img)
+            db.add(r)
+            changed = True
+        rows.append(r)
+    for r in existing[len(rows):]:
+        db.delete(r)
+        changed = True
+    if changed:
+        db.flush()
+    return rows, changed
+
+
+def _validate_boxes(boxes, pages_path: Path, label: str = "page") -> None:
+    for box in boxes:
+        if len(box.bbox) != 4:
+            raise HTTPException(status_code=400, detail="bbox must be 4 floats")
+        if not (pages_path / f"page_{box.page}.png").exists():
+            raise HTTPException(status_code=400, detail=f"{label} image missing: {box.page}")
+
+
 def _question_to_dict(
     q: Question,
     boxes: list[QuestionBox],
     db: Session = None,
     sections_override: list[str] | None = None,
 ) -> dict:
-    # 获取多个分类
-    sections = list(sections_override or [])
-    if (not sections) and db:
+    # 获取多个分类：列表接口会预先批量查好（空列表也算查过），单条接口才在这里查
+    if sections_override is not None:
+        sections = list(sections_override)
+    elif db is not None:
         section_rows = db.query(QuestionSection).filter(QuestionSection.question_id == q.id).all()
         sections = [s.section_name for s in section_rows]
+    else:
+        sections = []
     
     # 向后兼容：如果没有 sections 但有老的 section 字段，使用老字段
     if not sections and q.section:
@@ -69,15 +130,13 @@ def _question_to_dict(
         "notes": q.notes,
         "is_favorite": bool(getattr(q, "is_favorite", False)),
         "updated_at": q.updated_at,
+        "boxes_version": _boxes_version((b.page, b.bbox) for b in boxes),
         "boxes": [
             {
                 "id": b.id,
                 "page": b.page,
                 "bbox": b.bbox,
-                "image_url": _with_cache_bust(
-                    f"/data/pages/paper_{q.paper_id}/page_{b.page}.png",
-                    _file_mtime_token(PAGE_DIR / f"paper_{q.paper_id}" / f"page_{b.page}.png"),
-                ),
+                "image_url": page_image_url(q.paper_id, b.page),
             }
             for b in boxes
         ],
@@ -90,22 +149,84 @@ def _answer_to_dict(a: Answer, boxes: list[AnswerBox]) -> dict:
         "ms_paper_id": a.ms_paper_id,
         "notes": a.notes,
         "updated_at": a.updated_at,
+        "boxes_version": _boxes_version((b.page, b.bbox) for b in boxes),
         "boxes": [
             {
                 "id": b.id,
                 "page": b.page,
                 "bbox": b.bbox,
-                "image_url": _with_cache_bust(
-                    f"/data/pages/paper_{a.ms_paper_id}/page_{b.page}.png",
-                    _file_mtime_token(PAGE_DIR / f"paper_{a.ms_paper_id}" / f"page_{b.page}.png"),
-                ),
+                "image_url": page_image_url(a.ms_paper_id, b.page),
             }
             for b in boxes
         ],
     }
 
-@router.post("/papers/{paper_id}/questions")
-def create_question(paper_id: int, payload: QuestionCreate, db: Session = Depends(get_db)):
+def _prefetch_question_rows(
+    db: Session, qids: list[int], *, page: int | None = None
+) -> tuple[dict[int, list[QuestionBox]], dict[int, list[str]]]:
+    """Boxes and sections for `qids` in two queries; every qid gets an entry (possibly empty).
+
+    Pass the results to `_question_to_dict(..., sections_override=...)` so that
+    serialising a list never queries per question.
+    """
+    boxes_by_qid: dict[int, list[QuestionBox]] = {qid: [] for qid in qids}
+    sections_by_qid: dict[int, list[str]] = {qid: [] for qid in qids}
+    if not qids:
+        return boxes_by_qid, sections_by_qid
+    box_query = db.query(QuestionBox).filter(QuestionBox.question_id.in_(qids))
+    if page is not None:
+        box_query = box_query.filter(QuestionBox.page == page)
+    for b in box_query.order_by(QuestionBox.question_id.asc(), QuestionBox.page.asc(), QuestionBox.id.asc()).all():
+        boxes_by_qid.setdefault(int(b.question_id), []).append(b)
+    for qid, section_name in (
+        db.query(QuestionSection.question_id, QuestionSection.section_name)
+        .filter(QuestionSection.question_id.in_(qids))
+        .all()
+    ):
+        sections_by_qid.setdefault(int(qid), []).append(section_name)
+    return boxes_by_qid, sections_by_qid
+
+
+def _prefetch_answer_dicts(db: Session, qids) -> dict[int, dict]:
+    """question id -> answer dict for the questions in `qids` that have one (two queries)."""
+    qids = list(qids)
+    if not qids:
+        return {}
+    answers = db.query(Answer).filter(Answer.question_id.in_(qids)).all()
+    boxes_by_aid: dict[int, list[AnswerBox]] = {int(a.id): [] for a in answers}
+    if answers:
+        for b in (
+            db.query(AnswerBox)
+            .filter(AnswerBox.answer_id.in_(list(boxes_by_aid)))
+            .order_by(AnswerBox.answer_id.asc(), AnswerBox.page.asc(), AnswerBox.id.asc())
+            .all()
+        ):
+            boxes_by_aid[int(b.answer_id)].append(b)
+    return {int(a.question_id): _answer_to_dict(a, boxes_by_aid[int(a.id)]) for a in answers}
+
+
+def _duplicate_meta(db: Session, hits: list[tuple[int, int]]) -> list[dict]:
+    """(question id, hash distance) -> small dicts for "possible duplicate" hints."""
+    if not hits:
+        return []
+    meta = {
+        int(qid): (qno, pid, exam_code or filename)
+        for qid, qno, pid, exam_code, filename in (
+            db.query(Question.id, Question.question_no, Paper.id, Paper.exam_code, Paper.filename)
+            .join(Paper, Question.paper_id == Paper.id)
+            .filter(Question.id.in_([qid for qid, _ in hits]))
+            .all()
+        )
+    }
+    return [
+        {"id": qid, "question_no": meta[qid][0], "paper_id": meta[qid][1], "paper": meta[qid][2], "distance": d}
+        for qid, d in hits
+        if qid in meta
+    ]
+
+
+def _create_question_rows(db: Session, paper_id: int, payload: QuestionCreate) -> tuple[Question, list[QuestionBox]]:
+    """Insert a question with its sections and boxes (flushed, not committed)."""
     if payload.status not in {"draft", "confirmed"}:
         raise HTTPException(status_code=400, detail="invalid status")
     if not payload.boxes:
@@ -118,6 +239,7 @@ def create_question(paper_id: int, payload: QuestionCreate, db: Session = Depend
     paper = db.query(Paper).filter(Paper.id == paper_id).one_or_none()
     if paper is None:
         raise HTTPException(status_code=404, detail="paper not found")
+    _validate_boxes(payload.boxes, pages_path)
 
     # Auto-assign global numeric question_no
     rows = db.query(Question.question_no).filter(Question.question_no.isnot(None)).all()
@@ -148,44 +270,34 @@ def create_question(paper_id: int, payload: QuestionCreate, db: Session = Depend
         notes=payload.notes,
     )
     db.add(q)
-    db.commit()
-    db.refresh(q)
+    db.flush()
+    facet_index.touch_questions(db, [q.id])
 
     # 保存多个分类
     for section_name in sections_to_save:
-        qs = QuestionSection(question_id=q.id, section_name=section_name)
-        db.add(qs)
-    db.commit()
+        db.add(QuestionSection(question_id=q.id, section_name=section_name))
 
-    box_rows: list[QuestionBox] = []
-    for box in payload.boxes:
-        if len(box.bbox) != 4:
-            raise HTTPException(status_code=400, detail="bbox must be 4 floats")
-        img_path = pages_path / f"page_{box.page}.png"
-        if not img_path.exists():
-            raise HTTPException(status_code=400, detail=f"page image missing: {box.page}")
-        br = QuestionBox(
-            question_id=q.id,
-            paper_id=paper_id,
-            page=box.page,
-            bbox=box.bbox,
-            image_path=str(img_path),
-        )
-        db.add(br)
-        box_rows.append(br)
+    box_rows, _ = _sync_box_rows(
+        db,
+        [],
+        payload.boxes,
+        pages_path,
+        lambda page, bbox, img: QuestionBox(question_id=q.id, paper_id=paper_id, page=page, bbox=bbox, image_path=img),
+    )
+    question_text.refresh_question_text(db, [q.id])
+    return q, box_rows
 
-    db.commit()
-    for br in box_rows:
-        db.refresh(br)
 
+@router.post("/papers/{paper_id}/questions")
+def create_question(paper_id: int, payload: QuestionCreate, db: Session = Depends(get_db)):
+    q, box_rows = _create_question_rows(db, paper_id, payload)
+    db.commit()
+    # 截图哈希由后台 worker 在提交后计算，前端随后查 /questions/{id}/possible_duplicates
     return {"question": _question_to_dict(q, box_rows, db)}
 
-@router.patch("/questions/{question_id}")
-def update_question(question_id: int, payload: QuestionUpdate, db: Session = Depends(get_db)):
-    q = db.query(Question).filter(Question.id == question_id).one_or_none()
-    if q is None:
-        raise HTTPException(status_code=404, detail="question not found")
-    data = payload.model_dump(exclude_unset=True)
+def _apply_question_update(db: Session, q: Question, data: dict) -> None:
+    """Apply QuestionUpdate fields (exclude_unset dump) to q; no commit."""
+    facet_index.touch_questions(db, [q.id])
     if "status" in data and data["status"] is not None:
         if data["status"] not in {"draft", "confirmed"}:
             raise HTTPException(status_code=400, detail="invalid status")
@@ -223,6 +335,14 @@ def update_question(question_id: int, payload: QuestionUpdate, db: Session = Dep
     if "is_favorite" in data and data["is_favorite"] is not None:
         q.is_favorite = bool(data["is_favorite"])
     db.add(q)
+
+
+@router.patch("/questions/{question_id}")
+def update_question(question_id: int, payload: QuestionUpdate, db: Session = Depends(get_db)):
+    q = db.query(Question).filter(Question.id == question_id).one_or_none()
+    if q is None:
+        raise HTTPException(status_code=404, detail="question not found")
+    _apply_question_update(db, q, payload.model_dump(exclude_unset=True))
     db.commit()
     db.refresh(q)
     boxes = db.query(QuestionBox).filter(QuestionBox.question_id == q.id).order_by(QuestionBox.page.asc(), QuestionBox.id.asc()).all()
@@ -231,35 +351,46 @@ def update_question(question_id: int, payload: QuestionUpdate, db: Session = Dep
 
 @router.post("/questions/batch_update")
 def batch_update_questions(payload: QuestionsBatchUpdate, db: Session = Depends(get_db)):
-    ids = [int(x) for x in payload.ids if int(x) > 0]
+    ids = sorted({int(x) for x in payload.ids if int(x) > 0})
     if not ids:
         raise HTTPException(status_code=400, detail="ids required")
 
-    rows = db.query(Question).filter(Question.id.in_(ids)).all()
-    found_ids = {int(q.id) for q in rows}
+    found_ids = set(db.execute(select(Question.id).where(Question.id.in_(ids))).scalars())
     missing = [x for x in ids if x not in found_ids]
     if missing:
         raise HTTPException(status_code=404, detail=f"questions not found: {missing[:5]}")
 
-    sections_to_save = None
+    facet_index.touch_questions(db, found_ids)
+
+    # 集合操作：一条 DELETE + 一次 executemany INSERT + 一条 UPDATE，不逐行走 ORM
+    values: dict = {}
+    sections_deleted = sections_inserted = 0
     if payload.sections is not None:
         sections_to_save = list(dict.fromkeys([s.strip() for s in payload.sections if s and s.strip()]))
-
-    for q in rows:
-        if sections_to_save is not None:
-            db.query(QuestionSection).filter(QuestionSection.question_id == q.id).delete(synchronize_session=False)
-            for section_name in sections_to_save:
-                db.add(QuestionSection(question_id=q.id, section_name=section_name))
-            q.section = sections_to_save[0] if sections_to_save else None
-
-        if payload.notes is not None:
-            q.notes = payload.notes
-        if payload.is_favorite is not None:
-            q.is_favorite = bool(payload.is_favorite)
-        db.add(q)
+        sections_deleted = db.execute(delete(QuestionSection).where(QuestionSection.question_id.in_(ids))).rowcount or 0
+        if sections_to_save:
+            db.execute(
+                insert(QuestionSection),
+                [{"question_id": qid, "section_name": name} for qid in ids for name in sections_to_save],
+            )
+            sections_inserted = len(ids) * len(sections_to_save)
+        values["section"] = sections_to_save[0] if sections_to_save else None
+    if payload.notes is not None:
+        values["notes"] = payload.notes
+    if payload.is_favorite is not None:
+        values["is_favorite"] = bool(payload.is_favorite)
+    if values:
+        db.execute(
+            update(Question).where(Question.id.in_(ids)).values(**values).execution_options(synchronize_session=False)
+        )
 
     db.commit()
-    return {"ok": True, "updated": len(rows)}
+    return {
+        "ok": True,
+        "updated": len(found_ids),
+        "sections_deleted": int(sections_deleted),
+        "sections_inserted": sections_inserted,
+    }
 
 @router.get("/questions/{question_id}")
 def get_question(question_id: int, db: Session = Depends(get_db)):
@@ -269,67 +400,90 @@ def get_question(question_id: int, db: Session = Depends(get_db)):
     boxes = db.query(QuestionBox).filter(QuestionBox.question_id == q.id).order_by(QuestionBox.page.asc(), QuestionBox.id.asc()).all()
     return {"question": _question_to_dict(q, boxes, db)}
 
+def _replace_question_box_rows(db: Session, q: Question, boxes) -> tuple[list[QuestionBox], bool]:
+    if not boxes:
+        raise HTTPException(status_code=400, detail="boxes required")
+    pages_path = PAGE_DIR / f"paper_{q.paper_id}"
+    if not pages_path.exists():
+        raise HTTPException(status_code=404, detail="pages not found")
+    _validate_boxes(boxes, pages_path)
+
+    existing = db.query(QuestionBox).filter(QuestionBox.question_id == q.id).order_by(QuestionBox.page.asc(), QuestionBox.id.asc()).all()
+    rows, changed = _sync_box_rows(
+        db,
+        existing,
+        boxes,
+        pages_path,
+        lambda page, bbox, img: QuestionBox(question_id=q.id, paper_id=q.paper_id, page=page, bbox=bbox, image_path=img),
+    )
+    if changed:
+        facet_index.touch_questions(db, [q.id])
+        question_text.refresh_question_text(db, [q.id])
+    return rows, changed
+
+
+def _question_boxes_unchanged(db: Session, question_id: int, payload: QuestionBoxesReplace) -> str | None:
+    """The stored boxes_version when the client's version matches both the stored and the sent boxes."""
+    if not payload.version:
+        return None
+    # 客户端声明“内容没变”：只比对一次哈希，不加载题目也不写库
+    stored = db.query(QuestionBox.page, QuestionBox.bbox).filter(QuestionBox.question_id == question_id).order_by(
+        QuestionBox.page.asc(), QuestionBox.id.asc()
+    ).all()
+    current = _boxes_version(stored)
+    if stored and payload.version == current == _boxes_version((b.page, b.bbox) for b in payload.boxes):
+        return current
+    return None
+
+
 @router.post("/questions/{question_id}/boxes")
 def replace_question_boxes(question_id: int, payload: QuestionBoxesReplace, db: Session = Depends(get_db)):
     if not payload.boxes:
         raise HTTPException(status_code=400, detail="boxes required")
 
+    current = _question_boxes_unchanged(db, question_id, payload)
+    if current:
+        return {"unchanged": True, "question_id": question_id, "boxes_version": current}
+
     q = db.query(Question).filter(Question.id == question_id).one_or_none()
     if q is None:
         raise HTTPException(status_code=404, detail="question not found")
 
-    pages_path = PAGE_DIR / f"paper_{q.paper_id}"
-    if not pages_path.exists():
-        raise HTTPException(status_code=404, detail="pages not found")
-
-    # replace all boxes
-    db.query(QuestionBox).filter(QuestionBox.question_id == q.id).delete(synchronize_session=False)
-    db.commit()
-
-    rows: list[QuestionBox] = []
-    for box in payload.boxes:
-        if len(box.bbox) != 4:
-            raise HTTPException(status_code=400, detail="bbox must be 4 floats")
-        img_path = pages_path / f"page_{box.page}.png"
-        if not img_path.exists():
-            raise HTTPException(status_code=400, detail=f"page image missing: {box.page}")
-        br = QuestionBox(
-            question_id=q.id,
-            paper_id=q.paper_id,
-            page=box.page,
-            bbox=box.bbox,
-            image_path=str(img_path),
-        )
-        db.add(br)
-        rows.append(br)
-
-    db.commit()
-    for r in rows:
-        db.refresh(r)
-    return {"question": _question_to_dict(q, rows, db)}
+    rows, changed = _replace_question_box_rows(db, q, payload.boxes)
+    if changed:
+        db.commit()
+    return {"question": _question_to_dict(q, rows, db), "unchanged": not changed}
 
 @router.delete("/question_boxes/{box_id}")
 def delete_question_box(box_id: int, db: Session = Depends(get_db)):
     b = db.query(QuestionBox).filter(QuestionBox.id == box_id).one_or_none()
     if b is None:
         raise HTTPException(status_code=404, detail="box not found")
+    facet_index.touch_questions(db, [b.question_id])
     db.delete(b)
+    question_text.refresh_question_text(db, [b.question_id])
     db.commit()
     return {"ok": True}
 
-@router.delete("/questions/{question_id}")
-def delete_question(question_id: int, db: Session = Depends(get_db)):
-    q = db.query(Question).filter(Question.id == question_id).one_or_none()
-    if q is None:
-        raise HTTPException(status_code=404, detail="question not found")
-
+def _delete_question_rows(db: Session, q: Question) -> None:
+    facet_index.touch_questions(db, [q.id])
     a = db.query(Answer).filter(Answer.question_id == q.id).one_or_none()
     if a is not None:
         db.query(AnswerBox).filter(AnswerBox.answer_id == a.id).delete(synchronize_session=False)
         db.delete(a)
 
     db.query(QuestionBox).filter(QuestionBox.question_id == q.id).delete(synchronize_session=False)
+    question_text.delete_question_text(db, [q.id])
     db.delete(q)
+
+
+@router.delete("/questions/{question_id}")
+def delete_question(question_id: int, db: Session = Depends(get_db)):
+    q = db.query(Question).filter(Question.id == question_id).one_or_none()
+    if q is None:
+        raise HTTPException(status_code=404, detail="question not found")
+
+    _delete_question_rows(db, q)
     db.commit()
     return {"ok": True}
 
@@ -354,45 +508,48 @@ def list_questions_for_paper(paper_id: int, section: str | None = None, status:
     qs = q.order_by(Question.id.desc()).all()
 
     qids = [int(item.id) for item in qs]
-    box_query = db.query(QuestionBox).filter(QuestionBox.question_id.in_(qids)) if qids else None
-    if box_query is not None and page is not None:
-        box_query = box_query.filter(QuestionBox.page == page)
-    box_rows = (
-        box_query.order_by(QuestionBox.question_id.asc(), QuestionBox.page.asc(), QuestionBox.id.asc()).all()
-        if box_query is not None
-        else []
-    )
-    boxes_by_qid: dict[int, list[QuestionBox]] = {}
-    for b in box_rows:
-        boxes_by_qid.setdefault(int(b.question_id), []).append(b)
-
-    sections_by_qid: dict[int, list[str]] = {qid: [] for qid in qids}
-    if qids:
-        for qid, section_name in (
-            db.query(QuestionSection.question_id, QuestionSection.section_name)
-            .filter(QuestionSection.question_id.in_(qids))
-            .all()
-        ):
-            sections_by_qid.setdefault(int(qid), []).append(section_name)
+    boxes_by_qid, sections_by_qid = _prefetch_question_rows(db, qids, page=page)
 
     results = []
     for item in qs:
-        boxes = boxes_by_qid.get(int(item.id), [])
+        boxes = boxes_by_qid[int(item.id)]
         if page is not None and not boxes:
             continue
-        results.append(
-            _question_to_dict(
-                item,
-                boxes,
-                db,
-                sections_override=sections_by_qid.get(int(item.id), []),
-            )
-        )
+        results.append(_question_to_dict(item, boxes, db, sections_override=sections_by_qid[int(item.id)]))
 
     return {"paper_id": paper_id, "questions": results}
 
-def _search_questions_core(
+def _paper_year_season_map(db: Session) -> dict[int, tuple[str | None, str | None]]:
+    """paper_id -> (year, season) tokens (falls back to filename parsing for legacy rows)."""
+    out: dict[int, tuple[str | None, str | None]] = {}
+    for pid, y, s, exam_code, filename in db.query(
+        Paper.id, Paper.year_token, Paper.season_token, Paper.exam_code, Paper.filename
+    ).all():
+        if not y or not s:
+            py, ps = _extract_year_season(f"{exam_code or ''} {filename or ''}")
+            y = y or py
+            s = s or ps
+        out[int(pid)] = (y, s)
+    return out
+
+
+def _paper_ids_for_year_season(
     db: Session,
+    year_values: set[str],
+    season_values: set[str],
+) -> list[int]:
+    """Resolve year/season tokens to paper ids."""
+    ids: list[int] = []
+    for pid, (y, s) in _paper_year_season_map(db).items():
+        if year_values and y not in year_values:
+            continue
+        if season_values and s not in season_values:
+            continue
+        ids.append(pid)
+    return ids
+
+
+def _normalize_search_filters(
     *,
     section: str | None = None,
     status: str | None = None,
@@ -406,15 +563,9 @@ def _search_questions_core(
     favorite: bool | None = None,
     unsectioned: bool | None = None,
     exclude_multi_section: bool | None = None,
-    page: int = 1,
-    page_size: int = 10,
-    ids_only: bool = False,
-):
-    page = max(1, int(page or 1))
-    max_page_size = 2000 if ids_only else 200
-    page_size = max(1, min(max_page_size, int(page_size or 10)))
-
-    q = db.query(Question, Paper).join(Paper, Question.paper_id == Paper.id)
+    q: str | None = None,
+) -> dict:
+    """Canonical form of the Filter view conditions (also used as the search cache key)."""
     paper_id_values: set[int] = set()
     if paper_id is not None:
         paper_id_values.add(int(paper_id))
@@ -423,147 +574,219 @@ def _search_questions_core(
             paper_id_values.add(int(pid))
         except Exception:
             continue
-    if paper_id_values:
-        q = q.filter(Question.paper_id.in_(sorted(paper_id_values)))
-    if question_no is not None:
-        qno = str(question_no).strip()
-        if qno:
-            q = q.filter(Question.question_no == qno)
-
-    if section is not None and section != "":
-        section_qids = [
-            x[0]
-            for x in db.query(QuestionSection.question_id)
-            .filter(QuestionSection.section_name == section)
-            .all()
-        ]
-        if section_qids:
-            q = q.filter(or_(Question.id.in_(section_qids), Question.section == section))
-        else:
-            q = q.filter(Question.section == section)
-
-    if unsectioned is True:
-        has_sections_ids = [x[0] for x in db.query(QuestionSection.question_id).distinct().all()]
-        if has_sections_ids:
-            q = q.filter(~Question.id.in_(has_sections_ids))
-        q = q.filter(or_(Question.section.is_(None), Question.section == ""))
-        q = q.filter(db.query(QuestionBox.id).filter(QuestionBox.question_id == Question.id).exists())
-
-    if status is not None and status != "":
-        q = q.filter(Question.status == status)
-    if favorite is True:
-        q = q.filter(Question.is_favorite == True)
 
     year_values: set[str] = set()
-    if year:
-        norm = _normalize_year_token(year)
-        if norm:
-            year_values.add(norm)
-    for token in (years or []):
-        norm = _normalize_year_token(token)
+    for token in [year, *(years or [])]:
+        norm = _normalize_year_token(token) if token else None
         if norm:
             year_values.add(norm)
 
     season_values: set[str] = set()
-    if season:
-        sv = str(season).strip().lower()
-        if sv:
-            season_values.add(sv)
-    for token in (seasons or []):
-        sv = str(token).strip().lower()
+    for token in [season, *(seasons or [])]:
+        sv = str(token or "").strip().lower()
         if sv:
             season_values.add(sv)
 
-    rows = q.order_by(Question.id.desc()).all()
-    entries = []
-    for qq, pp in rows:
-        if year_values or season_values:
-            y = getattr(pp, "year_token", None)
-            s = getattr(pp, "season_token", None)
-            if not y or not s:
-                source = (pp.exam_code or "") + " " + (pp.filename or "")
-                py, ps = _extract_year_season(source)
-                y = y or py
-                s = s or ps
-            if year_values and y not in year_values:
-                continue
-            if season_values and s not in season_values:
-                continue
+    qno = str(question_no).strip() if question_no is not None else ""
+    return {
+        "section": section if section else None,
+        "status": status if status else None,
+        "paper_ids": tuple(sorted(paper_id_values)),
+        "question_no": qno or None,
+        "years": tuple(sorted(year_values)),
+        "seasons": tuple(sorted(season_values)),
+        "favorite": favorite is True,
+        "unsectioned": unsectioned is True,
+        "exclude_multi_section": exclude_multi_section is True,
+        "q": question_text.match_expression(q),
+    }
 
-        if exclude_multi_section is True:
-            section_count = (
-                db.query(QuestionSection)
-                .filter(QuestionSection.question_id == qq.id)
-                .count()
-            )
-            if section_count > 1:
-                continue
 
-        entries.append((qq, pp))
+def _search_cache_key(filters: dict) -> tuple:
+    return tuple(sorted(filters.items()))
 
-    def sort_key(pair: tuple[Question, Paper]):
-        qrow = pair[0]
-        qno = qrow.question_no
-        qid = int(qrow.id or 0)
-        if qno is not None:
-            s = str(qno).strip()
-            if s.isdigit():
-                return (0, -int(s), -qid)
-        return (1, 0, -qid)
 
-    entries.sort(key=sort_key)
-    total = len(entries)
+def _apply_search_filters(db: Session, q, filters: dict):
+    """Apply normalized Filter view conditions to a query over Question, entirely in SQL."""
+    if filters["paper_ids"]:
+        q = q.filter(Question.paper_id.in_(filters["paper_ids"]))
+    if filters["question_no"]:
+        q = q.filter(Question.question_no == filters["question_no"])
+
+    section = filters["section"]
+    if section:
+        # 新旧数据同时兼容：优先关联表，同时保留老字段命中
+        section_qids = select(QuestionSection.question_id).where(QuestionSection.section_name == section)
+        q = q.filter(or_(Question.id.in_(section_qids), Question.section == section))
+
+    if filters["unsectioned"]:
+        q = q.filter(~Question.id.in_(select(QuestionSection.question_id)))
+        q = q.filter(or_(Question.section.is_(None), Question.section == ""))
+        q = q.filter(db.query(QuestionBox.id).filter(QuestionBox.question_id == Question.id).exists())
+
+    if filters["status"]:
+        q = q.filter(Question.status == filters["status"])
+    if filters["favorite"]:
+        q = q.filter(Question.is_favorite == True)
+
+    if filters["years"] or filters["seasons"]:
+        paper_ids = _paper_ids_for_year_season(db, set(filters["years"]), set(filters["seasons"]))
+        q = q.filter(Question.paper_id.in_(paper_ids))
+
+    if filters["exclude_multi_section"]:
+        multi_qids = (
+            select(QuestionSection.question_id)
+            .group_by(QuestionSection.question_id)
+            .having(func.count(QuestionSection.id) > 1)
+        )
+        q = q.filter(~Question.id.in_(multi_qids))
+
+    if filters.get("q"):
+        if not question_text.fts_available(db):
+            raise HTTPException(status_code=400, detail="full-text search unavailable (SQLite without FTS5)")
+        q = q.filter(Question.id.in_(question_text.matching_ids_select(filters["q"])))
+
+    return q
+
+
+def _filtered_question_ids_query(db: Session, filters: dict):
+    return _apply_search_filters(
+        db,
+        db.query(Question.id).join(Paper, Question.paper_id == Paper.id),
+        filters,
+    )
+
+
+def _ordered_question_ids(db: Session, filters: dict, generation: int) -> tuple[int, ...]:
+    """Full ordered id list for a filter, served from the search cache when still current.
+
+    `generation` must be captured before any data is read for the request.
+    """
+    key = ("ids", _search_cache_key(filters))
+    cached = search_cache.get(key)
+    if cached is not None:
+        return cached
+    indexed = facet_index.query(filters)
+    if indexed is not None:
+        search_cache.put(key, indexed, generation)
+        return indexed
+    base = _filtered_question_ids_query(db, filters)
+    if filters.get("q"):
+        # 关键词检索：按 bm25 相关度排序，同分再按默认顺序
+        ranked = question_text.ranked_matches(filters["q"])
+        base = base.join(ranked, ranked.c.qid == Question.id).order_by(ranked.c.rank.asc(), *_question_order_clauses())
+    else:
+        base = base.order_by(*_question_order_clauses())
+    ids = tuple(int(qid) for (qid,) in base.all())
+    search_cache.put(key, ids, generation)
+    return ids
+
+
+def _question_order_clauses() -> list:
+    """Filter view ordering: numeric question_no desc first, then the rest by id desc."""
+    qno = func.trim(Question.question_no)
+    is_numeric = and_(qno != "", ~qno.op("GLOB")("*[^0-9]*"))
+    return [
+        case((is_numeric, 0), else_=1).asc(),
+        case((is_numeric, cast(qno, Integer)), else_=0).desc(),
+        Question.id.desc(),
+    ]
+
+
+def _hydrate_questions(db: Session, qids: list[int]) -> list[dict]:
+    """Question dicts (with boxes, sections and paper info) for `qids`, in the given order."""
+    if not qids:
+        return []
+    rows_by_qid: dict[int, tuple[Question, Paper]] = {}
+    for qq, pp in (
+        db.query(Question, Paper)
+        .join(Paper, Question.paper_id == Paper.id)
+        .filter(Question.id.in_(qids))
+        .all()
+    ):
+        rows_by_qid[int(qq.id)] = (qq, pp)
+    entries = [rows_by_qid[qid] for qid in qids if qid in rows_by_qid]
+    boxes_by_qid, sections_by_qid = _prefetch_question_rows(db, list(rows_by_qid))
+
+    results = []
+    for qq, pp in entries:
+        qid = int(qq.id)
+        d = _question_to_dict(qq, boxes_by_qid[qid], db, sections_override=sections_by_qid[qid])
+        d["paper"] = {"id": pp.id, "filename": pp.filename, "exam_code": pp.exam_code}
+        results.append(d)
+    return results
+
+
+def _search_questions_core(
+    db: Session,
+    *,
+    section: str | None = None,
+    status: str | None = None,
+    paper_id: int | None = None,
+    paper_ids: list[int] | None = None,
+    question_no: str | None = None,
+    year: str | None = None,
+    years: list[str] | None = None,
+    season: str | None = None,
+    seasons: list[str] | None = None,
+    favorite: bool | None = None,
+    unsectioned: bool | None = None,
+    exclude_multi_section: bool | None = None,
+    q: str | None = None,
+    page: int = 1,
+    page_size: int = 10,
+    ids_only: bool = False,
+):
+    page = max(1, int(page or 1))
+    max_page_size = 2000 if ids_only else 200
+    page_size = max(1, min(max_page_size, int(page_size or 10)))
+
+    filters = _normalize_search_filters(
+        section=section,
+        status=status,
+        paper_id=paper_id,
+        paper_ids=paper_ids,
+        question_no=question_no,
+        year=year,
+        years=years,
+        season=season,
+        seasons=seasons,
+        favorite=favorite,
+        unsectioned=unsectioned,
+        exclude_multi_section=exclude_multi_section,
+        q=q,
+    )
+    generation = data_generation()
+    ordered_ids = _ordered_question_ids(db, filters, generation)
+    total = len(ordered_ids)
     total_pages = max(1, (total + page_size - 1) // page_size)
     page = min(page, total_pages)
     start = (page - 1) * page_size
-    end = start + page_size
-    page_entries = entries[start:end]
+    page_qids = list(ordered_ids[start:start + page_size])
 
     if ids_only:
-        ids = [int(qq.id) for qq, _ in page_entries]
         return {
-            "question_ids": ids,
+            "question_ids": page_qids,
             "total": total,
             "page": page,
             "page_size": page_size,
             "total_pages": total_pages,
         }
 
-    page_qids = [int(qq.id) for qq, _ in page_entries]
-    box_rows = (
-        db.query(QuestionBox)
-        .filter(QuestionBox.question_id.in_(page_qids))
-        .order_by(QuestionBox.question_id.asc(), QuestionBox.page.asc(), QuestionBox.id.asc())
-        .all()
-        if page_qids
-        else []
-    )
-    boxes_by_qid: dict[int, list[QuestionBox]] = {}
-    for box in box_rows:
-        boxes_by_qid.setdefault(int(box.question_id), []).append(box)
-    sections_by_qid: dict[int, list[str]] = {qid: [] for qid in page_qids}
-    if page_qids:
-        for qid, section_name in (
-            db.query(QuestionSection.question_id, QuestionSection.section_name)
-            .filter(QuestionSection.question_id.in_(page_qids))
-            .all()
-        ):
-            sections_by_qid.setdefault(int(qid), []).append(section_name)
+    page_key = ("page", _search_cache_key(filters), page, page_size)
+    cached_page = search_cache.get(page_key)
+    if cached_page is not None:
+        return cached_page
 
-    results = []
-    for qq, pp in page_entries:
-        boxes = boxes_by_qid.get(int(qq.id), [])
-        d = _question_to_dict(qq, boxes, db, sections_override=sections_by_qid.get(int(qq.id), []))
-        d["paper"] = {"id": pp.id, "filename": pp.filename, "exam_code": pp.exam_code}
-        results.append(d)
-
-    return {
-        "questions": results,
+    out = {
+        "questions": _hydrate_questions(db, page_qids),
         "total": total,
         "page": page,
         "page_size": page_size,
         "total_pages": total_pages,
     }
+    search_cache.put(page_key, out, generation)
+    return out
 
 
 @router.get("/questions")
@@ -580,6 +803,7 @@ def search_questions(
     favorite: bool | None = None,
     unsectioned: bool | None = None,
     exclude_multi_section: bool | None = None,
+    q: str | None = None,
     page: int = 1,
     page_size: int = 10,
     ids_only: bool = False,
@@ -599,33 +823,326 @@ def search_questions(
         favorite=favorite,
         unsectioned=unsectioned,
         exclude_multi_section=exclude_multi_section,
+        q=q,
         page=page,
         page_size=page_size,
         ids_only=ids_only,
     )
 
 
+def _payload_filters(payload: QuestionSearchRequest) -> dict:
+    return {
+        "section": payload.section,
+        "status": payload.status,
+        "paper_id": payload.paper_id,
+        "paper_ids": payload.paper_ids or [],
+        "question_no": payload.question_no,
+        "year": payload.year,
+        "years": payload.years or [],
+        "season": payload.season,
+        "seasons": payload.seasons or [],
+        "favorite": payload.favorite,
+        "unsectioned": payload.unsectioned,
+        "exclude_multi_section": payload.exclude_multi_section,
+        "q": payload.q,
+    }
+
+
 @router.post("/questions/search")
 def search_questions_post(payload: QuestionSearchRequest, db: Session = Depends(get_db)):
     return _search_questions_core(
         db,
-        section=payload.section,
-        status=payload.status,
-        paper_id=payload.paper_id,
-        paper_ids=payload.paper_ids or [],
-        question_no=payload.question_no,
-        year=payload.year,
-        years=payload.years or [],
-        season=payload.season,
-        seasons=payload.seasons or [],
-        favorite=payload.favorite,
-        unsectioned=payload.unsectioned,
-        exclude_multi_section=payload.exclude_multi_section,
+        **_payload_filters(payload),
         page=payload.page,
         page_size=payload.page_size,
         ids_only=bool(payload.ids_only),
     )
 
+
+def _facet_counts_sql(db: Session, filters: dict) -> dict:
+    """All facet counts in one UNION ALL statement; each branch drops its own dimension."""
+
+    def ids_in(**overrides):
+        sub = _filtered_question_ids_query(db, {**filters, **overrides}).subquery()
+        return Question.id.in_(select(sub.c.id))
+
+    no_section = {"section": None, "unsectioned": False}
+    # 关联表 + 老字段合并成 (question_id, section_name)
+    names = union(
+        select(QuestionSection.question_id.label("qid"), QuestionSection.section_name.label("name")),
+        select(Question.id.label("qid"), Question.section.label("name")).where(
+            Question.section.is_not(None), Question.section != ""
+        ),
+    ).subquery()
+    section_sub = _filtered_question_ids_query(db, {**filters, **no_section}).subquery()
+
+    def per_paper(facet: str, **overrides):
+        return (
+            select(literal(facet), cast(Question.paper_id, String), func.count(Question.id))
+            .where(ids_in(**overrides))
+            .group_by(Question.paper_id)
+        )
+
+    stmt = union_all(
+        select(literal("total"), literal(None, String), func.count(Question.id)).where(ids_in()),
+        select(literal("section"), names.c.name, func.count(names.c.qid))
+        .where(names.c.qid.in_(select(section_sub.c.id)))
+        .group_by(names.c.name),
+        select(literal("unsectioned"), literal(None, String), func.count(Question.id)).where(
+            ids_in(section=None, unsectioned=True)
+        ),
+        per_paper("year", years=()),
+        per_paper("season", seasons=()),
+        per_paper("paper", paper_ids=()),
+        select(literal("favorite"), literal(None, String), func.count(Question.id)).where(
+            ids_in(favorite=True)
+        ),
+    )
+
+    tokens = _paper_year_season_map(db)
+    out = {"total": 0, "section": {}, "unsectioned": 0, "year": {}, "season": {}, "paper": {}, "favorite": 0}
+    for facet, key, count in db.execute(stmt).all():
+        count = int(count or 0)
+        if facet in ("total", "unsectioned", "favorite"):
+            out[facet] = count
+        elif facet == "section":
+            out["section"][key] = count
+        elif facet == "paper":
+            out["paper"][int(key)] = count
+        else:
+            y, s = tokens.get(int(key), (None, None))
+            token = y if facet == "year" else s
+            out[facet][token] = out[facet].get(token, 0) + count
+    return out
+
+
+@router.post("/questions/facets")
+def question_facets(payload: QuestionSearchRequest, db: Session = Depends(get_db)):
+    """Counts per section / year / season / paper / favorite for the current Filter conditions.
+
+    Each facet is counted under the filter without its own condition, so the numbers show
+    what selecting another value of that facet would give.
+    """
+    generation = data_generation()
+    filters = _normalize_search_filters(**_payload_filters(payload))
+    key = ("facets", _search_cache_key(filters))
+    cached = search_cache.get(key)
+    if cached is not None:
+        return cached
+
+    counts = facet_index.facet_counts(
+        filters, facets=("section", "unsectioned", "year", "season", "paper", "favorite")
+    )
+    source = "index"
+    if counts is None:
+        counts = _facet_counts_sql(db, filters)
+        source = "sql"
+    else:
+        counts["unsectioned"] = counts["unsectioned"].get(True, 0)
+        counts["favorite"] = counts["favorite"].get(True, 0)
+
+    def items(facet: str, label: str, reverse: bool = False) -> list[dict]:
+        values = [(k, c) for k, c in counts[facet].items() if k is not None and k != "" and c]
+        values.sort(key=lambda kv: kv[0], reverse=reverse)
+        return [{label: k, "count": int(c)} for k, c in values]
+
+    out = {
+        "total": int(counts["total"]),
+        "sections": items("section", "section"),
+        "unsectioned": int(counts["unsectioned"]),
+        "years": items("year", "year", reverse=True),
+        "seasons": items("season", "season"),
+        "papers": items("paper", "paper_id"),
+        "favorite": int(counts["favorite"]),
+        "source": source,
+    }
+    search_cache.put(key, out, generation)
+    return out
+
+
+def _question_id_for_no(db: Session, question_no: str, filters: dict, ordered_ids) -> int | None:
+    """Question with this question_no: the first one in the filtered ordering, else the newest overall."""
+    matches = db.query(Question.id).filter(Question.question_no == question_no)
+    if ordered_ids is not None:
+        wanted = {int(qid) for (qid,) in matches}
+        hit = next((qid for qid in ordered_ids if qid in wanted), None)
+    else:
+        # 题号相同时筛选顺序就是 id 倒序
+        hit = (
+            _filtered_question_ids_query(db, filters)
+            .filter(Question.question_no == question_no)
+            .order_by(Question.id.desc())
+            .limit(1)
+            .scalar()
+        )
+    if hit is None:
+        hit = matches.order_by(Question.id.desc()).limit(1).scalar()
+    return int(hit) if hit is not None else None
+
+
+@router.post("/questions/position")
+def locate_question_in_filter(payload: QuestionPositionRequest, db: Session = Depends(get_db)):
+    """Rank/page of one question inside the filtered ordering (used by Filter jump-to-question).
+
+    A target_question_no resolves to the matching question inside the filter
+    when there is one, otherwise to the newest question with that number.
+    """
+    page_size = max(1, min(200, int(payload.page_size or 10)))
+    generation = data_generation()
+
+    target_no = str(payload.target_question_no).strip() if payload.target_question_no is not None else ""
+    if payload.target_id is None and not target_no:
+        raise HTTPException(status_code=400, detail="target_id or target_question_no required")
+
+    filters = _normalize_search_filters(**_payload_filters(payload))
+    cached_ids = search_cache.get(("ids", _search_cache_key(filters)))
+    if cached_ids is None and filters["q"]:
+        # 关键词排序不是固定的 SQL 顺序，直接取完整的有序结果
+        cached_ids = _ordered_question_ids(db, filters, generation)
+
+    if payload.target_id is not None:
+        target_id = db.query(Question.id).filter(Question.id == int(payload.target_id)).scalar()
+    else:
+        target_id = _question_id_for_no(db, target_no, filters, cached_ids)
+
+    out = {
+        "question_id": int(target_id) if target_id is not None else None,
+        "in_filter": False,
+        "rank": None,
+        "index": None,
+        "page": None,
+        "page_size": page_size,
+        "prev_id": None,
+        "next_id": None,
+    }
+
+    if cached_ids is not None:
+        total = len(cached_ids)
+        try:
+            idx = cached_ids.index(int(target_id)) if target_id is not None else -1
+        except ValueError:
+            idx = -1
+        if idx >= 0:
+            out.update(
+                {
+                    "in_filter": True,
+                    "rank": idx + 1,
+                    "index": idx,
+                    "page": idx // page_size + 1,
+                    "prev_id": cached_ids[idx - 1] if idx > 0 else None,
+                    "next_id": cached_ids[idx + 1] if idx + 1 < total else None,
+                }
+            )
+        out["total"] = total
+        out["total_pages"] = max(1, (total + page_size - 1) // page_size)
+        return out
+
+    base = _filtered_question_ids_query(db, filters)
+    row = None
+    if target_id is not None:
+        order = _question_order_clauses()
+        ranked = base.with_entities(
+            Question.id.label("id"),
+            func.row_number().over(order_by=order).label("rn"),
+            func.lag(Question.id).over(order_by=order).label("prev_id"),
+            func.lead(Question.id).over(order_by=order).label("next_id"),
+            func.count().over().label("total"),
+        ).subquery()
+        row = db.query(ranked).filter(ranked.c.id == int(target_id)).one_or_none()
+
+    if row is None:
+        total = int(base.order_by(None).count())
+    else:
+        total = int(row.total or 0)
+        rank = int(row.rn)
+        out.update(
+            {
+                "in_filter": True,
+                "rank": rank,
+                "index": rank - 1,
+                "page": (rank - 1) // page_size + 1,
+                "prev_id": int(row.prev_id) if row.prev_id is not None else None,
+                "next_id": int(row.next_id) if row.next_id is not None else None,
+            }
+        )
+    out["total"] = total
+    out["total_pages"] = max(1, (total + page_size - 1) // page_size)
+    return out
+
+@router.get("/questions/{question_id}/similar")
+def similar_questions(question_id: int, k: int = 10, min_score: float = 0.0, db: Session = Depends(get_db)):
+    """Top-k questions by TF-IDF cosine over extracted question text."""
+    if db.query(Question.id).filter(Question.id == question_id).scalar() is None:
+        raise HTTPException(status_code=404, detail="question not found")
+    k = max(1, min(50, int(k or 10)))
+    hits = similarity_index.similar(question_id, k, min_score=max(0.0, float(min_score or 0.0)))
+    if hits is None:
+        # 没有文字层（扫描版）或尚未提取文字
+        return {"question_id": question_id, "indexed": False, "results": []}
+    score_by_qid = dict(hits)
+    questions = _hydrate_questions(db, [qid for qid, _ in hits])
+    return {
+        "question_id": question_id,
+        "indexed": True,
+        "results": [{"score": score_by_qid[int(d["id"])], "question": d} for d in questions],
+    }
+
+
+@router.get("/questions/{question_id}/possible_duplicates")
+def question_possible_duplicates(question_id: int, limit: int = 5, db: Session = Depends(get_db)):
+    """Questions whose crop hash is near this one's; pending=True until the worker has hashed it."""
+    if db.query(Question.id).filter(Question.id == question_id).scalar() is None:
+        raise HTTPException(status_code=404, detail="question not found")
+    hits = question_hash_index.duplicates_of(question_id)
+    if hits is None:
+        return {"question_id": question_id, "pending": True, "results": []}
+    return {
+        "question_id": question_id,
+        "pending": False,
+        "results": _duplicate_meta(db, hits[: max(1, min(50, int(limit or 5)))]),
+    }
+
+
+@router.get("/questions/{question_id}/section_suggestions")
+def question_section_suggestions(question_id: int, k: int = 3, db: Session = Depends(get_db)):
+    """Sections voted for by the question's nearest already-classified neighbours."""
+    if db.query(Question.id).filter(Question.id == question_id).scalar() is None:
+        raise HTTPException(status_code=404, detail="question not found")
+    suggestions = suggest_sections(db, [question_id], k=max(1, min(10, int(k or 3))))[question_id]
+    return {"question_id": question_id, "indexed": suggestions is not None, "suggestions": suggestions or []}
+
+
+@router.post("/questions/section_suggestions")
+def bulk_section_suggestions(payload: SectionSuggestRequest, db: Session = Depends(get_db)):
+    """Suggestions for every question matching a Filter payload (typically unsectioned + paper_id)."""
+    generation = data_generation()
+    filters = _normalize_search_filters(**_payload_filters(payload))
+    ids = _ordered_question_ids(db, filters, generation)
+    limit = max(1, min(5000, int(payload.limit or 500)))
+    qids = [int(x) for x in ids[:limit]]
+    suggestions = suggest_sections(db, qids, k=max(1, min(10, int(payload.k or 3))))
+    meta = {
+        int(qid): (qno, pid)
+        for qid, qno, pid in db.query(Question.id, Question.question_no, Question.paper_id)
+        .filter(Question.id.in_(qids))
+        .all()
+    } if qids else {}
+    return {
+        "total": len(ids),
+        "truncated": len(ids) > limit,
+        "results": [
+            {
+                "question_id": qid,
+                "question_no": meta.get(qid, (None, None))[0],
+                "paper_id": meta.get(qid, (None, None))[1],
+                "indexed": suggestions[qid] is not None,
+                "suggestions": suggestions[qid] or [],
+            }
+            for qid in qids
+        ],
+    }
+
+
 @router.get("/questions/{question_id}/answer")
 def get_answer_for_question(question_id: int, db: Session = Depends(get_db)):
     q = db.query(Question).filter(Question.id == question_id).one_or_none()
@@ -638,61 +1155,183 @@ def get_answer_for_question(question_id: int, db: Session = Depends(get_db)):
     boxes = db.query(AnswerBox).filter(AnswerBox.answer_id == a.id).order_by(AnswerBox.page.asc(), AnswerBox.id.asc()).all()
     return {"answer": _answer_to_dict(a, boxes)}
 
-@router.post("/questions/{question_id}/answer")
-def upsert_answer_for_question(question_id: int, payload: AnswerUpsert, db: Session = Depends(get_db)):
+def _upsert_answer_rows(
+    db: Session, question_id: int, payload: AnswerUpsert, a: Answer | None
+) -> tuple[Answer, list[AnswerBox], bool]:
+    """Create/update the answer and diff its boxes; no commit. `a` is the current answer row (or None)."""
     if not payload.boxes:
         raise HTTPException(status_code=400, detail="boxes required")
-
     ms_pages_path = PAGE_DIR / f"paper_{payload.ms_paper_id}"
     if not ms_pages_path.exists():
         raise HTTPException(status_code=404, detail="ms pages not found")
 
-    q = db.query(Question).filter(Question.id == question_id).one_or_none()
-    if q is None:
+    if a is None and db.query(Question.id).filter(Question.id == question_id).scalar() is None:
         raise HTTPException(status_code=404, detail="question not found")
 
     ms_paper = db.query(Paper).filter(Paper.id == payload.ms_paper_id).one_or_none()
     if ms_paper is None:
         raise HTTPException(status_code=404, detail="ms paper not found")
+    _validate_boxes(payload.boxes, ms_pages_path, "ms page")
 
-    a = db.query(Answer).filter(Answer.question_id == question_id).one_or_none()
+    changed = False
     if a is None:
         a = Answer(question_id=question_id, ms_paper_id=payload.ms_paper_id, notes=payload.notes)
         db.add(a)
-        db.commit()
-        db.refresh(a)
+        db.flush()
+        existing = []
+        changed = True
     else:
-        a.ms_paper_id = payload.ms_paper_id
-        a.notes = payload.notes
-        db.add(a)
+        if a.ms_paper_id != payload.ms_paper_id or a.notes != payload.notes:
+            a.ms_paper_id = payload.ms_paper_id
+            a.notes = payload.notes
+            changed = True
+        existing = db.query(AnswerBox).filter(AnswerBox.answer_id == a.id).order_by(AnswerBox.page.asc(), AnswerBox.id.asc()).all()
+        if any(int(b.ms_paper_id) != int(payload.ms_paper_id) for b in existing):
+            for b in existing:
+                b.ms_paper_id = payload.ms_paper_id
+            changed = True
+
+    rows, boxes_changed = _sync_box_rows(
+        db,
+        existing,
+        payload.boxes,
+        ms_pages_path,
+        lambda page, bbox, img: AnswerBox(answer_id=a.id, ms_paper_id=payload.ms_paper_id, page=page, bbox=bbox, image_path=img),
+    )
+    if changed or boxes_changed:
+        question_text.refresh_question_text(db, [question_id])
+    return a, rows, changed or boxes_changed
+
+
+def _answer_boxes_unchanged(db: Session, a: Answer | None, payload: AnswerUpsert) -> str | None:
+    """Like `_question_boxes_unchanged`, for an answer whose paper and notes are also unchanged."""
+    if not payload.version or a is None or a.ms_paper_id != payload.ms_paper_id or a.notes != payload.notes:
+        return None
+    stored = db.query(AnswerBox.page, AnswerBox.bbox).filter(AnswerBox.answer_id == a.id).order_by(
+        AnswerBox.page.asc(), AnswerBox.id.asc()
+    ).all()
+    current = _boxes_version(stored)
+    if stored and payload.version == current == _boxes_version((b.page, b.bbox) for b in payload.boxes):
+        return current
+    return None
+
+
+@router.post("/questions/{question_id}/answer")
+def upsert_answer_for_question(question_id: int, payload: AnswerUpsert, db: Session = Depends(get_db)):
+    a = db.query(Answer).filter(Answer.question_id == question_id).one_or_none()
+    current = _answer_boxes_unchanged(db, a, payload)
+    if current:
+        return {"unchanged": True, "question_id": question_id, "boxes_version": current}
+
+    a, rows, changed = _upsert_answer_rows(db, question_id, payload, a)
+    if changed:
         db.commit()
 
-    # replace all boxes
-    db.query(AnswerBox).filter(AnswerBox.answer_id == a.id).delete(synchronize_session=False)
-    db.commit()
+    return {"answer": _answer_to_dict(a, rows), "unchanged": not changed}
 
-    rows: list[AnswerBox] = []
-    for box in payload.boxes:
-        if len(box.bbox) != 4:
-            raise HTTPException(status_code=400, detail="bbox must be 4 floats")
-        img_path = ms_pages_path / f"page_{box.page}.png"
-        if not img_path.exists():
-            raise HTTPException(status_code=400, detail=f"ms page image missing: {box.page}")
-        br = AnswerBox(
-            answer_id=a.id,
-            ms_paper_id=payload.ms_paper_id,
-            page=box.page,
-            bbox=box.bbox,
-            image_path=str(img_path),
-        )
-        db.add(br)
-        rows.append(br)
+def _validate_op(model, data: dict, i: int):
+    try:
+        return model.model_validate(data or {})
+    except ValidationError as e:
+        err = (e.errors() or [{}])[0]
+        loc = ".".join(str(x) for x in err.get("loc", ()))
+        raise HTTPException(status_code=400, detail=f"op {i}: invalid data: {loc} {err.get('msg', '')}".strip())
+
+
+@router.post("/mutations")
+def apply_mutations(payload: MutationBatch, db: Session = Depends(get_db)):
+    """Apply an ordered list of question/answer edits in one transaction (all or nothing).
+
+    Ops: create (paper_id, temp_id, data=QuestionCreate), update (data=QuestionUpdate),
+    replace_boxes (data=QuestionBoxesReplace), delete, upsert_answer (data=AnswerUpsert).
+    `id` may be a temp_id from an earlier create in the same batch. replace_boxes and
+    upsert_answer honour `version` like their single-item routes: unchanged boxes are not written.
+    """
+    id_map: dict[str, int] = {}
+    touched: list[int] = []
+    deleted: set[int] = set()
+    answered: set[int] = set()
+    results: list[dict] = []
+
+    def resolve(ref, i: int) -> Question:
+        if isinstance(ref, str) and ref in id_map:
+            qid = id_map[ref]
+        else:
+            try:
+                qid = int(ref)
+            except (TypeError, ValueError):
+                raise HTTPException(status_code=400, detail=f"op {i}: unknown question id {ref!r}")
+        q = db.get(Question, qid) if qid not in deleted else None
+        if q is None:
+            raise HTTPException(status_code=404, detail=f"op {i}: question not found: {ref}")
+        return q
+
+    for i, op in enumerate(payload.ops):
+        kind = str(op.op or "").strip().lower()
+        try:
+            if kind == "create":
+                if op.paper_id is None:
+                    raise HTTPException(status_code=400, detail="paper_id required")
+                q, _ = _create_question_rows(db, int(op.paper_id), _validate_op(QuestionCreate, op.data, i))
+                if op.temp_id:
+                    id_map[str(op.temp_id)] = q.id
+                results.append({"op": kind, "id": q.id, "temp_id": op.temp_id})
+            elif kind == "update":
+                q = resolve(op.id, i)
+                data = _validate_op(QuestionUpdate, op.data, i).model_dump(exclude_unset=True)
+                _apply_question_update(db, q, data)
+                results.append({"op": kind, "id": q.id})
+            elif kind == "replace_boxes":
+                q = resolve(op.id, i)
+                data = _validate_op(QuestionBoxesReplace, op.data, i)
+                current = _question_boxes_unchanged(db, q.id, data)
+                if current:
+                    results.append({"op": kind, "id": q.id, "unchanged": True, "boxes_version": current})
+                else:
+                    _, changed = _replace_question_box_rows(db, q, data.boxes)
+                    results.append({"op": kind, "id": q.id, "unchanged": not changed})
+            elif kind == "delete":
+                q = resolve(op.id, i)
+                _delete_question_rows(db, q)
+                deleted.add(q.id)
+                results.append({"op": kind, "id": q.id})
+            elif kind == "upsert_answer":
+                q = resolve(op.id, i)
+                a = db.query(Answer).filter(Answer.question_id == q.id).one_or_none()
+                data = _validate_op(AnswerUpsert, op.data, i)
+                current = _answer_boxes_unchanged(db, a, data)
+                if current:
+                    results.append({"op": kind, "id": q.id, "unchanged": True, "boxes_version": current})
+                else:
+                    _, _, changed = _upsert_answer_rows(db, q.id, data, a)
+                    results.append({"op": kind, "id": q.id, "unchanged": not changed})
+                answered.add(q.id)
+            else:
+                raise HTTPException(status_code=400, detail=f"unknown op: {op.op}")
+        except HTTPException as e:
+            detail = str(e.detail)
+            if not detail.startswith(f"op {i}:"):
+                detail = f"op {i}: {detail}"
+            raise HTTPException(status_code=e.status_code, detail=detail)
+        # autoflush 关闭：每步都落到事务里，后面的操作才能看到前面的结果
+        db.flush()
+        if results[-1]["id"] not in touched:
+            touched.append(results[-1]["id"])
 
     db.commit()
-    for r in rows:
-        db.refresh(r)
 
-    return {"answer": _answer_to_dict(a, rows)}
+    live = [qid for qid in touched if qid not in deleted]
+    questions = {int(d["id"]): d for d in _hydrate_questions(db, live)} if live else {}
+    answers = _prefetch_answer_dicts(db, sorted(answered - deleted))
+    return {
+        "ok": True,
+        "id_map": id_map,
+        "results": results,
+        "questions": [questions[qid] for qid in live if qid in questions],
+        "answers": answers,
+        "deleted": sorted(deleted),
+    }
+
 
 @router.get("/section_stats")
 def get_section_stats(favorite_only: bool = False, db: Session = Depends(get_db)):
@@ -790,6 +1429,9 @@ def questions_integrity_check(db: Session = Depends(get_db)):
         lo, hi = unique_nums[0], unique_nums[-1]
         missing_nums = [n for n in range(lo, hi + 1) if n not in seen]
 
+    # 按哈希树 generation 缓存，树没变时不重复遍历
+    duplicate_groups = question_hash_index.duplicate_groups() if question_hash_index.ready else []
+
     return {
         "total_questions": total_questions,
         "missing_question_no": missing_question_no,
@@ -800,9 +1442,101 @@ def questions_integrity_check(db: Session = Depends(get_db)):
         "duplicate_question_no_examples": [str(r.question_no) for r in dup_rows[:10]],
         "question_no_gap_count": len(missing_nums),
         "question_no_gap_examples": missing_nums[:10],
+        "possible_duplicate_groups": len(duplicate_groups),
+        "possible_duplicate_total": sum(g["size"] for g in duplicate_groups),
     }
 
 
+@router.get("/maintenance/duplicate_questions")
+def duplicate_questions_report(max_distance: int = 6, limit: int = 200, db: Session = Depends(get_db)):
+    """Groups of visually near-identical questions (perceptual hash within max_distance bits)."""
+    max_distance = max(0, min(32, int(max_distance)))
+    groups = question_hash_index.duplicate_groups(max_distance)
+    total_groups = len(groups)
+    groups = groups[: max(1, min(2000, int(limit or 200)))]
+    for g in groups:
+        g["questions"] = _duplicate_meta(db, [(qid, None) for qid in g["question_ids"]])
+        for item in g["questions"]:
+            item.pop("distance", None)
+    return {
+        "max_distance": max_distance,
+        "count": total_groups,
+        "groups": groups,
+        "index": question_hash_index.stats(),
+    }
+
+
+@router.get("/maintenance/question_hashes")
+def question_hash_stats():
+    return question_hash_index.stats()
+
+
+@router.get("/maintenance/search_cache")
+def search_cache_stats():
+    return search_cache.stats()
+
+
+@router.post("/maintenance/search_cache/clear")
+def search_cache_clear():
+    search_cache.clear()
+    return {"ok": True, "stats": search_cache.stats()}
+
+
+@router.get("/maintenance/facet_index")
+def facet_index_stats():
+    return facet_index.stats()
+
+
+@router.post("/maintenance/facet_index/rebuild")
+def facet_index_rebuild():
+    if not facet_index.enabled:
+        raise HTTPException(status_code=400, detail="facet index disabled")
+    facet_index.rebuild()
+    search_cache.clear()
+    return {"ok": True, "stats": facet_index.stats()}
+
+
+@router.get("/maintenance/question_text")
+def question_text_stats(db: Session = Depends(get_db)):
+    return question_text.text_index_stats(db)
+
+
+@router.post("/maintenance/question_text/rebuild")
+def question_text_rebuild(full: bool = False, db: Session = Depends(get_db)):
+    """Extract text for boxed questions missing from the full-text index (or all of them with full=true)."""
+    return question_text.rebuild_question_text(db, only_missing=not full)
+
+
+@router.get("/maintenance/similarity_index")
+def similarity_index_stats():
+    return similarity_index.stats()
+
+
+@router.get("/maintenance/similar_clusters")
+def similar_question_clusters(threshold: float = 0.9, limit: int = 200, db: Session = Depends(get_db)):
+    """Near-duplicate clusters across the bank (text cosine >= threshold)."""
+    threshold = max(0.5, min(1.0, float(threshold)))
+    clusters = similarity_index.clusters(threshold, max_clusters=max(1, min(2000, int(limit or 200))))
+    all_ids = sorted({qid for c in clusters for qid in c["question_ids"]})
+    meta: dict[int, dict] = {}
+    for i in range(0, len(all_ids), 500):
+        for qid, qno, pid, exam_code, filename in (
+            db.query(Question.id, Question.question_no, Paper.id, Paper.exam_code, Paper.filename)
+            .join(Paper, Question.paper_id == Paper.id)
+            .filter(Question.id.in_(all_ids[i : i + 500]))
+            .all()
+        ):
+            meta[int(qid)] = {
+                "id": int(qid),
+                "question_no": qno,
+                "paper_id": int(pid),
+                "paper": exam_code or filename,
+            }
+    for c in clusters:
+        c["questions"] = [meta[qid] for qid in c["question_ids"] if qid in meta]
+    return {"threshold": threshold, "count": len(clusters), "clusters": clusters}
+
+
 @router.post("/maintenance/questions_repair")
 def questions_repair(payload: dict, db: Session = Depends(get_db)):
     dry_run = bool(payload.get("dry_run", True))
@@ -810,6 +1544,9 @@ def questions_repair(payload: dict, db: Session = Depends(get_db)):
     fill_missing_question_no = bool(payload.get("fill_missing_question_no", False))
     renumber_question_no_sequence = bool(payload.get("renumber_question_no_sequence", False))
 
+    if not dry_run:
+        facet_index.touch_all(db)
+
     report = {
         "dry_run": dry_run,
         "orphan_question_boxes_removed": 0,
@@ -3,6 +3,7 @@ from sqlalchemy.orm import Session
 from backend.database import SessionLocal, Question, SectionDef, SectionGroup, SectionGroupMember
 from backend.schemas.schemas import SectionDefCreate, SectionDefUpdate, SectionGroupCreate, SectionGroupUpdate
 from backend.dependencies import get_db
+from backend.services.facet_index import facet_index
 
 router = APIRouter(tags=["sections"])
 
@@ -91,6 +92,7 @@ def update_section_def(section_id: int, payload: SectionDefUpdate, db: Session =
 
     updated_questions = 0
     if renamed_to is not None and old_name and renamed_to and old_name != renamed_to:
+        facet_index.touch_all(db)
         updated_questions = (
             db.query(Question)
             .filter(Question.section == old_name)
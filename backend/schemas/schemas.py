@@ -6,6 +6,11 @@ class AutoSuggestRequest(BaseModel):
     min_height_px: int = 70
     y_padding_px: int = 12
 
+class AnswerSuggestRequest(BaseModel):
+    ms_paper_id: int | None = None  # 默认用配对的 ms 卷
+    apply: bool = False             # True：直接写入答案框（仅对还没有答案的题目）
+    overwrite: bool = False         # 与 apply 一起用：已有答案的题目也替换
+
 class PaperUpdate(BaseModel):
     exam_code: str | None = None
     done: bool | None = None
@@ -55,11 +60,13 @@ class QuestionUpdate(BaseModel):
 
 class QuestionBoxesReplace(BaseModel):
     boxes: list[BoxIn]
+    version: str | None = None  # 客户端上次拿到的 boxes_version；与本次内容一致时直接跳过
 
 class AnswerUpsert(BaseModel):
     ms_paper_id: int
     notes: str | None = None
     boxes: list[BoxIn]
+    version: str | None = None
 
 class QuestionSearchRequest(BaseModel):
     section: str | None = None
@@ -74,10 +81,29 @@ class QuestionSearchRequest(BaseModel):
     favorite: bool | None = None
     unsectioned: bool | None = None
     exclude_multi_section: bool | None = None
+    q: str | None = None  # 题目/答案文字关键词（全文检索）
     page: int = 1
     page_size: int = 10
     ids_only: bool = False
 
+class QuestionPositionRequest(QuestionSearchRequest):
+    target_id: int | None = None
+    target_question_no: str | None = None
+
+class MutationOp(BaseModel):
+    op: str  # create | update | replace_boxes | delete | upsert_answer
+    id: int | str | None = None  # 题目 id，或本批次前面 create 的 temp_id
+    temp_id: str | None = None   # create：客户端临时 id，后续操作可以引用
+    paper_id: int | None = None  # create：所属试卷
+    data: dict = Field(default_factory=dict)  # 与对应单条接口的请求体相同
+
+class MutationBatch(BaseModel):
+    ops: list[MutationOp] = Field(min_length=1, max_length=500)
+
+class SectionSuggestRequest(QuestionSearchRequest):
+    k: int = 3
+    limit: int = 500
+
 class QuestionsBatchUpdate(BaseModel):
     ids: list[int] = Field(min_length=1)
     sections: list[str] | None = None
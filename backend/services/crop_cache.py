@@ -0,0 +1,179 @@
+"""On-disk caches shared by export jobs: cropped box images and page fragments.
+
+Entries are content-addressed: the file name is a hash of everything the entry
+depends on (for a crop: source page image, its version, bbox, output variant),
+so a re-rendered page or a moved box simply misses and stale files age out.
+Total size is bounded; the least recently used files (by mtime, refreshed on
+every hit) are evicted first.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+from backend.config import DATA_DIR
+
+
+CROP_CACHE_DIR = DATA_DIR / "_crop_cache"
+FRAGMENT_CACHE_DIR = DATA_DIR / "_fragment_cache"
+DEFAULT_MAX_MB = 512
+DEFAULT_FRAGMENT_MAX_MB = 256
+PRUNE_GRACE_SECONDS = 600  # 最近用过的条目不淘汰：别的任务/进程可能刚查到它还没读
+
+
+class DiskCache:
+    def __init__(self, root: Path = CROP_CACHE_DIR, max_bytes: int = DEFAULT_MAX_MB * 1024 * 1024):
+        self.root = Path(root)
+        self.max_bytes = int(max_bytes)
+        self._lock = threading.Lock()
+        self._bytes: int | None = None  # 首次使用时扫描目录
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(*parts) -> str:
+        """Entry key: hash of JSON-serializable parts."""
+        raw = json.dumps(list(parts), separators=(",", ":"))
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    @classmethod
+    def key_for(cls, source: str, version: str | None, bbox, variant: str) -> str:
+        """Key of a cropped box image."""
+        return cls.key(str(source), str(version or ""), [round(float(v), 6) for v in bbox], str(variant))
+
+    def _path(self, key: str, ext: str) -> Path:
+        return self.root / key[:2] / f"{key}.{ext}"
+
+    def _scan(self) -> int:
+        total = 0
+        if self.root.exists():
+            for p in self.root.glob("*/*"):
+                try:
+                    total += p.stat().st_size
+                except OSError:
+                    pass
+        return total
+
+    def lookup(self, key: str, ext: str = "png") -> Path | None:
+        p = self._path(key, ext)
+        try:
+            os.utime(p)  # 命中即刷新 mtime（LRU 依据）
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return p
+
+    def read(self, key: str, ext: str = "png") -> bytes | None:
+        """Contents of an entry (refreshing its LRU time), or None on a miss.
+
+        Prefer this to `lookup` when the entry is used later: the bytes stay
+        valid even if another job or process evicts the file meanwhile.
+        """
+        p = self.lookup(key, ext)
+        if p is None:
+            return None
+        try:
+            return p.read_bytes()
+        except OSError:
+            return None
+
+    def store(self, key: str, data: bytes, ext: str = "png") -> Path:
+        """Write an entry atomically (tmp file + rename) and return its path."""
+        p = self._path(key, ext)
+        p.parent.mkdir(parents=True, exist_ok=True)
+        # 分片进程与服务进程共用缓存目录：临时文件名带上进程号和线程号
+        tmp = p.with_name(f"{p.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, p)
+        with self._lock:
+            self.stores += 1
+            if self._bytes is not None:
+                self._bytes += len(data)
+        return p
+
+    def prune(self) -> int:
+        """Evict least recently used entries until the cache fits its budget; returns files removed.
+
+        Entries used within PRUNE_GRACE_SECONDS are kept even if that leaves the cache over budget.
+        """
+        with self._lock:
+            if self._bytes is None:
+                self._bytes = self._scan()
+            if self._bytes <= self.max_bytes:
+                return 0
+            entries = []
+            for p in self.root.glob("*/*"):
+                try:
+                    st = p.stat()
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, p))
+            entries.sort()
+            total = sum(size for _, size, _ in entries)
+            # 删到预算的 90%，避免每次导出都触发淘汰
+            target = int(self.max_bytes * 0.9)
+            recent = time.time() - PRUNE_GRACE_SECONDS
+            removed = 0
+            for mtime, size, p in entries:
+                if total <= target or mtime >= recent:
+                    break
+                try:
+                    p.unlink()
+                except OSError:
+                    continue
+                total -= size
+                removed += 1
+            self._bytes = total
+            self.evictions += removed
+            return removed
+
+    def clear(self) -> int:
+        removed = 0
+        with self._lock:
+            if self.root.exists():
+                for p in self.root.glob("*/*"):
+                    try:
+                        p.unlink()
+                        removed += 1
+                    except OSError:
+                        pass
+            self._bytes = 0
+        return removed
+
+    def stats(self) -> dict:
+        with self._lock:
+            if self._bytes is None:
+                self._bytes = self._scan()
+            total = self.hits + self.misses
+            return {
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else None,
+                "stores": self.stores,
+                "evictions": self.evictions,
+            }
+
+
+def _max_bytes_from_env(name: str, default_mb: int) -> int:
+    try:
+        mb = int(os.getenv(name, str(default_mb)))
+    except ValueError:
+        mb = default_mb
+    return max(0, mb) * 1024 * 1024
+
+
+crop_cache = DiskCache(CROP_CACHE_DIR, _max_bytes_from_env("PAPER_LABELER_CROP_CACHE_MB", DEFAULT_MAX_MB))
+fragment_cache = DiskCache(
+    FRAGMENT_CACHE_DIR, _max_bytes_from_env("PAPER_LABELER_FRAGMENT_CACHE_MB", DEFAULT_FRAGMENT_MAX_MB)
+)
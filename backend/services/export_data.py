@@ -0,0 +1,150 @@
+"""Everything an export job reads from the database, loaded up front.
+
+`load_export_data` runs a handful of IN queries (chunked, so exports of any
+size stay within SQLite's bound-parameter limit) and returns plain frozen
+records. Layout and rendering then never touch the session, whatever the
+number of questions.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+
+from sqlalchemy.orm import Session
+
+from backend.database import (
+    Answer,
+    AnswerBox,
+    Paper,
+    Question,
+    QuestionBox,
+    QuestionSection,
+    SectionGroup,
+    SectionGroupMember,
+)
+
+
+IN_CHUNK = 500
+
+
+@dataclass(frozen=True)
+class ExportQuestion:
+    id: int
+    paper_id: int
+    question_no: str | None
+    section: str | None  # 旧的单分类字段，没有多分类时回退使用
+    notes: str | None
+
+
+@dataclass(frozen=True)
+class ExportBox:
+    id: int
+    paper_id: int  # 题目框是所在试卷，答案框是 ms 卷
+    page: int
+    bbox: tuple[float, float, float, float]
+    image_path: str
+
+
+@dataclass(frozen=True)
+class ExportPaper:
+    exam_code: str | None
+    filename: str | None
+    pdf_path: str | None
+
+
+@dataclass
+class ExportData:
+    questions: list[ExportQuestion]  # export order (ids order, duplicates kept)
+    question_boxes: dict[int, list[ExportBox]] = field(default_factory=dict)  # question id -> boxes
+    answer_boxes: dict[int, list[ExportBox]] = field(default_factory=dict)  # question id -> its answer's boxes
+    sections: dict[int, list[str]] = field(default_factory=dict)  # question id -> section names
+    papers: dict[int, ExportPaper] = field(default_factory=dict)
+    section_labels: dict[str, str] = field(default_factory=dict)  # section name -> "group_section"
+
+
+def _chunks(values: list[int]):
+    for i in range(0, len(values), IN_CHUNK):
+        yield values[i : i + IN_CHUNK]
+
+
+def _box(row) -> ExportBox:
+    return ExportBox(int(row[0]), int(row[1]), int(row[2]), tuple(float(v) for v in (row[3] or [])), str(row[4] or ""))
+
+
+def load_export_data(db: Session, ids, *, include_answers: bool = False, include_sections: bool = True) -> ExportData:
+    """Questions of `ids` with their boxes, answer boxes, papers and section labels."""
+    ids = [int(x) for x in (ids or [])]
+    unique_ids = list(dict.fromkeys(ids))
+    data = ExportData(questions=[])
+
+    by_id: dict[int, ExportQuestion] = {}
+    for chunk in _chunks(unique_ids):
+        for qid, paper_id, question_no, section, notes in db.query(
+            Question.id, Question.paper_id, Question.question_no, Question.section, Question.notes
+        ).filter(Question.id.in_(chunk)):
+            by_id[int(qid)] = ExportQuestion(int(qid), int(paper_id), question_no, section, notes)
+    data.questions = [by_id[qid] for qid in ids if qid in by_id]
+    qids = [qid for qid in unique_ids if qid in by_id]
+    if not qids:
+        return data
+
+    data.question_boxes = {qid: [] for qid in qids}
+    for chunk in _chunks(qids):
+        for row in (
+            db.query(
+                QuestionBox.question_id,
+                QuestionBox.id,
+                QuestionBox.paper_id,
+                QuestionBox.page,
+                QuestionBox.bbox,
+                QuestionBox.image_path,
+            )
+            .filter(QuestionBox.question_id.in_(chunk))
+            .order_by(QuestionBox.question_id, QuestionBox.page, QuestionBox.id)
+        ):
+            data.question_boxes[int(row[0])].append(_box(row[1:]))
+
+    if include_answers:
+        qid_by_aid: dict[int, int] = {}
+        for chunk in _chunks(qids):
+            for aid, qid in db.query(Answer.id, Answer.question_id).filter(Answer.question_id.in_(chunk)):
+                qid_by_aid[int(aid)] = int(qid)
+                data.answer_boxes[int(qid)] = []
+        for chunk in _chunks(list(qid_by_aid)):
+            for row in (
+                db.query(
+                    AnswerBox.answer_id,
+                    AnswerBox.id,
+                    AnswerBox.ms_paper_id,
+                    AnswerBox.page,
+                    AnswerBox.bbox,
+                    AnswerBox.image_path,
+                )
+                .filter(AnswerBox.answer_id.in_(chunk))
+                .order_by(AnswerBox.answer_id, AnswerBox.page, AnswerBox.id)
+            ):
+                data.answer_boxes[qid_by_aid[int(row[0])]].append(_box(row[1:]))
+
+    if include_sections:
+        data.sections = {qid: [] for qid in qids}
+        for chunk in _chunks(qids):
+            for qid, name in (
+                db.query(QuestionSection.question_id, QuestionSection.section_name)
+                .filter(QuestionSection.question_id.in_(chunk))
+                .order_by(QuestionSection.question_id, QuestionSection.section_name)
+            ):
+                data.sections[int(qid)].append(name)
+        for section_name, group_name in db.query(SectionGroupMember.section_name, SectionGroup.name).join(
+            SectionGroup, SectionGroupMember.group_id == SectionGroup.id
+        ):
+            if section_name and group_name:
+                data.section_labels[section_name] = f"{group_name}_{section_name}"
+
+    pids = {q.paper_id for q in by_id.values()}
+    pids |= {b.paper_id for boxes in data.question_boxes.values() for b in boxes}
+    pids |= {b.paper_id for boxes in data.answer_boxes.values() for b in boxes}
+    for chunk in _chunks(sorted(pids)):
+        for pid, exam_code, filename, pdf_path in db.query(
+            Paper.id, Paper.exam_code, Paper.filename, Paper.pdf_path
+        ).filter(Paper.id.in_(chunk)):
+            data.papers[int(pid)] = ExportPaper(exam_code, filename, pdf_path)
+    return data
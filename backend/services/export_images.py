@@ -0,0 +1,268 @@
+"""Cropping box images out of rendered pages for PDF export.
+
+An export's boxes are grouped by source page image, so each page is decoded
+once per job however many boxes (question parts, answers sharing a mark-scheme
+page) it holds. Decoded pages also stay in a memory-bounded LRU shared by the
+export jobs running in a process, sized from the export memory budget and
+dropped when the last of them finishes.
+"""
+from __future__ import annotations
+
+import io
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Hashable, Iterable
+
+from PIL import Image, features
+
+from backend.config import DATA_DIR, PAGE_DIR
+
+
+DECODED_PAGE_BUDGET = 256 * 1024 * 1024  # 4x 渲染的一页约 9MP（RGB 约 27MB）；导出时按内存预算另行设置
+IMAGE_ENCODINGS = ("color", "gray", "jpeg", "bilevel")
+_HAS_LIBTIFF = features.check("libtiff")
+
+
+def crop_pixel_box(size: tuple[int, int], bbox: list) -> tuple[int, int, int, int]:
+    """Pixel crop box of a normalized bbox [x0, y0, x1, y1] on an image of `size`."""
+    w, h = size
+    x0, y0, x1, y1 = bbox
+    # Convert normalized to pixel coordinates
+    px0 = int(x0 * w)
+    py0 = int(y0 * h)
+    px1 = int(x1 * w)
+    py1 = int(y1 * h)
+    # Ensure valid crop box
+    px0 = max(0, min(w, px0))
+    py0 = max(0, min(h, py0))
+    px1 = max(px0, min(w, px1))
+    py1 = max(py0, min(h, py1))
+    return px0, py0, px1, py1
+
+
+def crop_image_with_bbox(img: Image.Image, bbox: list) -> Image.Image:
+    """Crop image according to normalized bbox [x0, y0, x1, y1]."""
+    return img.crop(crop_pixel_box(img.size, bbox))
+
+
+def crop_extension(encoding: str) -> str:
+    """File extension of crops encoded by `encode_crop` with this encoding."""
+    if encoding == "jpeg":
+        return "jpg"
+    if encoding == "bilevel" and _HAS_LIBTIFF:
+        return "tif"
+    return "png"
+
+
+def encode_crop(
+    img: Image.Image,
+    encoding: str = "color",
+    *,
+    max_width: int = 0,
+    jpeg_quality: int = 80,
+    compress_level: int = 6,
+) -> tuple[bytes, str]:
+    """Encode a crop for embedding in the export PDF; returns (bytes, file extension).
+
+    `max_width` > 0 downsamples wider crops. color/gray are PNG (fpdf stores
+    them Flate-compressed); jpeg and bilevel (CCITT G4 TIFF) bytes are
+    embedded by fpdf as they are, without being decoded again.
+    """
+    if encoding in {"gray", "bilevel"}:
+        if img.mode != "L":
+            img = img.convert("L")
+    elif encoding == "jpeg":
+        if img.mode not in {"RGB", "L"}:
+            img = img.convert("RGB")
+    w, h = img.size
+    if max_width and w > max_width:
+        img = img.resize((int(max_width), max(1, round(h * max_width / w))), Image.Resampling.LANCZOS)
+
+    buf = io.BytesIO()
+    if encoding == "jpeg":
+        img.save(buf, format="JPEG", quality=int(jpeg_quality))
+        return buf.getvalue(), "jpg"
+    if encoding == "bilevel":
+        img = img.convert("1", dither=Image.Dither.NONE)
+        if _HAS_LIBTIFF:
+            # 单条带（RowsPerStrip = 高度）fpdf 才能直接拷贝 G4 数据
+            img.save(buf, format="TIFF", compression="group4", tiffinfo={278: img.size[1]})
+            return buf.getvalue(), "tif"
+    img.save(buf, format="PNG", compress_level=int(compress_level))
+    return buf.getvalue(), "png"
+
+
+def resolve_box_image_path(b) -> Path:
+    """Page image of a QuestionBox/AnswerBox (stored path, data-relative path, then the paper's page dir)."""
+    final_path = Path(b.image_path)
+    if not final_path.exists():
+        final_path = DATA_DIR / b.image_path
+    if not final_path.exists():
+        pid = getattr(b, "paper_id", None)
+        if pid is None:
+            pid = getattr(b, "ms_paper_id", None)
+        page_no = getattr(b, "page", None)
+        if pid is not None and page_no is not None:
+            fallback = PAGE_DIR / f"paper_{int(pid)}" / f"page_{int(page_no)}.png"
+            if fallback.exists():
+                final_path = fallback
+    return final_path
+
+
+class DecodedPageCache:
+    """LRU of decoded page images, bounded by their decoded size in bytes.
+
+    Keyed by (path, mtime, size) so a re-rendered page is decoded afresh.
+    Cached images are only ever read (cropped), so threads may share them.
+    """
+
+    def __init__(self, max_bytes: int = DECODED_PAGE_BUDGET):
+        self.default_max_bytes = self.max_bytes = int(max_bytes)
+        self._lock = threading.Lock()
+        self._items: OrderedDict[tuple, tuple[Image.Image, int]] = OrderedDict()
+        self._bytes = 0
+        self._budgets: dict[int, int] = {}
+        self._next_user = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _nbytes(img: Image.Image) -> int:
+        w, h = img.size
+        return w * h * len(img.getbands())
+
+    def get(self, path: Path) -> Image.Image:
+        st = path.stat()
+        key = (str(path), st.st_mtime_ns, st.st_size)
+        with self._lock:
+            hit = self._items.get(key)
+            if hit is not None:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return hit[0]
+            self.misses += 1
+
+        img = Image.open(path)
+        img.load()  # 单帧 PNG：load() 之后文件句柄已关闭
+        if img.mode not in {"1", "L", "RGB", "RGBA"}:
+            img = img.convert("RGB")
+        size = self._nbytes(img)
+        if size > self.max_bytes:
+            return img
+        with self._lock:
+            # 同一路径的旧版本（重新渲染之前的）直接丢掉
+            for old in [k for k in self._items if k[0] == key[0] and k != key]:
+                self._bytes -= self._items.pop(old)[1]
+            if key not in self._items:
+                self._items[key] = (img, size)
+                self._bytes += size
+            self._evict()
+        return img
+
+    def _evict(self) -> None:
+        # 调用方持有 self._lock
+        while self._bytes > self.max_bytes and self._items:
+            _, (_, freed) = self._items.popitem(last=False)
+            self._bytes -= freed
+
+    def _apply_budgets(self) -> None:
+        # 调用方持有 self._lock；并发导出各自的预算相加（每份预算本来就是按该任务分到的内存算的）
+        self.max_bytes = sum(self._budgets.values()) if self._budgets else self.default_max_bytes
+        self._evict()
+
+    @contextmanager
+    def use(self, max_bytes: int):
+        """Scope of one export with its own budget.
+
+        The cache limit is the sum of the active exports' budgets and is recomputed
+        when one finishes; the last export to finish empties the cache.
+        """
+        with self._lock:
+            token = self._next_user
+            self._next_user += 1
+            self._budgets[token] = int(max_bytes)
+            self._apply_budgets()
+        try:
+            yield self
+        finally:
+            with self._lock:
+                del self._budgets[token]
+                if not self._budgets:
+                    self._items.clear()
+                    self._bytes = 0
+                self._apply_budgets()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "pages": len(self._items),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "active_exports": len(self._budgets),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+decoded_pages = DecodedPageCache()
+
+
+def crop_boxes(
+    entries: Iterable[tuple[Hashable, Path, list]],
+    handle: Callable[[Hashable, Image.Image], object],
+    *,
+    workers: int = 0,
+) -> dict:
+    """Crop every (key, page image path, bbox) entry, decoding each page image once.
+
+    `handle(key, crop)` turns a crop into the caller's result; None results are
+    dropped. Pages are processed in parallel (one task per page image).
+    Returns {key: result}.
+    """
+    by_path: dict[Path, list[tuple[Hashable, list]]] = {}
+    for key, path, bbox in entries:
+        by_path.setdefault(Path(path), []).append((key, bbox))
+    out: dict = {}
+    if not by_path:
+        return out
+
+    def crop_page(path: Path) -> list[tuple[Hashable, object]]:
+        if not path.exists():
+            return []
+        try:
+            page = decoded_pages.get(path)
+        except Exception as e:
+            print(f"处理图片失败 {path}: {e}")
+            return []
+        done = []
+        for key, bbox in by_path[path]:
+            try:
+                result = handle(key, crop_image_with_bbox(page, bbox))
+            except Exception as e:
+                print(f"处理图片失败 {path}: {e}")
+                continue
+            if result is not None:
+                done.append((key, result))
+        return done
+
+    paths = list(by_path)
+    if workers <= 0:
+        workers = min(12, max(2, os.cpu_count() or 4))
+    workers = min(workers, len(paths))
+    if workers <= 1:
+        for path in paths:
+            out.update(crop_page(path))
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            for done in ex.map(crop_page, paths):
+                out.update(done)
+    return out
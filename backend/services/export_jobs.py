@@ -0,0 +1,272 @@
+"""Export jobs persisted in the `export_jobs` table.
+
+Every server process (uvicorn worker) sees the same jobs: status, progress
+and results are read from the table, never guessed from files on disk, and
+queued jobs survive a restart. Workers take jobs with `claim`, a single
+conditional UPDATE, so two processes never start the same job. A running
+job's worker refreshes `heartbeat_at`; a job whose worker stopped
+heartbeating (process killed, server restarted) goes back to the queue.
+Progress and results are written only by the worker holding the current
+claim, so a run that was re-queued as stale but is still going cannot
+overwrite the new claimant's job.
+"""
+from __future__ import annotations
+
+import os
+import socket
+import time
+import uuid
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import aliased, sessionmaker
+
+from backend.config import EXPORT_DIR
+from backend.database import ExportJob, engine
+
+
+AGING_PER_SECOND = 20.0  # 每等待 1 秒，估算成本减 20（约 20 道题）
+STALE_SECONDS = 120.0  # 处理中的任务超过这么久没有心跳，视为所在进程已退出（PyMuPDF 调用期间不释放 GIL，留足余量）
+FINISHED = ("done", "error", "cancelled")
+DEFAULT_RETENTION_HOURS = 24
+
+# 不走 SessionLocal：任务表的领取/心跳/进度写入不是题库数据变更，不应触发搜索缓存失效
+JobSession = sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+
+
+def _job_dict(job: ExportJob) -> dict:
+    return {
+        "id": job.id,
+        "status": job.status,
+        "request": job.request,
+        "priority": job.priority,
+        "cost": job.cost,
+        "queued_at": job.queued_at,
+        "worker": job.worker,
+        "phase": job.phase,
+        "progress": job.progress,
+        "image": job.image,
+        "path": job.path,
+        "filename": job.filename,
+        "saved_copy_path": job.saved_copy_path,
+        "size_bytes": job.size_bytes,
+        "msg": job.msg,
+        "finished_at": job.finished_at,
+    }
+
+
+class JobLost(Exception):
+    """The job was re-queued as stale and is no longer this worker's to run."""
+
+
+def worker_label() -> str:
+    """Identity of a claiming thread: host, process and a per-claim token."""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:12]}"
+
+
+def claim_token(worker: str) -> str:
+    """The per-claim part of a worker label (used to name the claim's output files)."""
+    return worker.rsplit(":", 1)[-1]
+
+
+class ExportJobStore:
+    @staticmethod
+    def _rank(now: float, job=ExportJob):
+        # 优先级高的先做；同优先级按估算成本（短任务先做），排队越久成本越低；最后按提交顺序
+        return (
+            job.priority.desc(),
+            job.cost - (now - job.queued_at) * AGING_PER_SECOND,
+            job.queued_at,
+        )
+
+    def create(self, request: dict, *, cost: int, priority: int, image: dict | None) -> str:
+        """Queue a job; returns its id."""
+        now = time.time()
+        base = f"job_{int(now * 1000)}"
+        n = 1
+        while True:
+            # 同一毫秒内提交的多个任务（可能来自不同进程）
+            job_id = base if n == 1 else f"{base}_{n}"
+            try:
+                with JobSession() as db:
+                    db.add(ExportJob(
+                        id=job_id,
+                        status="queued",
+                        request=request,
+                        priority=int(priority),
+                        cost=int(cost),
+                        queued_at=now,
+                        phase="queued",
+                        progress={"done": 0, "total": 3, "percent": 0.0},
+                        image=image,
+                        msg="queued",
+                    ))
+                    db.commit()
+                return job_id
+            except IntegrityError:
+                n += 1
+
+    def get(self, job_id: str) -> dict | None:
+        with JobSession() as db:
+            job = db.get(ExportJob, job_id)
+            return _job_dict(job) if job is not None else None
+
+    def claim(self, worker: str) -> tuple[str, dict] | None:
+        """Atomically move the best queued job to processing for `worker`; (job id, request) or None."""
+        now = time.time()
+        candidate = aliased(ExportJob)
+        with JobSession() as db:
+            best = (
+                db.query(candidate.id)
+                .filter(candidate.status == "queued")
+                .order_by(*self._rank(now, candidate))
+                .limit(1)
+                .scalar_subquery()
+            )
+            claimed = (
+                db.query(ExportJob)
+                .filter(ExportJob.id == best, ExportJob.status == "queued")
+                .update(
+                    {
+                        "status": "processing",
+                        "worker": worker,
+                        "heartbeat_at": now,
+                        "phase": "processing",
+                        "progress": {"done": 1, "total": 3, "percent": 33.3},
+                    },
+                    synchronize_session=False,
+                )
+            )
+            if not claimed:
+                # 没领到任务：空轮询不提交
+                db.rollback()
+                return None
+            db.commit()
+            job = db.query(ExportJob).filter(ExportJob.worker == worker, ExportJob.status == "processing").first()
+            return (job.id, job.request) if job is not None else None
+
+    @staticmethod
+    def _claimed(job_id: str, worker: str | None):
+        conds = [ExportJob.id == job_id, ExportJob.status == "processing"]
+        if worker is not None:
+            conds.append(ExportJob.worker == worker)
+        return conds
+
+    def update_progress(self, job_id: str, phase: str, progress: dict, worker: str | None = None) -> bool:
+        """Record progress of a processing job; with `worker`, only while that claim holds. Returns whether it did."""
+        now = time.time()
+        with JobSession() as db:
+            n = db.query(ExportJob).filter(*self._claimed(job_id, worker)).update(
+                {"phase": phase, "progress": progress, "heartbeat_at": now}, synchronize_session=False
+            )
+            if not n:
+                db.rollback()
+                return False
+            db.commit()
+            return True
+
+    def finish(self, job_id: str, status: str, worker: str | None = None, **fields) -> bool:
+        """Record a job's outcome (status done or error) with its result fields; see `update_progress`."""
+        with JobSession() as db:
+            n = db.query(ExportJob).filter(*self._claimed(job_id, worker)).update(
+                {"status": status, "phase": status, "finished_at": time.time(), **fields},
+                synchronize_session=False,
+            )
+            if not n:
+                db.rollback()
+                return False
+            db.commit()
+            return True
+
+    def cancel(self, job_id: str) -> str | None:
+        """Cancel a queued job; returns the job's status afterwards (None if unknown)."""
+        with JobSession() as db:
+            db.query(ExportJob).filter(ExportJob.id == job_id, ExportJob.status == "queued").update(
+                {
+                    "status": "cancelled",
+                    "phase": "cancelled",
+                    "msg": "cancelled",
+                    "progress": {"done": 0, "total": 3, "percent": 0.0},
+                    "finished_at": time.time(),
+                },
+                synchronize_session=False,
+            )
+            db.commit()
+            job = db.get(ExportJob, job_id)
+            return job.status if job is not None else None
+
+    def heartbeat(self, workers) -> None:
+        """Refresh the jobs held by these claims (worker labels)."""
+        labels = list(workers)
+        if not labels:
+            return
+        with JobSession() as db:
+            db.query(ExportJob).filter(ExportJob.worker.in_(labels), ExportJob.status == "processing").update(
+                {"heartbeat_at": time.time()}, synchronize_session=False
+            )
+            db.commit()
+
+    def requeue_stale(self) -> int:
+        """Put processing jobs whose worker stopped heartbeating back in the queue; returns how many."""
+        with JobSession() as db:
+            n = (
+                db.query(ExportJob)
+                .filter(ExportJob.status == "processing", ExportJob.heartbeat_at < time.time() - STALE_SECONDS)
+                .update(
+                    {"status": "queued", "worker": None, "phase": "queued", "progress": {"done": 0, "total": 3, "percent": 0.0}},
+                    synchronize_session=False,
+                )
+            )
+            if not n:
+                db.rollback()
+                return 0
+            db.commit()
+            return int(n)
+
+    def queued_ids(self) -> list[str]:
+        """Queued job ids in the order they will be claimed."""
+        with JobSession() as db:
+            rows = db.query(ExportJob.id).filter(ExportJob.status == "queued").order_by(*self._rank(time.time()))
+            return [r[0] for r in rows]
+
+    def running_ids(self) -> list[str]:
+        with JobSession() as db:
+            return sorted(r[0] for r in db.query(ExportJob.id).filter(ExportJob.status == "processing"))
+
+    def position(self, job_id: str) -> int:
+        queued = self.queued_ids()
+        return queued.index(job_id) if job_id in queued else 0
+
+    def purge_expired(self, retention_seconds: float) -> int:
+        """Delete finished jobs older than the retention period, their files, and orphaned files; returns files removed."""
+        cutoff = time.time() - retention_seconds
+        with JobSession() as db:
+            db.query(ExportJob).filter(ExportJob.status.in_(FINISHED), ExportJob.finished_at < cutoff).delete(
+                synchronize_session=False
+            )
+            db.commit()
+            known = {r[0] for r in db.query(ExportJob.id)}
+        removed = 0
+        if not EXPORT_DIR.exists():
+            return removed
+        for p in EXPORT_DIR.iterdir():
+            # job_x.pdf、job_x.part1.pdf、job_x.chunk2.pdf…… 都以任务 id 开头
+            if not p.is_file() or p.name.split(".", 1)[0] in known:
+                continue
+            try:
+                if p.stat().st_mtime < cutoff:
+                    p.unlink()
+                    removed += 1
+            except OSError:
+                pass
+        return removed
+
+
+def retention_seconds_from_env() -> float:
+    try:
+        hours = float(os.getenv("PAPER_LABELER_EXPORT_RETENTION_HOURS", str(DEFAULT_RETENTION_HOURS)))
+    except ValueError:
+        hours = DEFAULT_RETENTION_HOURS
+    return max(1.0, hours) * 3600
+
+
+export_job_store = ExportJobStore()
@@ -0,0 +1,456 @@
+"""Page layout of exported PDFs: per-question fragments and their assembly.
+
+Each question and each answer is laid out on its own page(s) as a small PDF
+fragment holding only its boxes and borders. Nothing that depends on the
+export goes into a fragment: the header line (which carries the export
+sequence number) is left as reserved space, and there are no page numbers.
+`PdfAssembler` concatenates fragments with PyMuPDF `insert_pdf` and stamps
+headers and page numbers where fpdf would have drawn them. So a fragment
+depends only on its boxes and the image options, and can be cached across
+exports.
+"""
+from __future__ import annotations
+
+import io
+import re
+from pathlib import Path
+
+import fitz
+from fpdf import FPDF
+
+from backend.services.export_vector import MM_TO_PT, PdfRegion, SourcePdfs, stamp_regions
+
+
+CONTENT_X = 15
+PAGE_BOTTOM = 282  # A4 高 297mm，底部留 15mm 给页码
+HEADER_H = 8
+HEADER_GAP = 2
+ANSWER_GAP = 2
+
+
+# Custom PDF class with page numbers
+class PDFWithPageNumbers(FPDF):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # When a summary cover is inserted, keep question pages starting from 1.
+        self.page_number_offset = 0
+        self.page_number_enabled = True
+
+    def footer(self):
+        """Add centered page numbers at the bottom of each page."""
+        if not getattr(self, "page_number_enabled", True):
+            return
+        display_no = self.page_no() - int(getattr(self, "page_number_offset", 0) or 0)
+        if display_no <= 0:
+            return
+        self.set_y(-15)
+        self.set_font('Arial', 'I', 8)
+        self.set_text_color(128, 128, 128)
+        # Page number centered
+        self.cell(0, 10, f'{display_no}', 0, 0, 'C')
+
+
+def pdf_text(value: str) -> str:
+    text = str(value or "")
+    try:
+        return text.encode("latin-1", "replace").decode("latin-1")
+    except Exception:
+        return text
+
+
+def _new_fragment() -> PDFWithPageNumbers:
+    pdf = PDFWithPageNumbers()
+    pdf.page_number_enabled = False  # 页码在拼接时统一盖上
+    pdf.set_auto_page_break(auto=False, margin=15)
+    pdf.set_font("Arial", size=10)
+    return pdf
+
+
+class _FragmentWriter:
+    """An fpdf fragment plus the vector regions to stamp into it once written."""
+
+    def __init__(self, sources: SourcePdfs | None):
+        self.pdf = _new_fragment()
+        self.sources = sources
+        self.placements: list[tuple] = []
+
+    def add_page(self, with_header: bool) -> None:
+        self.pdf.add_page()
+        if with_header:
+            # 页眉只占位，文字在拼接时写入
+            self.pdf.ln(HEADER_H)
+            self.pdf.ln(HEADER_GAP)
+
+    def draw(self, img_src, x, y, w, h) -> None:
+        if isinstance(img_src, PdfRegion):
+            # 先占位，fpdf 输出后再用 PyMuPDF 把原 PDF 区域画进去
+            self.placements.append((self.pdf.page_no(), x, y, w, h, img_src))
+        else:
+            # 内存中的裁剪图直接交给 fpdf（按内容哈希去重），不落临时文件
+            src = io.BytesIO(img_src) if isinstance(img_src, bytes) else img_src
+            self.pdf.image(src, x=x, y=y, w=w)
+
+    def output(self) -> bytes:
+        return stamp_regions(bytes(self.pdf.output()), self.placements, self.sources)
+
+
+def render_question_fragment(items: list[tuple], *, has_header: bool, sources: SourcePdfs | None = None) -> bytes:
+    """One question page (plus a blank answer page when it is nearly full).
+
+    `items` are (image source, width mm, height mm); an image source is
+    encoded crop bytes, a file path, or a PdfRegion.
+    """
+    w = _FragmentWriter(sources)
+    pdf = w.pdf
+    # One page per question
+    w.add_page(has_header)
+
+    # Draw all images with a border that extends to page bottom
+    if items:
+        start_y = pdf.get_y()
+        current_y = start_y
+        border_w = items[-1][1]
+
+        # Draw each image
+        for img_src, render_w, render_h in items:
+            w.draw(img_src, CONTENT_X, current_y, render_w, render_h)
+            current_y += render_h + 2
+
+        # Draw border from start to page bottom (leave 15mm margin)
+        total_height = PAGE_BOTTOM - start_y
+        pdf.rect(CONTENT_X - 2, start_y - 2, border_w + 4, total_height + 2)
+
+        # Add a light separator line after question content
+        separator_y = current_y + 3
+        pdf.set_draw_color(200, 200, 200)  # Light gray
+        pdf.line(CONTENT_X, separator_y, CONTENT_X + border_w, separator_y)
+        pdf.set_draw_color(0, 0, 0)  # Reset to black
+
+        # If the question occupies >=70% of available height, add a blank page after it.
+        available_height = PAGE_BOTTOM - start_y
+        content_height = current_y - start_y
+        if available_height > 0 and (content_height / available_height) >= 0.7:
+            pdf.add_page()
+            pdf.set_y(start_y)
+            pdf.rect(CONTENT_X - 2, start_y - 2, border_w + 4, total_height + 2)
+    return w.output()
+
+
+def render_answer_fragment(items: list[tuple], *, sources: SourcePdfs | None = None) -> bytes | None:
+    """Answer pages (auto paginate when the answer is too tall); None when there is nothing to draw."""
+    if not items:
+        return None
+    w = _FragmentWriter(sources)
+    pdf = w.pdf
+    current_y = 0.0
+    start_y = 0.0
+    page_max_w = 0.0
+    page_has_content = False
+
+    def start_answer_page():
+        nonlocal current_y, start_y, page_max_w, page_has_content
+        w.add_page(True)
+        start_y = pdf.get_y()
+        current_y = start_y
+        page_max_w = 0.0
+        page_has_content = False
+
+    def finish_answer_page():
+        if not page_has_content:
+            return
+        total_h = max(0.0, current_y - start_y - ANSWER_GAP)
+        pdf.rect(CONTENT_X - 2, start_y - 2, page_max_w + 4, total_h + 4)
+
+    start_answer_page()
+    for img_src, render_w, render_h in items:
+        avail_h = PAGE_BOTTOM - current_y
+        if page_has_content and render_h > avail_h:
+            finish_answer_page()
+            start_answer_page()
+            avail_h = PAGE_BOTTOM - current_y
+
+        draw_w = render_w
+        draw_h = render_h
+        if draw_h > avail_h and avail_h > 5:
+            scale = avail_h / draw_h
+            draw_h = avail_h
+            draw_w = max(10, draw_w * scale)
+
+        w.draw(img_src, CONTENT_X, current_y, draw_w, draw_h)
+        current_y += draw_h + ANSWER_GAP
+        page_max_w = max(page_max_w, draw_w)
+        page_has_content = True
+
+    finish_answer_page()
+    return w.output()
+
+
+def render_filter_summary_fragment(lines: list[str]) -> bytes:
+    pdf = _new_fragment()
+    pdf.add_page()
+    page_h = pdf.h
+    # Align with question content outer frame: x = content_x - 2 (15 - 2)
+    box_x = 13
+    box_y = 12
+    # Align width with question content outer frame: 180 + 4
+    box_w = 184
+    box_h = page_h - 20
+    pdf.rect(box_x, box_y, box_w, box_h)
+
+    info_lines = [str(x).strip() for x in (lines or []) if str(x).strip()]
+    if not info_lines:
+        info_lines = ["(No filters)"]
+
+    line_h = 14
+    body_h = len(info_lines) * line_h
+    total_h = body_h
+    start_y = box_y + max(8, (box_h - total_h) / 2)
+
+    pdf.set_y(start_y)
+    pdf.set_font("Arial", size=18)
+    for line in info_lines:
+        pdf.cell(0, line_h, pdf_text(line), ln=True, align="C")
+    return bytes(pdf.output())
+
+
+class PdfAssembler:
+    """Concatenates fragments into the export, then stamps headers and page numbers.
+
+    Text goes exactly where fpdf puts it (Arial is the Helvetica base font in
+    both): header cell at the top margin, page number centered in the footer.
+    Stamps are small content streams sharing one base-14 font object per
+    document; `Page.insert_text` would add a font to every page and costs
+    milliseconds per call.
+
+    With `chunk_bytes` set, the pages assembled so far are written out as a
+    part file (headers stamped) whenever that many fragment bytes have been
+    appended, and `save` streams the parts into the output one at a time, so
+    memory stays bounded however large the export. Exports that fit in one
+    chunk are saved in one piece as before.
+    """
+
+    MARGIN = 10  # fpdf 默认页边距 1cm，单元格内边距 1mm
+    CELL_MARGIN = 1
+    FONTS = {"PLH": "Helvetica-Bold", "PLI": "Helvetica-Oblique"}
+
+    def __init__(
+        self,
+        page_number_offset: int = 0,
+        number_pages: bool = True,
+        chunk_bytes: int = 0,
+        spill_prefix: Path | None = None,
+    ):
+        self.doc = fitz.open()
+        self._number_font = fitz.Font("heit")
+        # 封面不计页码：前 page_number_offset 页不编号
+        self.page_number_offset = int(page_number_offset or 0)
+        # 分片渲染的部分 PDF 只写页眉，页码在合并后统一编
+        self.number_pages = bool(number_pages)
+        self.chunk_bytes = int(chunk_bytes or 0) if spill_prefix is not None else 0
+        self.spill_prefix = spill_prefix
+        self._headers: dict[int, str] = {}  # 当前块内页序号 -> 页眉
+        self._pending_bytes = 0
+        self._parts: list[tuple[Path, bool]] = []  # (部分 PDF, 是否由本对象创建)
+        self._flushed_pages = 0
+
+    @property
+    def page_count(self) -> int:
+        return self._flushed_pages + self.doc.page_count
+
+    def append(self, fragment: bytes | Path, header: str | None = None, continued_header: str | None = None) -> int:
+        """Append a fragment; `header` goes on its first page, `continued_header` on the rest. Returns pages added."""
+        src = fitz.open(str(fragment)) if isinstance(fragment, Path) else fitz.open("pdf", fragment)
+        try:
+            start = self.doc.page_count
+            self.doc.insert_pdf(src)
+            added = src.page_count
+        finally:
+            src.close()
+        for i in range(added):
+            text = header if i == 0 else continued_header
+            if text:
+                self._headers[start + i] = text
+        if self.chunk_bytes:
+            self._pending_bytes += fragment.stat().st_size if isinstance(fragment, Path) else len(fragment)
+            if self._pending_bytes >= self.chunk_bytes:
+                self._flush()
+        return added
+
+    def append_part(self, path: Path) -> int:
+        """Append a finished partial PDF (headers already stamped) without loading it; returns its pages."""
+        self._flush()
+        with fitz.open(str(path)) as src:
+            pages = src.page_count
+        self._parts.append((Path(path), False))
+        self._flushed_pages += pages
+        return pages
+
+    def _flush(self) -> None:
+        """Write the pages assembled so far to a part file (headers only) and start an empty document."""
+        if not self.doc.page_count:
+            return
+        if self.spill_prefix is None:
+            raise ValueError("PdfAssembler needs spill_prefix to write parts")
+        path = Path(f"{self.spill_prefix}.chunk{len(self._parts) + 1}.pdf")
+        self._stamp_pages(self.doc, self._headers, 0, number_pages=False)
+        self.doc.save(str(path), garbage=4, deflate=True)
+        self._parts.append((path, True))
+        self._flushed_pages += self.doc.page_count
+        self.doc.close()
+        self.doc = fitz.open()
+        self._headers = {}
+        self._pending_bytes = 0
+
+    @staticmethod
+    def _new_object(doc: fitz.Document, source: str, stream: bytes | None = None) -> int:
+        xref = doc.get_new_xref()
+        doc.update_object(xref, source)
+        if stream is not None:
+            doc.update_stream(xref, stream)
+        return xref
+
+    @staticmethod
+    def _font_dict(doc: fitz.Document, page_xref: int) -> tuple[int, str]:
+        """(xref, key prefix) of a page's font dictionary, following indirect objects."""
+        xref, prefix = page_xref, ""
+        for key in ("Resources", "Font"):
+            kind, value = doc.xref_get_key(xref, prefix + key)
+            if kind == "xref":
+                xref, prefix = int(value.split()[0]), ""
+            else:
+                prefix += key + "/"
+        return xref, prefix
+
+    @staticmethod
+    def _contents(doc: fitz.Document, page_xref: int) -> list[str]:
+        kind, value = doc.xref_get_key(page_xref, "Contents")
+        if kind == "xref" and not doc.xref_is_stream(int(value.split()[0])):
+            value = doc.xref_object(int(value.split()[0]), compressed=True)
+        return re.findall(r"\d+ 0 R", value)
+
+    @staticmethod
+    def _pdf_string(text: str) -> str:
+        text = pdf_text(text).replace("\r", " ").replace("\n", " ")
+        return "(" + text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") + ")"
+
+    def _stamp_pages(self, doc: fitz.Document, headers: dict[int, str], first_page: int, number_pages: bool) -> None:
+        """Stamp `headers` and (optionally) page numbers; `first_page` is the export index of doc's first page."""
+        if not doc.page_count:
+            return
+        fonts = {
+            name: self._new_object(doc, f"<</Type/Font/Subtype/Type1/BaseFont/{base}/Encoding/WinAnsiEncoding>>")
+            for name, base in self.FONTS.items()
+        }
+        # 原内容包在 q/Q 里，页码不受其遗留的图形状态影响
+        push = self._new_object(doc, "<<>>", b"q\n")
+        pop = self._new_object(doc, "<<>>", b"\nQ\n")
+        k = MM_TO_PT
+        for idx in range(doc.page_count):
+            px = doc.page_xref(idx)
+            kind, value = doc.xref_get_key(px, "MediaBox")
+            box = [float(v) for v in value.strip("[]").split()] if kind == "array" else [0, 0, 595.28, 841.89]
+            page_w, page_h = box[2] - box[0], box[3] - box[1]
+            before, after = [], []
+            header = headers.get(idx)
+            if header:
+                # fpdf: cell(0, 8) 加粗 11pt，基线 = y + h/2 + 0.3 * 字号
+                x = (self.MARGIN + self.CELL_MARGIN) * k
+                y = page_h - (self.MARGIN + HEADER_H / 2) * k - 0.3 * 11
+                stream = f"q BT /PLH 11 Tf {x:.2f} {y:.2f} Td {self._pdf_string(header)} Tj ET Q\n"
+                before.append(self._new_object(doc, "<<>>", stream.encode("latin-1")))
+            display_no = first_page + idx + 1 - self.page_number_offset
+            if number_pages and display_no > 0:
+                # footer: set_y(-15)，cell(0, 10, align="C")，斜体 8pt 灰色
+                text = str(display_no)
+                text_w = self._number_font.text_length(text, fontsize=8)
+                x = self.MARGIN * k + (page_w - 2 * self.MARGIN * k - text_w) / 2
+                y = (15 - 10 / 2) * k - 0.3 * 8
+                stream = f"q 0.502 g BT /PLI 8 Tf {x:.2f} {y:.2f} Td ({text}) Tj ET Q\n"
+                after.append(self._new_object(doc, "<<>>", stream.encode("latin-1")))
+            if not before and not after:
+                continue
+            font_xref, prefix = self._font_dict(doc, px)
+            for name, xref in fonts.items():
+                doc.xref_set_key(font_xref, prefix + name, f"{xref} 0 R")
+            contents = [f"{x} 0 R" for x in before] + [f"{push} 0 R"] + self._contents(doc, px)
+            contents += [f"{pop} 0 R"] + [f"{x} 0 R" for x in after]
+            doc.xref_set_key(px, "Contents", "[" + " ".join(contents) + "]")
+
+    def save(self, path: Path) -> None:
+        if not self._parts:
+            self._stamp_pages(self.doc, self._headers, 0, self.number_pages)
+            # garbage=4 合并各片段里重复的对象（同一原 PDF 页、字体）
+            self.doc.save(str(path), garbage=4, deflate=True)
+            return
+        self._flush()
+        with open(path, "wb") as out:
+            self._write_parts(out)
+
+    def _write_parts(self, out) -> None:
+        """Stream the parts into one PDF: each part's objects are copied with renumbered references."""
+        out.write(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+        offsets: list[int | None] = [None, None, None]  # 1 = Catalog，2 = 页面树，写在最后
+        kids: list[int] = []
+        first_page = 0
+        for part, _ in self._parts:
+            with fitz.open(str(part)) as doc:
+                if self.number_pages:
+                    self._stamp_pages(doc, {}, first_page, True)
+                first_page += doc.page_count
+                base = len(offsets) - 1  # 部分内的对象 n 写成 n + base
+                page_xrefs = [doc.page_xref(i) for i in range(doc.page_count)]
+                skip = {doc.pdf_catalog()} | self._page_tree_nodes(doc)
+                for xref in page_xrefs:
+                    doc.xref_set_key(xref, "Parent", "null")
+                for xref in range(1, doc.xref_length()):
+                    offsets.append(None)
+                    if xref in skip or doc.xref_get_key(xref, "Type")[1] == "/XRef":
+                        continue
+                    raw = doc.xref_stream_raw(xref) if doc.xref_is_stream(xref) else None
+                    if raw is not None:
+                        doc.xref_set_key(xref, "Length", str(len(raw)))
+                    source = re.sub(
+                        r"\b(\d+) 0 R\b", lambda m: f"{int(m.group(1)) + base} 0 R", doc.xref_object(xref, compressed=True)
+                    )
+                    if xref in page_xrefs:
+                        source = source.replace("/Parent null", "/Parent 2 0 R")
+                    offsets[xref + base] = out.tell()
+                    out.write(f"{xref + base} 0 obj\n{source}\n".encode("latin-1"))
+                    if raw is not None:
+                        out.write(b"stream\n" + raw + b"\nendstream\n")
+                    out.write(b"endobj\n")
+                kids.extend(xref + base for xref in page_xrefs)
+        offsets[1] = out.tell()
+        out.write(b"1 0 obj\n<</Type/Catalog/Pages 2 0 R>>\nendobj\n")
+        offsets[2] = out.tell()
+        out.write(f"2 0 obj\n<</Type/Pages/Count {len(kids)}/Kids[".encode("latin-1"))
+        out.write(" ".join(f"{x} 0 R" for x in kids).encode("latin-1"))
+        out.write(b"]>>\nendobj\n")
+        xref_at = out.tell()
+        out.write(f"xref\n0 {len(offsets)}\n".encode("latin-1"))
+        out.write(b"0000000000 65535 f \n")
+        for offset in offsets[1:]:
+            out.write(b"0000000000 65535 f \n" if offset is None else f"{offset:010d} 00000 n \n".encode("latin-1"))
+        out.write(f"trailer\n<</Size {len(offsets)}/Root 1 0 R>>\nstartxref\n{xref_at}\n%%EOF\n".encode("latin-1"))
+
+    @staticmethod
+    def _page_tree_nodes(doc: fitz.Document) -> set[int]:
+        nodes: set[int] = set()
+        kind, value = doc.xref_get_key(doc.pdf_catalog(), "Pages")
+        todo = [int(value.split()[0])] if kind == "xref" else []
+        while todo:
+            xref = todo.pop()
+            if xref in nodes or doc.xref_get_key(xref, "Type")[1] != "/Pages":
+                continue
+            nodes.add(xref)
+            todo.extend(int(x) for x in re.findall(r"(\d+) 0 R", doc.xref_get_key(xref, "Kids")[1]))
+        return nodes
+
+    def close(self) -> None:
+        self.doc.close()
+        for path, owned in self._parts:
+            if owned:
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
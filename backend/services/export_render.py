@@ -0,0 +1,442 @@
+"""Cropping and laying out export units, in this process or sharded across processes.
+
+A unit is one question or one answer: its boxes plus the header text the
+assembler stamps on its pages. `render_units` crops the boxes of units whose
+fragment is not cached and appends every fragment to a `PdfAssembler`.
+
+Units are rendered in batches and the assembler spills finished page
+chunks to disk (see `PdfAssembler`), so memory is bounded by
+PAPER_LABELER_EXPORT_MEMORY_MB rather than by the export size. The budget
+is per export job and covers every process rendering it: each process gets
+an equal share, split by `settings_for_budget` between assembled pages,
+decoded page images and the current batch of crops.
+
+Very large exports are split into contiguous shards, each rendered to a
+partial PDF (headers stamped, no page numbers) by `render_shard` in a
+separate process; the parent appends the partial PDFs in order and numbers
+the pages. Units and settings are plain picklable records and the worker
+never opens the database, so workers are started with "spawn" (forking a
+server process that holds threads and locks is not safe).
+"""
+from __future__ import annotations
+
+import math
+import multiprocessing
+import os
+import queue as queue_module
+import sys
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import dataclass, field, replace
+from pathlib import Path
+from typing import Callable
+
+from PIL import Image
+
+from backend.services.crop_cache import crop_cache, fragment_cache
+from backend.services.export_data import ExportBox
+from backend.services.export_images import (
+    DECODED_PAGE_BUDGET,
+    crop_boxes,
+    crop_extension,
+    crop_pixel_box,
+    decoded_pages,
+    encode_crop,
+    resolve_box_image_path,
+)
+from backend.services.export_layout import PdfAssembler, render_answer_fragment, render_question_fragment
+from backend.services.export_vector import SourcePdfs
+
+
+# 片段版式（边框、间距、分页规则）改动时加一，旧的缓存片段随之失效
+FRAGMENT_LAYOUT_VERSION = 1
+SHARD_MIN_UNITS = 150  # 每个分片至少这么多待排版的单元，否则进程启动开销不划算
+CACHED_UNIT_WEIGHT = 0.05  # 命中缓存的单元只需拼接，分片时按这个权重计
+RENDER_BATCH_UNITS = 64  # 每批裁剪、排版的单元数上限；裁剪图只在本批内留在内存
+MIN_BATCH_UNITS = 8
+CROP_BYTES_PER_UNIT = 2 * 1024 * 1024  # 一个单元编码后的裁剪图按 2MB 估算（4x 彩色 PNG）
+PROCESS_MIN_MEMORY = 256 * 1024 * 1024  # 每个分片进程至少分到这么多预算，否则少开进程（空载的解释器 + PyMuPDF + PIL 就约 100MB）
+DEFAULT_MEMORY_MB = 1024
+
+
+@dataclass
+class RenderUnit:
+    kind: str  # "q" | "a"
+    boxes: list[ExportBox]
+    header: str | None
+    continued_header: str | None
+    phase: str
+    versions: tuple[str, ...] = ()  # 每个框所在页面图片的版本
+    key: str | None = None  # 片段缓存 key
+    cached: Path | None = None  # 查找时命中的缓存片段
+
+
+@dataclass(frozen=True)
+class RenderSettings:
+    image_mode: dict
+    vector_pdf_paths: dict[int, str | None] = field(default_factory=dict)
+    crop_workers: int = 0  # 0=auto
+    use_crop_cache: bool = True
+    use_fragment_cache: bool = True
+    chunk_bytes: int = 0  # 分片进程拼接时的落盘阈值（见 PdfAssembler）
+    decoded_page_bytes: int = DECODED_PAGE_BUDGET  # 解码页面缓存上限
+    batch_units: int = RENDER_BATCH_UNITS
+
+
+def crop_variant(mode: dict) -> str:
+    """Crop cache variant for an image mode (original colour PNG keeps the plain "png" key)."""
+    if mode["encoding"] == "color" and not mode["dpi"]:
+        return "png"
+    parts = [mode["encoding"], str(mode["dpi"])]
+    if mode["encoding"] == "jpeg":
+        parts.append(str(mode["jpeg_quality"]))
+    return "-".join(parts)
+
+
+def crop_render_size(w_px: int, h_px: int) -> tuple[float, float]:
+    """(width mm, height mm): crops are drawn at 96 dpi of the 4x render, at most 180 mm wide."""
+    aspect = h_px / w_px
+    max_w = 180
+    render_w = min(max_w, w_px * 0.264583)
+    render_h = render_w * aspect
+    return render_w, render_h
+
+
+def fragment_key(unit: RenderUnit, settings: RenderSettings) -> str:
+    box_parts = []
+    for b, version in zip(unit.boxes, unit.versions):
+        pid = b.paper_id
+        box_parts.append(
+            [int(pid), int(b.page), [round(float(v), 6) for v in b.bbox], version, settings.vector_pdf_paths.get(pid) or ""]
+        )
+    return fragment_cache.key(FRAGMENT_LAYOUT_VERSION, unit.kind, box_parts, settings.image_mode, bool(unit.header))
+
+
+class UnitRenderer:
+    """Crops and fragments of one export (or one shard of it)."""
+
+    def __init__(self, settings: RenderSettings):
+        self.settings = settings
+        self.sources = SourcePdfs()
+        self.crops: dict[tuple, tuple] = {}
+        self._cache_keys: dict[tuple, str] = {}
+        self._page_sizes: dict[str, tuple[int, int]] = {}
+        self._crop_variant = crop_variant(settings.image_mode)
+        self._crop_ext = crop_extension(settings.image_mode["encoding"])
+
+    def _target_width(self, render_w: float) -> int:
+        # 绘制宽度（mm）按目标 DPI 换算成像素；0 = 不下采样
+        dpi = self.settings.image_mode["dpi"]
+        return round(render_w / 25.4 * dpi) if dpi else 0
+
+    def _save_crop(self, key, cropped_img):
+        # 裁剪图只编码一次：同一份字节写入缓存并直接交给 fpdf
+        w_px, h_px = cropped_img.size
+        if w_px <= 0 or h_px <= 0:
+            return None
+        render_w, render_h = crop_render_size(w_px, h_px)
+        mode = self.settings.image_mode
+        data, ext = encode_crop(
+            cropped_img,
+            mode["encoding"],
+            max_width=self._target_width(render_w),
+            jpeg_quality=mode.get("jpeg_quality", 80),
+            compress_level=6 if self.settings.use_crop_cache else 1,
+        )
+        if self.settings.use_crop_cache:
+            crop_cache.store(self._cache_keys[key], data, ext)
+        return data, render_w, render_h
+
+    def _page_size(self, src: Path) -> tuple[int, int]:
+        # 只读 PNG 头，不解码
+        if str(src) not in self._page_sizes:
+            with Image.open(src) as im:
+                self._page_sizes[str(src)] = im.size
+        return self._page_sizes[str(src)]
+
+    def prepare_crops(self, units: list[RenderUnit]) -> None:
+        crops = self.crops
+        vector_pdf_paths = self.settings.vector_pdf_paths
+        use_crop_cache = self.settings.use_crop_cache
+        crop_entries = []
+        # 同一页面同一 bbox 的框（重复标注）只裁剪一次
+        first_key_by_region: dict[tuple, tuple] = {}
+        aliases: dict[tuple, tuple] = {}
+        seen: set[tuple] = set()
+        for unit in units:
+            for b, version in zip(unit.boxes, unit.versions):
+                key = (unit.kind, b.id)
+                if key in crops or key in seen:
+                    continue
+                seen.add(key)
+                pid = b.paper_id
+                if vector_pdf_paths:
+                    region = self.sources.region(vector_pdf_paths.get(pid), b.page, b.bbox)
+                    if region is not None:
+                        w_px, h_px = self.sources.pixel_size(region)
+                        if w_px > 0 and h_px > 0:
+                            crops[key] = (region, *crop_render_size(w_px, h_px))
+                        continue
+                src = resolve_box_image_path(b)
+                region = (str(src), tuple(float(v) for v in (b.bbox or [])))
+                if region in first_key_by_region:
+                    aliases[key] = first_key_by_region[region]
+                    continue
+                first_key_by_region[region] = key
+                if use_crop_cache:
+                    cache_key = crop_cache.key_for(str(src), version, b.bbox, self._crop_variant)
+                    # 命中的裁剪图当场读进内存（只留在本批内）：排版前文件可能已被别的任务/进程淘汰
+                    hit = crop_cache.read(cache_key, self._crop_ext)
+                    if hit is not None:
+                        try:
+                            px0, py0, px1, py1 = crop_pixel_box(self._page_size(src), b.bbox)
+                            crops[key] = (hit, *crop_render_size(px1 - px0, py1 - py0))
+                            continue
+                        except Exception:
+                            pass
+                    self._cache_keys[key] = cache_key
+                crop_entries.append((key, src, b.bbox))
+        crops.update(crop_boxes(crop_entries, self._save_crop, workers=self.settings.crop_workers))
+        for key, first in aliases.items():
+            if first in crops:
+                crops[key] = crops[first]
+        if use_crop_cache:
+            crop_cache.prune()
+
+    def render(self, unit: RenderUnit) -> bytes | None:
+        items = [self.crops[(unit.kind, b.id)] for b in unit.boxes if (unit.kind, b.id) in self.crops]
+        if unit.kind == "q":
+            fragment = render_question_fragment(items, has_header=bool(unit.header), sources=self.sources)
+        else:
+            fragment = render_answer_fragment(items, sources=self.sources)
+        # 有框没裁出来（页面图片缺失）的片段不缓存，下次重新排版
+        if fragment is not None and unit.key and len(items) == len(unit.boxes):
+            fragment_cache.store(unit.key, fragment, "pdf")
+        return fragment
+
+    def append(self, assembler: PdfAssembler, unit: RenderUnit) -> None:
+        if not unit.boxes:
+            return
+        if unit.cached is not None:
+            try:
+                assembler.append(unit.cached, unit.header, unit.continued_header)
+                return
+            except Exception:
+                # 片段在查找之后被淘汰（或文件损坏）：当场重新排版
+                self.prepare_crops([unit])
+        fragment = self.render(unit)
+        if fragment is not None:
+            assembler.append(fragment, unit.header, unit.continued_header)
+
+    def release_crops(self) -> None:
+        self.crops.clear()
+        self._cache_keys.clear()
+
+    def close(self) -> None:
+        self.sources.close()
+
+
+def render_units(
+    units: list[RenderUnit],
+    settings: RenderSettings,
+    assembler: PdfAssembler,
+    on_unit: Callable[[str], None] | None = None,
+    on_crops: Callable[[], None] | None = None,
+) -> None:
+    """Crop the boxes of uncached units, then append every unit's fragment to `assembler` in order.
+
+    Works in batches of `settings.batch_units`: a batch's crops are dropped
+    once its fragments are appended. Decoded pages are cached up to
+    `settings.decoded_page_bytes` while this runs.
+    """
+    renderer = UnitRenderer(settings)
+    batch_units = max(1, settings.batch_units)
+    try:
+        with decoded_pages.use(settings.decoded_page_bytes):
+            for start in range(0, len(units), batch_units):
+                batch = units[start : start + batch_units]
+                # 只裁剪未命中片段的框
+                renderer.prepare_crops([u for u in batch if u.cached is None])
+                if start == 0 and on_crops is not None:
+                    on_crops()
+                for unit in batch:
+                    renderer.append(assembler, unit)
+                    if on_unit is not None:
+                        on_unit(unit.phase)
+                renderer.release_crops()
+        if settings.use_fragment_cache:
+            fragment_cache.prune()
+    finally:
+        renderer.close()
+
+
+def memory_budget_from_env() -> int:
+    """Export memory budget in bytes (PAPER_LABELER_EXPORT_MEMORY_MB)."""
+    try:
+        mb = int(os.getenv("PAPER_LABELER_EXPORT_MEMORY_MB", str(DEFAULT_MEMORY_MB)))
+    except ValueError:
+        mb = DEFAULT_MEMORY_MB
+    return max(64, mb) * 1024 * 1024
+
+
+def chunk_bytes_for(budget: int, processes: int = 1) -> int:
+    """Fragment bytes assembled in memory before a chunk is written out.
+
+    PyMuPDF holds roughly the appended bytes again in its object tables, and
+    the decoded-page cache and the current batch of crops need room too, so a
+    quarter of each process's share of the budget.
+    """
+    return max(8 * 1024 * 1024, budget // (4 * max(1, processes)))
+
+
+def settings_for_budget(settings: RenderSettings, budget: int, processes: int = 1) -> RenderSettings:
+    """`settings` sized to one process's share of the budget.
+
+    A quarter each for assembled pages (`chunk_bytes_for`), the decoded-page
+    cache and one batch of crops; the rest is left to PyMuPDF, the crop
+    threads' pages in flight and the interpreter.
+    """
+    quarter = budget // (4 * max(1, processes))
+    return replace(
+        settings,
+        chunk_bytes=chunk_bytes_for(budget, processes),
+        decoded_page_bytes=quarter,
+        batch_units=max(MIN_BATCH_UNITS, min(RENDER_BATCH_UNITS, quarter // CROP_BYTES_PER_UNIT)),
+    )
+
+
+def processes_for_budget(budget: int, processes: int) -> int:
+    """Cap the shard processes so each gets at least PROCESS_MIN_MEMORY of the budget."""
+    return max(1, min(processes, budget // PROCESS_MIN_MEMORY))
+
+
+def rss_bytes() -> int:
+    """Resident set size of this process (0 when it cannot be read)."""
+    try:
+        if sys.platform.startswith("linux"):
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        if sys.platform == "win32":
+            import ctypes
+            from ctypes import wintypes
+
+            class _Counters(ctypes.Structure):
+                _fields_ = [
+                    ("cb", wintypes.DWORD),
+                    ("PageFaultCount", wintypes.DWORD),
+                    ("PeakWorkingSetSize", ctypes.c_size_t),
+                    ("WorkingSetSize", ctypes.c_size_t),
+                    ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                    ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                    ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                    ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                    ("PagefileUsage", ctypes.c_size_t),
+                    ("PeakPagefileUsage", ctypes.c_size_t),
+                ]
+
+            counters = _Counters()
+            counters.cb = ctypes.sizeof(counters)
+            handle = ctypes.windll.kernel32.GetCurrentProcess()
+            if ctypes.windll.psapi.GetProcessMemoryInfo(handle, ctypes.byref(counters), counters.cb):
+                return int(counters.WorkingSetSize)
+            return 0
+        import resource
+
+        # 其他平台只有历史峰值（macOS 单位是字节）
+        return int(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+    except Exception:
+        return 0
+
+
+# ---- 多进程分片 ----
+
+_progress_queue = None
+
+
+def _init_shard_process(progress_queue) -> None:
+    global _progress_queue
+    _progress_queue = progress_queue
+
+
+def render_shard(units: list[RenderUnit], settings: RenderSettings, out_path: str) -> int:
+    """Worker entry point: render a shard to a partial PDF (headers, no page numbers); returns its pages."""
+    assembler = PdfAssembler(
+        number_pages=False, chunk_bytes=settings.chunk_bytes, spill_prefix=Path(out_path).with_suffix("")
+    )
+
+    def on_unit(phase: str) -> None:
+        if _progress_queue is not None:
+            _progress_queue.put((phase, rss_bytes()))
+
+    try:
+        render_units(units, settings, assembler, on_unit=on_unit)
+        assembler.save(Path(out_path))
+        return assembler.page_count
+    finally:
+        assembler.close()
+
+
+def processes_from_env() -> int:
+    try:
+        n = int(os.getenv("PAPER_LABELER_EXPORT_PROCESSES", str(min(8, os.cpu_count() or 1))))
+    except ValueError:
+        n = 1
+    return max(1, min(32, n))
+
+
+def plan_shards(units: list[RenderUnit], processes: int) -> list[list[RenderUnit]]:
+    """Contiguous shards of roughly equal work; a single shard when the job is too small to split."""
+    pending = sum(1 for u in units if u.boxes and u.cached is None)
+    n = min(processes, pending // SHARD_MIN_UNITS)
+    if n < 2:
+        return [units]
+    weights = [0.0 if not u.boxes else CACHED_UNIT_WEIGHT if u.cached is not None else 1.0 for u in units]
+    per_shard = sum(weights) / n
+    shards: list[list[RenderUnit]] = [[]]
+    acc = 0.0
+    for unit, weight in zip(units, weights):
+        if acc >= per_shard * len(shards) and len(shards) < n:
+            shards.append([])
+        shards[-1].append(unit)
+        acc += weight
+    return shards
+
+
+def render_shards(
+    shards: list[list[RenderUnit]],
+    settings: RenderSettings,
+    out_paths: list[Path],
+    on_unit: Callable[[str, int], None] | None = None,
+) -> list[int]:
+    """Render each shard to its partial PDF in a process pool; returns the page count of each.
+
+    `on_unit(phase, worker_rss_bytes)` is called as the workers finish units.
+    """
+    if not settings.crop_workers:
+        # 每个进程分到的裁剪线程，合计不超过 CPU 数
+        settings = replace(settings, crop_workers=max(1, math.ceil((os.cpu_count() or 1) / len(shards))))
+    ctx = multiprocessing.get_context("spawn")
+    progress = ctx.Queue()
+
+    def drain() -> None:
+        while True:
+            try:
+                phase, worker_rss = progress.get_nowait()
+            except queue_module.Empty:
+                return
+            if on_unit is not None:
+                on_unit(phase, worker_rss)
+
+    try:
+        with ProcessPoolExecutor(
+            max_workers=len(shards), mp_context=ctx, initializer=_init_shard_process, initargs=(progress,)
+        ) as pool:
+            futures = [pool.submit(render_shard, shard, settings, str(p)) for shard, p in zip(shards, out_paths)]
+            pending = set(futures)
+            while pending:
+                _, pending = wait(pending, timeout=0.2, return_when=FIRST_COMPLETED)
+                drain()
+            pages = [f.result() for f in futures]
+        drain()
+        return pages
+    finally:
+        progress.close()
@@ -0,0 +1,131 @@
+"""Export job scheduling: a fixed pool of worker threads claiming jobs from the job store.
+
+Queued jobs run in order of priority (higher first), then estimated cost
+(shorter first, so one big random export does not hold up the small ones
+queued behind it), then arrival. A waiting job's effective cost shrinks the
+longer it waits, so big jobs are delayed but never starved. The ordering is
+applied by `ExportJobStore.claim`, so it holds across server processes; each
+process runs its own pool, woken at once for jobs submitted to it and
+polling for the rest. The handler gets the claim's worker label and must
+pass it back to the store, so a run that lost its claim stops writing.
+"""
+from __future__ import annotations
+
+import os
+import threading
+import time
+import traceback
+from typing import Any, Callable
+
+from backend.services.export_jobs import ExportJobStore, retention_seconds_from_env, worker_label
+
+
+DEFAULT_WORKERS = 2
+POLL_SECONDS = 2.0  # 其他进程提交的任务最多等这么久被发现
+HEARTBEAT_SECONDS = 10.0
+PURGE_INTERVAL_SECONDS = 600.0
+
+
+class ExportScheduler:
+    def __init__(self, handler: Callable[[str, Any, str], None], store: ExportJobStore, workers: int = DEFAULT_WORKERS):
+        self._handler = handler
+        self.store = store
+        self.workers = max(1, int(workers))
+        self._cond = threading.Condition()
+        self._kicks = 0
+        self._running: dict[str, str] = {}  # 任务 id -> 领取它的 worker 标签
+        self._threads: list[threading.Thread] = []
+        self._housekeeper: threading.Thread | None = None
+        self.completed = 0
+
+    def _ensure_started(self) -> None:
+        # 调用方持有 self._cond
+        while len(self._threads) < self.workers:
+            t = threading.Thread(target=self._worker, name=f"export-worker-{len(self._threads) + 1}", daemon=True)
+            self._threads.append(t)
+            t.start()
+        if self._housekeeper is None:
+            self._housekeeper = threading.Thread(target=self._housekeeping, name="export-housekeeping", daemon=True)
+            self._housekeeper.start()
+
+    def start(self) -> None:
+        """Start the workers (at server startup, so jobs queued before a restart resume)."""
+        with self._cond:
+            self._ensure_started()
+
+    def wake(self) -> None:
+        """A job was queued: let an idle worker claim it now instead of at its next poll."""
+        with self._cond:
+            self._ensure_started()
+            self._kicks += 1
+            self._cond.notify()
+
+    def position(self, job_id: str) -> int:
+        """Queue position of a job (0 = next to start)."""
+        return self.store.position(job_id)
+
+    def stats(self) -> dict:
+        with self._cond:
+            running_here = sorted(self._running)
+            completed = self.completed
+        return {
+            "workers": self.workers,
+            "running": self.store.running_ids(),
+            "running_here": running_here,
+            "queued": self.store.queued_ids(),
+            "completed": completed,
+        }
+
+    def _worker(self) -> None:
+        while True:
+            worker = worker_label()
+            try:
+                claimed = self.store.claim(worker)
+            except Exception:
+                traceback.print_exc()
+                claimed = None
+            if claimed is None:
+                with self._cond:
+                    if not self._kicks:
+                        self._cond.wait(POLL_SECONDS)
+                    if self._kicks:
+                        self._kicks -= 1
+                continue
+            job_id, payload = claimed
+            with self._cond:
+                self._running[job_id] = worker
+            try:
+                self._handler(job_id, payload, worker)
+            except Exception:
+                traceback.print_exc()
+            finally:
+                with self._cond:
+                    self._running.pop(job_id, None)
+                    self.completed += 1
+
+    def _housekeeping(self) -> None:
+        last_purge = 0.0
+        while True:
+            try:
+                with self._cond:
+                    running = list(self._running.values())
+                self.store.heartbeat(running)
+                # 进程被杀、服务重启时没做完的任务重新排队
+                if self.store.requeue_stale():
+                    with self._cond:
+                        self._kicks += self.workers
+                        self._cond.notify_all()
+                if time.monotonic() - last_purge >= PURGE_INTERVAL_SECONDS or not last_purge:
+                    self.store.purge_expired(retention_seconds_from_env())
+                    last_purge = time.monotonic()
+            except Exception:
+                traceback.print_exc()
+            time.sleep(HEARTBEAT_SECONDS)
+
+
+def workers_from_env() -> int:
+    try:
+        n = int(os.getenv("PAPER_LABELER_EXPORT_WORKERS", str(DEFAULT_WORKERS)))
+    except ValueError:
+        n = DEFAULT_WORKERS
+    return max(1, min(8, n))
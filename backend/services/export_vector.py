@@ -0,0 +1,98 @@
+"""Vector export: clipped regions of the original PDF pages instead of raster crops.
+
+The fpdf layout pass stays the same (borders, answer placement); it only
+records where each box goes. After fpdf has written a fragment,
+`stamp_regions` opens it with PyMuPDF and draws every region with
+`show_pdf_page`, so questions stay vector at any zoom and each source page is
+embedded once per fragment (as a form XObject) however many of its boxes are
+placed.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from pathlib import Path
+
+import fitz
+
+from backend.services.export_images import crop_pixel_box
+from backend.services.paper_utils import RENDER_ZOOM
+
+
+MM_TO_PT = 72 / 25.4
+
+
+@dataclass(frozen=True)
+class PdfRegion:
+    pdf_path: str
+    page: int  # 1-based
+    bbox: tuple[float, float, float, float]  # normalized, in rendered (rotated) page space
+
+
+class SourcePdfs:
+    """Source PDFs opened once per export.
+
+    Owned by the thread rendering that export, like its PdfAssembler: fitz
+    documents are never shared between threads, so parallel exports need no
+    lock around their PyMuPDF calls.
+    """
+
+    def __init__(self):
+        self._docs: dict[str, fitz.Document | None] = {}
+
+    def doc(self, pdf_path: str) -> fitz.Document | None:
+        if pdf_path not in self._docs:
+            try:
+                self._docs[pdf_path] = fitz.open(pdf_path) if Path(pdf_path).exists() else None
+            except Exception:
+                self._docs[pdf_path] = None
+        return self._docs[pdf_path]
+
+    def region(self, pdf_path: str | None, page: int, bbox) -> PdfRegion | None:
+        """A PdfRegion for the box, or None when the source page is unavailable."""
+        if not pdf_path:
+            return None
+        doc = self.doc(str(pdf_path))
+        if doc is None or not (1 <= int(page) <= doc.page_count):
+            return None
+        return PdfRegion(str(pdf_path), int(page), tuple(float(v) for v in bbox))
+
+    def pixel_size(self, region: PdfRegion) -> tuple[int, int]:
+        """Size of the region in the 4x page render, so layout matches the raster export."""
+        doc = self.doc(region.pdf_path)
+        r = doc[region.page - 1].rect
+        px0, py0, px1, py1 = crop_pixel_box(
+            (round(r.width * RENDER_ZOOM), round(r.height * RENDER_ZOOM)), list(region.bbox)
+        )
+        return px1 - px0, py1 - py0
+
+    def close(self) -> None:
+        for doc in self._docs.values():
+            if doc is not None:
+                doc.close()
+        self._docs.clear()
+
+
+def stamp_regions(
+    pdf_bytes: bytes,
+    placements: list[tuple[int, float, float, float, float, PdfRegion]],
+    sources: SourcePdfs,
+) -> bytes:
+    """Draw each (page_no, x, y, w, h in mm, region) into an fpdf-written PDF; returns the new bytes."""
+    if not placements:
+        return pdf_bytes
+    out = fitz.open("pdf", pdf_bytes)
+    try:
+        for page_no, x, y, w, h, region in placements:
+            src_doc = sources.doc(region.pdf_path)
+            src_page = src_doc[region.page - 1]
+            r = src_page.rect
+            x0, y0, x1, y1 = region.bbox
+            # bbox 是渲染图（已旋转）坐标；show_pdf_page 的 clip 用未旋转的页面坐标
+            clip = fitz.Rect(
+                r.x0 + x0 * r.width, r.y0 + y0 * r.height, r.x0 + x1 * r.width, r.y0 + y1 * r.height
+            ) * src_page.derotation_matrix
+            target = fitz.Rect(x, y, x + w, y + h) * MM_TO_PT
+            out[page_no - 1].show_pdf_page(target, src_doc, region.page - 1, clip=clip)
+        return out.tobytes(garbage=3, deflate=True)
+    finally:
+        out.close()
@@ -0,0 +1,481 @@
+"""Optional in-memory faceted bitmap index over questions.
+
+Every question gets a bit position; each facet value (paper, year token, season
+token, section, status, favorite, section count, ...) keeps a Python int used as
+a bitset. A Filter query becomes a handful of AND/OR operations, and per-facet
+counts for the current filter are `(result & bits).bit_count()`.
+
+Bit positions follow the Filter view ordering (numeric question_no desc, then
+id desc) with the first displayed question on the highest bit, so a page is
+read by walking set bits from the top. New questions normally get the next
+global number and therefore simply take the next position; anything that would
+land elsewhere marks the index for a rebuild.
+
+Routes record what they touched with touch_questions/touch_papers/touch_all
+before committing; the changes are applied from the commit hook before the
+search cache generation is bumped. Disable with PAPER_LABELER_FACET_INDEX=0.
+"""
+from __future__ import annotations
+
+import os
+import re
+import threading
+from dataclasses import dataclass
+
+from backend.database import SessionLocal, Paper, Question, QuestionBox, QuestionSection
+from backend.services.search_cache import on_commit
+
+
+_BLOCK_BITS = 4096
+_PENDING_KEY = "facet_index_pending"
+
+
+def _extract_year_season(source: str) -> tuple[str | None, str | None]:
+    m = re.search(r"_(m|s|w)(\d{2})_", source, flags=re.IGNORECASE)
+    if not m:
+        return None, None
+    return m.group(2), m.group(1).lower()
+
+
+def _paper_tokens(y, s, exam_code, filename) -> tuple[str | None, str | None]:
+    if not y or not s:
+        py, ps = _extract_year_season(f"{exam_code or ''} {filename or ''}")
+        y = y or py
+        s = s or ps
+    return y, s
+
+
+def _mask_from_positions(positions: list[int], nbits: int) -> int:
+    buf = bytearray((nbits + 7) // 8)
+    for p in positions:
+        buf[p >> 3] |= 1 << (p & 7)
+    return int.from_bytes(buf, "little")
+
+
+def _sort_key(qid: int, question_no) -> tuple:
+    s = str(question_no or "").strip()
+    if s.isdigit():
+        return (0, -int(s), -int(qid))
+    return (1, 0, -int(qid))
+
+
+@dataclass(frozen=True)
+class _QRec:
+    paper_id: int
+    question_no: str | None
+    status: str | None
+    favorite: bool
+    sections: frozenset
+    section_count: int
+    legacy_section: str | None
+    has_boxes: bool
+    year: str | None
+    season: str | None
+
+    def facet_values(self):
+        yield "paper", self.paper_id
+        yield "year", self.year
+        yield "season", self.season
+        yield "status", self.status
+        if self.question_no:
+            yield "question_no", self.question_no
+        if self.favorite:
+            yield "favorite", True
+        for name in self.sections:
+            yield "section", name
+        yield "section_count", min(self.section_count, 2)
+        if self.section_count == 0 and not self.legacy_section and self.has_boxes:
+            yield "unsectioned", True
+
+
+class BitsetResult:
+    """Immutable ordered view over a result bitset (behaves like a tuple of ids)."""
+
+    def __init__(self, mask: int, qid_at: list, pos_of: dict):
+        self._mask = mask
+        self._qid_at = qid_at
+        self._pos_of = pos_of
+        self._len = mask.bit_count()
+
+    def __len__(self) -> int:
+        return self._len
+
+    def _positions_from_top(self, start: int, count: int) -> list[int]:
+        out: list[int] = []
+        mask = self._mask
+        skip = max(0, start)
+        top = mask.bit_length()
+        while top > 0 and len(out) < count:
+            lo = max(0, top - _BLOCK_BITS)
+            block = (mask >> lo) & ((1 << (top - lo)) - 1)
+            c = block.bit_count()
+            if skip >= c:
+                skip -= c
+                top = lo
+                continue
+            while block and len(out) < count:
+                b = block.bit_length() - 1
+                block ^= 1 << b
+                if skip:
+                    skip -= 1
+                    continue
+                out.append(lo + b)
+            top = lo
+        return out
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            start, stop, step = item.indices(self._len)
+            if step != 1:
+                return tuple(self[i] for i in range(start, stop, step))
+            if stop <= start:
+                return ()
+            return tuple(self._qid_at[p] for p in self._positions_from_top(start, stop - start))
+        idx = int(item)
+        if idx < 0:
+            idx += self._len
+        if idx < 0 or idx >= self._len:
+            raise IndexError(item)
+        return self._qid_at[self._positions_from_top(idx, 1)[0]]
+
+    def __iter__(self):
+        return iter(self[0:self._len])
+
+    def index(self, qid) -> int:
+        pos = self._pos_of.get(int(qid))
+        if pos is None or not (self._mask >> pos) & 1:
+            raise ValueError(qid)
+        return (self._mask >> (pos + 1)).bit_count()
+
+
+class FacetIndex:
+    def __init__(self, enabled: bool = True):
+        self.enabled = bool(enabled)
+        self.ready = False
+        self.needs_rebuild = False
+        self.builds = 0
+        self.incremental_updates = 0
+        self._commit_seq = 0
+        self._lock = threading.RLock()
+        self._rebuild_thread: threading.Thread | None = None
+        self._reset()
+
+    def _reset(self) -> None:
+        self._qid_at: list[int] = []
+        self._pos_of: dict[int, int] = {}
+        self._recs: dict[int, _QRec] = {}
+        self._alive = 0
+        self._bits: dict[str, dict] = {}
+        self._first_key: tuple | None = None
+
+    # ---------- building ----------
+
+    def _load(self, db, qids: list[int] | None = None) -> dict[int, _QRec]:
+        q = db.query(
+            Question.id, Question.paper_id, Question.question_no, Question.status,
+            Question.is_favorite, Question.section,
+        )
+        if qids is not None:
+            if not qids:
+                return {}
+            q = q.filter(Question.id.in_(qids))
+        rows = q.all()
+        found = [int(r[0]) for r in rows]
+        paper_ids = sorted({int(r[1]) for r in rows})
+
+        tokens: dict[int, tuple] = {}
+        if paper_ids:
+            pq = db.query(Paper.id, Paper.year_token, Paper.season_token, Paper.exam_code, Paper.filename)
+            if qids is not None:
+                pq = pq.filter(Paper.id.in_(paper_ids))
+            for pid, y, s, code, fn in pq.all():
+                tokens[int(pid)] = _paper_tokens(y, s, code, fn)
+
+        sections: dict[int, set] = {}
+        sq = db.query(QuestionSection.question_id, QuestionSection.section_name)
+        bq = db.query(QuestionBox.question_id).distinct()
+        if qids is not None:
+            sq = sq.filter(QuestionSection.question_id.in_(found))
+            bq = bq.filter(QuestionBox.question_id.in_(found))
+        for qid, name in sq.all():
+            sections.setdefault(int(qid), set()).add(name)
+        with_boxes = {int(qid) for (qid,) in bq.all()}
+
+        recs: dict[int, _QRec] = {}
+        for qid, pid, qno, status, fav, legacy in rows:
+            qid = int(qid)
+            if int(pid) not in tokens:
+                continue  # orphan question: the search joins Paper, so skip it here too
+            rel = sections.get(qid, set())
+            names = set(rel)
+            if legacy:
+                names.add(legacy)
+            y, s = tokens[int(pid)]
+            recs[qid] = _QRec(
+                paper_id=int(pid),
+                question_no=str(qno).strip() if qno is not None and str(qno).strip() else None,
+                status=status or None,
+                favorite=bool(fav),
+                sections=frozenset(names),
+                section_count=len(rel),
+                legacy_section=legacy or None,
+                has_boxes=qid in with_boxes,
+                year=y,
+                season=s,
+            )
+        return recs
+
+    def _set_bits(self, pos: int, rec: _QRec, on: bool) -> None:
+        bit = 1 << pos
+        for facet, value in rec.facet_values():
+            values = self._bits.setdefault(facet, {})
+            cur = values.get(value, 0)
+            if on:
+                values[value] = cur | bit
+            else:
+                cur &= ~bit
+                if cur:
+                    values[value] = cur
+                else:
+                    values.pop(value, None)
+
+    def rebuild(self) -> None:
+        with self._lock:
+            seq = self._commit_seq
+        with SessionLocal() as db:
+            recs = self._load(db)
+        ordered = sorted(recs, key=lambda qid: _sort_key(qid, recs[qid].question_no))
+        n = len(ordered)
+        # Display order runs from the highest bit down.
+        pos_of = {qid: n - 1 - i for i, qid in enumerate(ordered)}
+        positions: dict[str, dict] = {}
+        for qid, pos in pos_of.items():
+            for facet, value in recs[qid].facet_values():
+                positions.setdefault(facet, {}).setdefault(value, []).append(pos)
+        bits = {
+            facet: {value: _mask_from_positions(ps, n) for value, ps in values.items()}
+            for facet, values in positions.items()
+        }
+        with self._lock:
+            if self._commit_seq != seq:
+                # A tracked write landed while loading; this snapshot may miss it.
+                self.ready = False
+                self.needs_rebuild = True
+                return
+            self._reset()
+            self._qid_at = list(reversed(ordered))
+            self._pos_of = pos_of
+            self._recs = recs
+            self._alive = (1 << n) - 1
+            self._bits = bits
+            self._first_key = _sort_key(ordered[0], recs[ordered[0]].question_no) if ordered else None
+            self.ready = True
+            self.needs_rebuild = False
+            self.builds += 1
+
+    def start(self) -> None:
+        if not self.enabled:
+            return
+        self._rebuild_async()
+
+    def _rebuild_async(self) -> None:
+        with self._lock:
+            if self._rebuild_thread is not None and self._rebuild_thread.is_alive():
+                return
+
+            def run():
+                for _ in range(5):
+                    try:
+                        self.rebuild()
+                    except Exception:
+                        with self._lock:
+                            self.ready = False
+                        return
+                    if self.ready:
+                        return
+
+            self._rebuild_thread = threading.Thread(target=run, daemon=True)
+            self._rebuild_thread.start()
+
+    # ---------- incremental updates ----------
+
+    def _pending(self, db) -> dict:
+        return db.info.setdefault(_PENDING_KEY, {"qids": set(), "pids": set(), "all": False})
+
+    def touch_questions(self, db, qids) -> None:
+        if self.enabled:
+            self._pending(db)["qids"].update(int(x) for x in qids)
+
+    def touch_papers(self, db, pids) -> None:
+        if self.enabled:
+            self._pending(db)["pids"].update(int(x) for x in pids)
+
+    def touch_all(self, db) -> None:
+        if self.enabled:
+            self._pending(db)["all"] = True
+
+    def apply_pending(self, session) -> None:
+        # Touches stay on the session so later commits of the same request
+        # (several routes commit in steps) re-sync the same rows.
+        pending = session.info.get(_PENDING_KEY)
+        if not pending or not self.enabled:
+            return
+        with self._lock:
+            self._commit_seq += 1
+            if not self.ready:
+                self.needs_rebuild = True
+                return
+            if pending["all"]:
+                self.ready = False
+                self.needs_rebuild = True
+            else:
+                try:
+                    self._apply(pending["qids"], pending["pids"])
+                except Exception:
+                    self.ready = False
+                    self.needs_rebuild = True
+        if self.needs_rebuild:
+            self._rebuild_async()
+
+    def _apply(self, qids: set, pids: set) -> None:
+        targets = set(qids)
+        with SessionLocal() as db:
+            if pids:
+                for pid in pids:
+                    bits = self._bits.get("paper", {}).get(int(pid), 0)
+                    targets.update(self._qids_in(bits))
+                targets.update(
+                    int(qid) for (qid,) in db.query(Question.id).filter(Question.paper_id.in_(sorted(pids))).all()
+                )
+            recs = self._load(db, sorted(targets))
+        for qid in targets:
+            old = self._recs.get(qid)
+            new = recs.get(qid)
+            pos = self._pos_of.get(qid)
+            if old is not None and pos is not None:
+                self._set_bits(pos, old, False)
+                self._alive &= ~(1 << pos)
+                del self._recs[qid]
+            if new is None:
+                continue
+            key = _sort_key(qid, new.question_no)
+            if pos is not None and old is not None and old.question_no != new.question_no:
+                # Ordering changed: positions no longer reflect display order.
+                self.ready = False
+                self.needs_rebuild = True
+                return
+            if pos is None:
+                if self._first_key is not None and key > self._first_key:
+                    self.ready = False
+                    self.needs_rebuild = True
+                    return
+                pos = len(self._qid_at)
+                self._qid_at.append(qid)
+                self._pos_of[qid] = pos
+                self._first_key = key
+            self._recs[qid] = new
+            self._alive |= 1 << pos
+            self._set_bits(pos, new, True)
+        self.incremental_updates += 1
+
+    def _qids_in(self, mask: int) -> list[int]:
+        out = []
+        while mask:
+            b = mask.bit_length() - 1
+            mask ^= 1 << b
+            out.append(self._qid_at[b])
+        return out
+
+    # ---------- queries ----------
+
+    def _any_of(self, facet: str, values) -> int:
+        bits = self._bits.get(facet, {})
+        out = 0
+        for v in values:
+            out |= bits.get(v, 0)
+        return out
+
+    def _constraint_masks(self, filters: dict) -> dict[str, int]:
+        """One mask per active filter dimension (keyed by dimension name)."""
+        masks: dict[str, int] = {}
+        if filters.get("paper_ids"):
+            masks["paper"] = self._any_of("paper", filters["paper_ids"])
+        if filters.get("question_no"):
+            masks["question_no"] = self._any_of("question_no", [filters["question_no"]])
+        if filters.get("section"):
+            masks["section"] = self._any_of("section", [filters["section"]])
+        if filters.get("unsectioned"):
+            masks["unsectioned"] = self._any_of("unsectioned", [True])
+        if filters.get("status"):
+            masks["status"] = self._any_of("status", [filters["status"]])
+        if filters.get("favorite"):
+            masks["favorite"] = self._any_of("favorite", [True])
+        if filters.get("years"):
+            masks["year"] = self._any_of("year", filters["years"])
+        if filters.get("seasons"):
+            masks["season"] = self._any_of("season", filters["seasons"])
+        if filters.get("exclude_multi_section"):
+            masks["section_count"] = self._any_of("section_count", [0, 1])
+        return masks
+
+    def usable(self) -> bool:
+        return self.enabled and self.ready and not self.needs_rebuild
+
+    def query(self, filters: dict) -> BitsetResult | None:
+        """Ordered result for normalized Filter conditions, or None when the index can't serve it."""
+        if filters.get("q"):
+            return None  # 全文检索条件不在位图里
+        with self._lock:
+            if not self.usable():
+                return None
+            mask = self._alive
+            for m in self._constraint_masks(filters).values():
+                mask &= m
+            return BitsetResult(mask, self._qid_at, self._pos_of)
+
+    def facet_counts(self, filters: dict, facets=("section", "year", "season", "paper", "favorite")) -> dict | None:
+        """Per-value counts for each facet under the filter minus that facet's own condition.
+
+        The result also carries the total under the full filter as `"total"`.
+        """
+        own = {"section": ("section", "unsectioned"), "unsectioned": ("section", "unsectioned")}
+        if filters.get("q"):
+            return None  # 全文检索条件不在位图里
+        with self._lock:
+            if not self.usable():
+                return None
+            masks = self._constraint_masks(filters)
+            total = self._alive
+            for m in masks.values():
+                total &= m
+            out: dict = {"total": total.bit_count()}
+            for facet in facets:
+                skip = own.get(facet, (facet,))
+                base = self._alive
+                for name, m in masks.items():
+                    if name not in skip:
+                        base &= m
+                counts = {}
+                for value, bits in self._bits.get(facet, {}).items():
+                    c = (base & bits).bit_count()
+                    if c:
+                        counts[value] = c
+                out[facet] = counts
+            return out
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "ready": self.ready,
+                "needs_rebuild": self.needs_rebuild,
+                "questions": self._alive.bit_count(),
+                "positions": len(self._qid_at),
+                "facet_values": {k: len(v) for k, v in self._bits.items()},
+                "builds": self.builds,
+                "incremental_updates": self.incremental_updates,
+            }
+
+
+facet_index = FacetIndex(enabled=os.getenv("PAPER_LABELER_FACET_INDEX", "1").strip() not in {"0", "false", "no"})
+on_commit(facet_index.apply_pending)
@@ -0,0 +1,109 @@
+"""Version tokens for rendered page images (cache-busting `?v=` in image URLs).
+
+A paper's pages are always rendered together, so one token per render covers
+every page. The token is written to `papers.pages_version` when the PDF is
+rendered and mirrored in memory, so building an image URL never stats a file.
+Papers rendered before the column existed get a token from their page
+directory's mtime once at startup. Papers without a token (unknown id, not
+rendered yet) are re-read from the database at most every MISS_TTL_SECONDS.
+"""
+from __future__ import annotations
+
+import threading
+import time
+
+from backend.config import PAGE_DIR
+from backend.database import Paper, SessionLocal
+from backend.utils import _with_cache_bust
+
+
+MISS_TTL_SECONDS = 5.0  # 没有版本号的试卷（不存在/未渲染，或由别的进程刚渲染）隔几秒再查库
+
+
+class PageAssetRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versions: dict[int, str | None] = {}
+        self._page_counts: dict[int, int | None] = {}
+        self._miss_until: dict[int, float] = {}
+        self.loads = 0
+
+    @staticmethod
+    def new_token() -> str:
+        return format(time.time_ns() // 1_000_000, "x")
+
+    def _put(self, paper_id: int, version: str | None, page_count: int | None) -> None:
+        with self._lock:
+            self._versions[int(paper_id)] = version
+            self._page_counts[int(paper_id)] = int(page_count) if page_count else None
+            if version:
+                self._miss_until.pop(int(paper_id), None)
+            else:
+                self._miss_until[int(paper_id)] = time.monotonic() + MISS_TTL_SECONDS
+
+    def load(self) -> int:
+        """Load every paper's token; backfill papers that predate `pages_version` (one stat per paper)."""
+        backfilled = 0
+        with SessionLocal() as db:
+            for paper in db.query(Paper).all():
+                if not paper.pages_version and paper.page_count:
+                    try:
+                        paper.pages_version = str(int((PAGE_DIR / f"paper_{paper.id}").stat().st_mtime))
+                        backfilled += 1
+                    except OSError:
+                        pass
+                self._put(paper.id, paper.pages_version, paper.page_count)
+            if backfilled:
+                db.commit()
+        with self._lock:
+            self.loads += 1
+        return backfilled
+
+    def mark_rendered(self, paper: Paper, page_count: int) -> str:
+        """Record a (re-)render: new token on the paper row (caller commits) and in memory."""
+        token = self.new_token()
+        paper.pages_version = token
+        self._put(paper.id, token, page_count)
+        return token
+
+    def _ensure(self, paper_id: int) -> None:
+        if self._versions.get(paper_id):
+            return
+        if paper_id in self._versions and self._miss_until.get(paper_id, 0.0) > time.monotonic():
+            return
+        with SessionLocal() as db:
+            row = db.query(Paper.pages_version, Paper.page_count).filter(Paper.id == paper_id).one_or_none()
+        self._put(paper_id, row[0] if row else None, row[1] if row else None)
+
+    def version(self, paper_id: int) -> str | None:
+        paper_id = int(paper_id)
+        self._ensure(paper_id)
+        return self._versions.get(paper_id)
+
+    def page_count(self, paper_id: int) -> int | None:
+        paper_id = int(paper_id)
+        self._ensure(paper_id)
+        return self._page_counts.get(paper_id)
+
+    def forget(self, paper_id: int) -> None:
+        with self._lock:
+            self._versions.pop(int(paper_id), None)
+            self._page_counts.pop(int(paper_id), None)
+            self._miss_until.pop(int(paper_id), None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._versions.clear()
+            self._page_counts.clear()
+            self._miss_until.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"papers": len(self._versions), "loads": self.loads}
+
+
+page_assets = PageAssetRegistry()
+
+
+def page_image_url(paper_id: int, page: int) -> str:
+    return _with_cache_bust(f"/data/pages/paper_{int(paper_id)}/page_{int(page)}.png", page_assets.version(paper_id))
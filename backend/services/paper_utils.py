@@ -12,6 +12,10 @@ from backend.config import MAX_UPLOAD_BYTES
 from backend.database import SessionLocal, Paper
 
 
+# 页面图片的渲染倍率（72dpi × 4 ≈ 288dpi）；导出按它把 bbox 换算成像素/毫米
+RENDER_ZOOM = 4
+
+
 def extract_year_from_filename(name: str) -> Optional[int]:
     """Extract 2-digit year from filenames like '9709_s23_qp_23.pdf' -> 23.
 
@@ -74,7 +78,7 @@ def render_pdf_to_images(pdf_path: Path, output_dir: Path) -> int:
     try:
         for page_index in range(len(doc)):
             page = doc[page_index]
-            matrix = fitz.Matrix(4, 4)
+            matrix = fitz.Matrix(RENDER_ZOOM, RENDER_ZOOM)
             pix = page.get_pixmap(matrix=matrix)
 
             image_path = output_dir / f"page_{page_index + 1}.png"
@@ -0,0 +1,416 @@
+"""Perceptual hashes of question crops + a BK-tree for near-duplicate lookup.
+
+Each question's boxes are rendered small and grey straight from the PDF,
+stacked vertically, trimmed to their content and reduced to a 128-bit dHash
+(64 horizontal + 64 vertical gradient bits). Hashes live in `question_hashes`
+and in an in-memory BK-tree, so "everything within Hamming distance d" is a
+tree walk instead of a pairwise scan.
+
+A background worker keeps hashes in sync with box edits (driven by the
+question content change notifications) and backfills existing banks. Tree
+updates are queued on the session and applied only after its commit, so a
+rolled-back batch never leaves phantom hashes behind.
+"""
+from __future__ import annotations
+
+import json
+import threading
+from datetime import datetime
+
+import fitz
+from PIL import Image, ImageOps
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from backend.database import Question, QuestionBox, QuestionHash, SessionLocal, engine
+from backend.services import question_text
+from backend.services.question_text import PdfDocCache
+from backend.services.search_cache import on_commit
+
+
+RENDER_ZOOM = 0.5           # 约 36 dpi，足够算 9x8 的梯度哈希
+MIN_DETAIL_BITS = 12        # 几乎空白的截图哈希没有区分度，不参与重复判断
+DEFAULT_MAX_DISTANCE = 6         # 128 位里最多差 6 位（文字截图之间的差异本来就小，阈值要收紧）
+_PENDING_KEY = "question_hash_pending"
+
+
+def dhash(img: Image.Image) -> int:
+    """128-bit difference hash: 8x8 horizontal gradients followed by 8x8 vertical ones."""
+    g = img.convert("L")
+    h_px = g.resize((9, 8), Image.LANCZOS).tobytes()
+    v_px = g.resize((8, 9), Image.LANCZOS).tobytes()
+    bits = 0
+    for r in range(8):
+        row = h_px[r * 9 : r * 9 + 9]
+        for c in range(8):
+            bits = (bits << 1) | (row[c] > row[c + 1])
+    for r in range(8):
+        top, bottom = v_px[r * 8 : r * 8 + 8], v_px[(r + 1) * 8 : (r + 1) * 8 + 8]
+        for c in range(8):
+            bits = (bits << 1) | (top[c] > bottom[c])
+    return bits
+
+
+def boxes_signature(paper_id: int, boxes) -> str:
+    return f"{int(paper_id)}:" + json.dumps([[int(p), [round(float(v), 4) for v in b]] for p, b in boxes])
+
+
+def render_boxes(docs: PdfDocCache, paper_id: int, boxes) -> Image.Image | None:
+    """Boxes of one question rendered from the PDF and stacked top to bottom (grey)."""
+    doc = docs.get(paper_id)
+    if doc is None:
+        return None
+    parts: list[Image.Image] = []
+    for page_no, bbox in boxes:
+        try:
+            page = doc[int(page_no) - 1]
+            r = page.rect
+            x0, y0, x1, y1 = [float(v) for v in bbox]
+            clip = fitz.Rect(r.x0 + x0 * r.width, r.y0 + y0 * r.height, r.x0 + x1 * r.width, r.y0 + y1 * r.height)
+            pix = page.get_pixmap(matrix=fitz.Matrix(RENDER_ZOOM, RENDER_ZOOM), clip=clip, colorspace=fitz.csGRAY, alpha=False)
+        except Exception:
+            continue
+        if pix.width > 0 and pix.height > 0:
+            parts.append(Image.frombytes("L", (pix.width, pix.height), pix.samples))
+    if not parts:
+        return None
+    width = max(p.width for p in parts)
+    out = Image.new("L", (width, sum(p.height for p in parts)), 255)
+    y = 0
+    for p in parts:
+        out.paste(p, (0, y))
+        y += p.height
+    # 裁掉四周空白：同一道题框得松或紧不应影响哈希
+    content = ImageOps.invert(out).point(lambda v: 255 if v > 24 else 0).getbbox()
+    return out.crop(content) if content else out
+
+
+class _BKNode:
+    __slots__ = ("hash", "qids", "children")
+
+    def __init__(self, h: int):
+        self.hash = h
+        self.qids: set[int] = set()
+        self.children: dict[int, _BKNode] = {}
+
+
+class BKTree:
+    """BK-tree over Hamming distance; several questions can share one hash node."""
+
+    def __init__(self):
+        self.root: _BKNode | None = None
+        self.nodes = 0
+
+    def add(self, h: int, qid: int) -> None:
+        if self.root is None:
+            self.root = _BKNode(h)
+            self.nodes = 1
+        node = self.root
+        while True:
+            d = (node.hash ^ h).bit_count()
+            if d == 0:
+                node.qids.add(qid)
+                return
+            child = node.children.get(d)
+            if child is None:
+                child = node.children[d] = _BKNode(h)
+                self.nodes += 1
+                child.qids.add(qid)
+                return
+            node = child
+
+    def discard(self, h: int, qid: int) -> None:
+        node = self.root
+        while node is not None:
+            d = (node.hash ^ h).bit_count()
+            if d == 0:
+                node.qids.discard(qid)
+                return
+            node = node.children.get(d)
+
+    def search(self, h: int, max_distance: int) -> list[tuple[int, int]]:
+        """(question id, distance) for every stored hash within max_distance of h."""
+        out: list[tuple[int, int]] = []
+        if self.root is None:
+            return out
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            d = (node.hash ^ h).bit_count()
+            if d <= max_distance:
+                out.extend((q, d) for q in node.qids)
+            lo, hi = d - max_distance, d + max_distance
+            for cd, child in node.children.items():
+                if lo <= cd <= hi:
+                    stack.append(child)
+        return out
+
+
+class QuestionHashIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._cond = threading.Condition(self._lock)
+        self._tree = BKTree()
+        self._by_qid: dict[int, int] = {}
+        self._dirty: set[int] = set()
+        self._inflight: set[int] = set()
+        self._full_sync = False
+        self._groups_cache: dict[int, list[dict]] = {}
+        self.generation = 0
+        self._worker: threading.Thread | None = None
+        self.ready = False
+        self.hashed = 0
+        self.skipped = 0
+        self.failed = 0
+
+    # ---- lifecycle ---------------------------------------------------------
+
+    def start(self) -> None:
+        with self._lock:
+            self._full_sync = True
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="question-hash-worker", daemon=True)
+                self._worker.start()
+            self._cond.notify()
+
+    def on_content_change(self, qids) -> None:
+        with self._lock:
+            if qids is None:
+                self._full_sync = True
+            else:
+                self._dirty.update(qids)
+            self._cond.notify()
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                while not self._dirty and not self._full_sync:
+                    self._cond.wait()
+                full = self._full_sync
+                self._full_sync = False
+                batch = set(self._dirty)
+                self._dirty.clear()
+                self._inflight = set(batch)
+            try:
+                if full:
+                    self._sync_all()
+                if batch:
+                    self._sync(sorted(batch))
+            except Exception:
+                with self._lock:
+                    self.failed += 1
+            finally:
+                with self._lock:
+                    self._inflight = set()
+
+    # ---- hashing -----------------------------------------------------------
+
+    def _load_tree(self, db: Session) -> None:
+        tree = BKTree()
+        by_qid: dict[int, int] = {}
+        for qid, hx in db.query(QuestionHash.question_id, QuestionHash.dhash).all():
+            h = int(hx, 16)
+            by_qid[int(qid)] = h
+            tree.add(h, int(qid))
+        with self._lock:
+            self._tree, self._by_qid = tree, by_qid
+            self.generation += 1
+            self.ready = True
+
+    def _sync_all(self) -> None:
+        # 不走 SessionLocal：后台补算不应触发搜索缓存失效
+        with Session(engine) as db:
+            self._load_tree(db)
+            live = {int(x) for (x,) in db.query(QuestionBox.question_id).distinct().all()}
+            stale = [qid for qid in self._by_qid if qid not in live]
+        self._sync(sorted(live | set(stale)))
+
+    def _sync(self, qids: list[int], batch_size: int = 100) -> None:
+        with Session(engine) as db:
+            docs = PdfDocCache(db)
+            try:
+                for i in range(0, len(qids), batch_size):
+                    self._sync_batch(db, qids[i : i + batch_size], docs)
+                    db.commit()
+                    # Session(engine) 不挂 SessionLocal 的 after_commit 钩子，这里手动落到树上
+                    self.apply_pending(db)
+            finally:
+                docs.close()
+
+    def _sync_batch(self, db: Session, qids: list[int], docs: PdfDocCache) -> None:
+        boxes: dict[int, list] = {}
+        paper_of: dict[int, int] = {}
+        for qid, pid, page, bbox in (
+            db.query(QuestionBox.question_id, QuestionBox.paper_id, QuestionBox.page, QuestionBox.bbox)
+            .join(Question, Question.id == QuestionBox.question_id)
+            .filter(QuestionBox.question_id.in_(qids))
+            .order_by(QuestionBox.question_id, QuestionBox.page, QuestionBox.id)
+            .all()
+        ):
+            boxes.setdefault(int(qid), []).append((page, bbox))
+            paper_of[int(qid)] = int(pid)
+        rows = {int(r.question_id): r for r in db.query(QuestionHash).filter(QuestionHash.question_id.in_(qids)).all()}
+        for qid in qids:
+            row = rows.get(qid)
+            if qid not in boxes:
+                if row is not None:
+                    db.delete(row)
+                self._queue(db, qid, None)
+                continue
+            sig = boxes_signature(paper_of[qid], boxes[qid])
+            if row is not None and row.boxes_sig == sig:
+                self._queue(db, qid, int(row.dhash, 16))
+                with self._lock:
+                    self.skipped += 1
+                continue
+            h = self.compute(docs, paper_of[qid], boxes[qid])
+            if h is None:
+                with self._lock:
+                    self.failed += 1
+                continue
+            self._store(db, qid, h, sig, row)
+
+    def compute(self, docs: PdfDocCache, paper_id: int, boxes) -> int | None:
+        img = render_boxes(docs, paper_id, boxes)
+        return dhash(img) if img is not None else None
+
+    def _store(self, db: Session, qid: int, h: int, sig: str, row: QuestionHash | None = None) -> None:
+        hx = f"{h:032x}"
+        if row is None:
+            row = db.get(QuestionHash, qid)
+        if row is None:
+            db.add(QuestionHash(question_id=qid, dhash=hx, boxes_sig=sig))
+        else:
+            row.dhash, row.boxes_sig, row.updated_at = hx, sig, datetime.utcnow()
+        self._queue(db, qid, h)
+        with self._lock:
+            self.hashed += 1
+
+    def _queue(self, db: Session, qid: int, h: int | None) -> None:
+        """Record a tree update (None = remove) to apply once db commits."""
+        db.info.setdefault(_PENDING_KEY, {})[qid] = h
+
+    def apply_pending(self, session) -> None:
+        pending = session.info.pop(_PENDING_KEY, None)
+        if not pending:
+            return
+        with self._lock:
+            for qid, h in pending.items():
+                if h is None:
+                    self._forget(qid)
+                else:
+                    self._remember(qid, h)
+
+    def _remember(self, qid: int, h: int) -> None:
+        with self._lock:
+            old = self._by_qid.get(qid)
+            if old == h:
+                return
+            if old is not None:
+                self._tree.discard(old, qid)
+            self._by_qid[qid] = h
+            self._tree.add(h, qid)
+            self.generation += 1
+
+    def _forget(self, qid: int) -> None:
+        with self._lock:
+            old = self._by_qid.pop(qid, None)
+            if old is not None:
+                self._tree.discard(old, qid)
+                self.generation += 1
+
+    # ---- queries -----------------------------------------------------------
+
+    def duplicates_of(self, qid: int, *, max_distance: int = DEFAULT_MAX_DISTANCE) -> list[tuple[int, int]] | None:
+        """Likely duplicates of one question, or None while its hash is still queued for the worker."""
+        with self._lock:
+            if not self.ready or self._full_sync or qid in self._dirty or qid in self._inflight:
+                return None
+            h = self._by_qid.get(qid)
+            if h is None or h.bit_count() < MIN_DETAIL_BITS:
+                return []
+            hits = self._tree.search(h, max_distance)
+        return sorted(((q, d) for q, d in hits if q != qid), key=lambda x: (x[1], x[0]))
+
+    def duplicate_groups(self, max_distance: int = DEFAULT_MAX_DISTANCE) -> list[dict]:
+        """Connected groups of questions whose hashes are within max_distance (BK-tree walk per hash).
+
+        Cached per tree generation, so repeated reports between hash changes are free.
+        """
+        with self._lock:
+            key = (self.generation, max_distance)
+            cached = self._groups_cache.get(key)
+            if cached is not None:
+                return [dict(g, question_ids=list(g["question_ids"])) for g in cached]
+            items = [(q, h) for q, h in self._by_qid.items() if h.bit_count() >= MIN_DETAIL_BITS]
+            parent: dict[int, int] = {}
+
+            def find(x: int) -> int:
+                while parent.get(x, x) != x:
+                    parent[x] = parent.get(parent[x], parent[x])
+                    x = parent[x]
+                return x
+
+            seen_hashes: set[int] = set()
+            for _, h in items:
+                if h in seen_hashes:
+                    continue  # 同一哈希的题目在第一次查询时已全部连通
+                seen_hashes.add(h)
+                hits = [q for q, _ in self._tree.search(h, max_distance) if self._by_qid.get(q, 0).bit_count() >= MIN_DETAIL_BITS]
+                if len(hits) < 2:
+                    continue
+                anchor = find(hits[0])
+                for q in hits[1:]:
+                    rq = find(q)
+                    if rq != anchor:
+                        lo, hi = min(anchor, rq), max(anchor, rq)
+                        parent[hi] = lo
+                        parent.setdefault(lo, lo)
+                        anchor = lo
+
+            groups: dict[int, list[int]] = {}
+            for q in parent:
+                groups.setdefault(find(q), []).append(q)
+            hashes = {q: self._by_qid.get(q) for members in groups.values() for q in members}
+
+        out = []
+        for members in groups.values():
+            if len(members) < 2:
+                continue
+            members.sort()
+            first = hashes[members[0]]
+            out.append(
+                {
+                    "question_ids": members,
+                    "size": len(members),
+                    "max_distance": max((first ^ hashes[q]).bit_count() for q in members),
+                }
+            )
+        out.sort(key=lambda g: (-g["size"], g["question_ids"][0]))
+        with self._lock:
+            if self.generation == key[0]:
+                self._groups_cache = {k: v for k, v in self._groups_cache.items() if k[0] == key[0]}
+                self._groups_cache[key] = out
+        return [dict(g, question_ids=list(g["question_ids"])) for g in out]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "ready": self.ready,
+                "hashes": len(self._by_qid),
+                "tree_nodes": self._tree.nodes,
+                "pending": len(self._dirty) + (1 if self._full_sync else 0),
+                "hashed": self.hashed,
+                "skipped_unchanged": self.skipped,
+                "failed": self.failed,
+            }
+
+
+question_hash_index = QuestionHashIndex()
+question_text.on_text_change(question_hash_index.on_content_change)
+on_commit(question_hash_index.apply_pending)
+
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _drop_pending_on_rollback(session) -> None:
+    session.info.pop(_PENDING_KEY, None)
@@ -0,0 +1,291 @@
+"""Question/answer text taken from the PDF text layer, indexed in SQLite FTS5.
+
+`question_fts` (created in `init_db`) holds one row per question with
+rowid = question id. Rows are rewritten inside the same transaction as the box
+changes that affect them, so the text index commits (or rolls back) together
+with the boxes.
+"""
+from __future__ import annotations
+
+import re
+import threading
+from pathlib import Path
+
+import fitz
+from sqlalchemy import Float, Integer, text
+from sqlalchemy.orm import Session
+
+from backend.config import PDF_DIR
+from backend.database import Answer, AnswerBox, Paper, QuestionBox
+from backend.services.search_cache import on_commit
+
+
+FTS_TABLE = "question_fts"
+# session.info key: question ids whose boxes/text changed in this session ("all" after a clear)
+CHANGED_KEY = "question_text_changed"
+
+_change_listeners: list = []
+
+_available: bool | None = None
+_available_lock = threading.Lock()
+
+_WS_RE = re.compile(r"\s+")
+_TOKEN_RE = re.compile(r"\w+", flags=re.UNICODE)
+
+
+def _mark_changed(db: Session, qids=None) -> None:
+    changed = db.info.setdefault(CHANGED_KEY, {"qids": set(), "all": False})
+    if qids is None:
+        changed["all"] = True
+    else:
+        changed["qids"].update(int(x) for x in qids)
+
+
+def on_text_change(fn):
+    """Register fn(qids: set | None) called after a commit that changed question boxes/text (None = everything)."""
+    _change_listeners.append(fn)
+    return fn
+
+
+@on_commit
+def _dispatch_text_changes(session) -> None:
+    # Text rows are written in the same transaction as the mark, so each commit consumes its marks.
+    changed = session.info.pop(CHANGED_KEY, None)
+    if not changed:
+        return
+    qids = None if changed["all"] else set(changed["qids"])
+    for fn in list(_change_listeners):
+        fn(qids)
+
+
+def fts_available(db: Session) -> bool:
+    """True when the FTS5 table exists (SQLite built without FTS5 -> False)."""
+    global _available
+    if _available is None:
+        with _available_lock:
+            if _available is None:
+                row = db.execute(
+                    text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :n"),
+                    {"n": FTS_TABLE},
+                ).first()
+                _available = row is not None
+    return bool(_available)
+
+
+def match_expression(raw: str | None) -> str | None:
+    """User keywords -> FTS5 MATCH expression (every word must appear; last word as prefix).
+
+    Words are quoted so punctuation like "(a)" or "x-axis" can't break FTS5 syntax.
+    """
+    tokens = _TOKEN_RE.findall(str(raw or "").lower())
+    if not tokens:
+        return None
+    parts = [f'"{t}"' for t in tokens[:-1]]
+    parts.append(f'"{tokens[-1]}"*')
+    return " ".join(parts)
+
+
+def matching_ids_select(expr: str):
+    """SELECT question ids matching an FTS expression (usable inside IN)."""
+    return (
+        text(f"SELECT rowid AS qid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :fts_q")
+        .bindparams(fts_q=expr)
+        .columns(qid=Integer)
+    )
+
+
+def ranked_matches(expr: str):
+    """Subquery (qid, rank) for an FTS expression; lower rank = better (bm25, question text weighted 2x)."""
+    return (
+        text(
+            f"SELECT rowid AS qid, bm25({FTS_TABLE}, 2.0, 1.0) AS rank "
+            f"FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :fts_q"
+        )
+        .bindparams(fts_q=expr)
+        .columns(qid=Integer, rank=Float)
+        .subquery()
+    )
+
+
+def _pdf_path(paper: Paper | None) -> Path | None:
+    if paper is None:
+        return None
+    if paper.pdf_path and Path(paper.pdf_path).exists():
+        return Path(paper.pdf_path)
+    p = PDF_DIR / f"paper_{paper.id}.pdf"
+    return p if p.exists() else None
+
+
+class PdfDocCache:
+    """Keep PDFs open while extracting many boxes from the same papers."""
+
+    def __init__(self, db: Session):
+        self.db = db
+        self._docs: dict[int, fitz.Document | None] = {}
+
+    def get(self, paper_id: int):
+        if paper_id not in self._docs:
+            doc = None
+            path = _pdf_path(self.db.get(Paper, paper_id))
+            if path is not None:
+                try:
+                    doc = fitz.open(str(path))
+                except Exception:
+                    doc = None
+            self._docs[paper_id] = doc
+        return self._docs[paper_id]
+
+    def close(self) -> None:
+        for doc in self._docs.values():
+            try:
+                if doc is not None:
+                    doc.close()
+            except Exception:
+                pass
+        self._docs.clear()
+
+
+def _boxes_text(docs: PdfDocCache, paper_id: int, boxes) -> str:
+    doc = docs.get(paper_id)
+    if doc is None:
+        return ""
+    chunks: list[str] = []
+    for page_no, bbox in boxes:
+        try:
+            page = doc[int(page_no) - 1]
+            r = page.rect
+            x0, y0, x1, y1 = [float(v) for v in bbox]
+            clip = fitz.Rect(r.x0 + x0 * r.width, r.y0 + y0 * r.height, r.x0 + x1 * r.width, r.y0 + y1 * r.height)
+            t = page.get_text("text", clip=clip) or ""
+        except Exception:
+            continue
+        t = _WS_RE.sub(" ", t).strip()
+        if t:
+            chunks.append(t)
+    return "\n".join(chunks)
+
+
+def refresh_question_text(db: Session, question_ids, docs: PdfDocCache | None = None) -> int:
+    """Re-extract question + answer text for the given questions and rewrite their FTS rows.
+
+    Does not commit: call before the caller's commit so text and boxes change together.
+    """
+    qids = sorted({int(x) for x in (question_ids or [])})
+    if qids:
+        _mark_changed(db, qids)
+    if not qids or not fts_available(db):
+        return 0
+
+    own_docs = docs is None
+    docs = docs or PdfDocCache(db)
+    try:
+        db.flush()
+        q_boxes: dict[int, list] = {}
+        q_paper: dict[int, int] = {}
+        for qid, pid, page, bbox in (
+            db.query(QuestionBox.question_id, QuestionBox.paper_id, QuestionBox.page, QuestionBox.bbox)
+            .filter(QuestionBox.question_id.in_(qids))
+            .order_by(QuestionBox.question_id, QuestionBox.page, QuestionBox.id)
+            .all()
+        ):
+            q_boxes.setdefault(int(qid), []).append((page, bbox))
+            q_paper[int(qid)] = int(pid)
+
+        a_boxes: dict[int, list] = {}
+        a_paper: dict[int, int] = {}
+        for qid, ms_pid, page, bbox in (
+            db.query(Answer.question_id, AnswerBox.ms_paper_id, AnswerBox.page, AnswerBox.bbox)
+            .join(AnswerBox, AnswerBox.answer_id == Answer.id)
+            .filter(Answer.question_id.in_(qids))
+            .order_by(Answer.question_id, AnswerBox.page, AnswerBox.id)
+            .all()
+        ):
+            a_boxes.setdefault(int(qid), []).append((page, bbox))
+            a_paper[int(qid)] = int(ms_pid)
+
+        delete_question_text(db, qids)
+        written = 0
+        for qid in qids:
+            if qid not in q_boxes and qid not in a_boxes:
+                continue
+            q_text = _boxes_text(docs, q_paper[qid], q_boxes[qid]) if qid in q_boxes else ""
+            a_text = _boxes_text(docs, a_paper[qid], a_boxes[qid]) if qid in a_boxes else ""
+            db.execute(
+                text(f"INSERT INTO {FTS_TABLE}(rowid, question_text, answer_text) VALUES (:id, :qt, :at)"),
+                {"id": qid, "qt": q_text, "at": a_text},
+            )
+            written += 1
+        return written
+    finally:
+        if own_docs:
+            docs.close()
+
+
+def delete_question_text(db: Session, question_ids) -> None:
+    qids = [int(x) for x in (question_ids or [])]
+    if qids:
+        _mark_changed(db, qids)
+    if not qids or not fts_available(db):
+        return
+    for i in range(0, len(qids), 500):
+        chunk = qids[i : i + 500]
+        marks = ",".join(str(x) for x in chunk)
+        db.execute(text(f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({marks})"))
+
+
+def clear_question_text(db: Session) -> None:
+    _mark_changed(db)
+    if fts_available(db):
+        db.execute(text(f"DELETE FROM {FTS_TABLE}"))
+
+
+def rebuild_question_text(db: Session, *, only_missing: bool = True, batch_size: int = 200) -> dict:
+    """Backfill the text index (existing banks were labelled before text extraction existed)."""
+    if not fts_available(db):
+        return {"available": False, "indexed": 0}
+    boxed = [int(x) for (x,) in db.query(QuestionBox.question_id).distinct().order_by(QuestionBox.question_id).all()]
+    if only_missing:
+        have = {int(x) for (x,) in db.execute(text(f"SELECT rowid FROM {FTS_TABLE}")).all()}
+        todo = [x for x in boxed if x not in have]
+    else:
+        clear_question_text(db)
+        db.commit()
+        todo = boxed
+
+    docs = PdfDocCache(db)
+    indexed = 0
+    try:
+        for i in range(0, len(todo), batch_size):
+            indexed += refresh_question_text(db, todo[i : i + batch_size], docs=docs)
+            db.commit()
+    finally:
+        docs.close()
+    return {"available": True, "indexed": indexed, "candidates": len(todo)}
+
+
+def load_question_texts(db: Session, question_ids=None) -> dict[int, str]:
+    """question id -> extracted question text (all rows when `question_ids` is None)."""
+    if not fts_available(db):
+        return {}
+    if question_ids is None:
+        rows = db.execute(text(f"SELECT rowid, question_text FROM {FTS_TABLE}")).all()
+    else:
+        qids = [int(x) for x in question_ids]
+        rows = []
+        for i in range(0, len(qids), 500):
+            marks = ",".join(str(x) for x in qids[i : i + 500])
+            rows.extend(
+                db.execute(text(f"SELECT rowid, question_text FROM {FTS_TABLE} WHERE rowid IN ({marks})")).all()
+            )
+    return {int(qid): (t or "") for qid, t in rows}
+
+
+def text_index_stats(db: Session) -> dict:
+    if not fts_available(db):
+        return {"available": False}
+    rows = int(db.execute(text(f"SELECT count(*) FROM {FTS_TABLE}")).scalar() or 0)
+    with_text = int(
+        db.execute(text(f"SELECT count(*) FROM {FTS_TABLE} WHERE question_text != '' OR answer_text != ''")).scalar()
+        or 0
+    )
+    return {"available": True, "rows": rows, "rows_with_text": with_text}
@@ -0,0 +1,110 @@
+"""In-process LRU cache for Filter search results.
+
+Entries are tagged with the data generation that was current when the query
+started. Every committed write bumps the generation (see the session hook at
+the bottom), so an entry computed before a write can never be served after it.
+"""
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+
+from sqlalchemy import event
+
+from backend.database import SessionLocal
+
+
+_generation = 0
+_generation_lock = threading.Lock()
+
+
+def data_generation() -> int:
+    return _generation
+
+
+def bump_data_generation() -> int:
+    global _generation
+    with _generation_lock:
+        _generation += 1
+        return _generation
+
+
+class SearchResultCache:
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max(1, int(max_entries))
+        self._entries: OrderedDict = OrderedDict()  # key -> (generation, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale_drops = 0
+        self.evictions = 0
+
+    def get(self, key):
+        current = data_generation()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            generation, value = entry
+            if generation != current:
+                del self._entries[key]
+                self.stale_drops += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, generation: int) -> None:
+        # A write committed while the value was being computed makes it stale already.
+        if generation != data_generation():
+            return
+        with self._lock:
+            self._entries[key] = (generation, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "stale_drops": self.stale_drops,
+                "evictions": self.evictions,
+                "generation": data_generation(),
+            }
+
+
+search_cache = SearchResultCache()
+
+# Derived in-memory structures (e.g. the facet index) that must be brought up to
+# date *before* the generation moves on, so nothing stale is cached under it.
+_commit_listeners: list = []
+
+
+def on_commit(fn):
+    _commit_listeners.append(fn)
+    return fn
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _bump_generation_on_commit(session) -> None:
+    # Request sessions only commit from mutation routes (read routes never commit),
+    # so this covers every write in questions/papers/sections/admin/cie_import.
+    for fn in list(_commit_listeners):
+        try:
+            fn(session)
+        except Exception:
+            pass
+    bump_data_generation()
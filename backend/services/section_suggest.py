@@ -0,0 +1,86 @@
+"""Section suggestions from the nearest already-classified questions.
+
+Every question that already has sections is a labelled example. A question's
+suggestions come from its k nearest labelled neighbours in the TF-IDF index
+(`similarity_index`): each neighbour votes for its sections with its cosine
+similarity, and a section's score is its share of the total vote.
+"""
+from __future__ import annotations
+
+from sqlalchemy.orm import Session
+
+from backend.database import Question, QuestionSection, SectionDef
+from backend.services.search_cache import data_generation, search_cache
+from backend.services.similarity import similarity_index
+
+
+NEIGHBOURS = 15       # 参与投票的近邻数
+MIN_SIMILARITY = 0.05  # 低于此相似度的近邻基本是噪声，不投票
+_LABELS_KEY = ("section_labels",)
+
+
+def section_labels(db: Session) -> dict[int, frozenset]:
+    """question id -> its sections (relation rows, else the legacy column), cached per data generation."""
+    generation = data_generation()
+    cached = search_cache.get(_LABELS_KEY)
+    if cached is not None:
+        return cached
+
+    labels: dict[int, set] = {}
+    for qid, name in db.query(QuestionSection.question_id, QuestionSection.section_name).all():
+        if name:
+            labels.setdefault(int(qid), set()).add(name)
+    for qid, name in (
+        db.query(Question.id, Question.section)
+        .filter(Question.section.isnot(None), Question.section != "")
+        .all()
+    ):
+        if int(qid) not in labels:
+            labels[int(qid)] = {name}
+
+    # 只推荐仍然存在的分类（已删除的分类名不再出现）
+    defined = {name for (name,) in db.query(SectionDef.name).all()}
+    out: dict[int, frozenset] = {}
+    for qid, names in labels.items():
+        keep = frozenset(n for n in names if not defined or n in defined)
+        if keep:
+            out[qid] = keep
+    search_cache.put(_LABELS_KEY, out, generation)
+    return out
+
+
+def _vote(hits, labels: dict[int, frozenset], k: int) -> list[dict]:
+    votes: dict[str, float] = {}
+    support: dict[str, int] = {}
+    total = 0.0
+    for qid, score in hits:
+        if score < MIN_SIMILARITY:
+            continue
+        total += score
+        for name in labels.get(qid, ()):
+            votes[name] = votes.get(name, 0.0) + score
+            support[name] = support.get(name, 0) + 1
+    if total <= 0:
+        return []
+    ranked = sorted(votes.items(), key=lambda kv: (-kv[1], kv[0]))[: max(1, int(k))]
+    return [
+        {"section": name, "score": round(v / total, 4), "neighbours": support[name]}
+        for name, v in ranked
+    ]
+
+
+def suggest_sections(
+    db: Session, question_ids, *, k: int = 3, neighbours: int = NEIGHBOURS
+) -> dict[int, list[dict] | None]:
+    """question id -> top-k section suggestions (None when the question has no indexed text).
+
+    A question never votes for itself, so already-classified questions can be
+    checked against their neighbours too.
+    """
+    labels = section_labels(db)
+    out: dict[int, list[dict] | None] = {}
+    for qid in question_ids:
+        hits = similarity_index.similar(int(qid), neighbours, among=labels)
+        out[int(qid)] = None if hits is None else _vote(hits, labels, k)
+    return out
+
@@ -0,0 +1,447 @@
+"""TF-IDF similar-question engine over extracted question text.
+
+Vectors are sublinear TF-IDF, L2-normalised, so a dot product is the cosine.
+The bulk of the corpus lives in a compact CSR layout built from `array`s
+(term-major postings for scoring, doc-major rows for "query by question"):
+about 8 bytes per non-zero instead of a dict entry per (term, question).
+
+Edits after a build go to a small overlay (the base row is masked dead); once
+the overlay grows past a fraction of the corpus a background rebuild folds it
+back in and refreshes IDF.
+"""
+from __future__ import annotations
+
+import heapq
+import math
+import re
+import threading
+from array import array
+
+from backend.database import SessionLocal
+from backend.services import question_text
+
+
+_TOKEN_RE = re.compile(r"[a-z][a-z]+")
+_STOPWORDS = frozenset(
+    """
+    a an and are as at be been by can do does for from give has have how if in into is it its
+    of on or show that the their then there these this those to use using was were what when
+    where which who will with you your find hence answer question questions marks mark total
+    """.split()
+)
+
+QUERY_TERMS = 48        # 查询向量只保留权重最高的若干词（长倒排、低 idf 的词贡献很小）
+CLUSTER_REST_FRACTION = 0.9  # 聚类：前缀取到剩余上界 < threshold×该比例为止，候选分数下限更高、精确校验更少
+RERANK_CANDIDATES = 200  # 截断查询得到的候选，再用完整向量精确重排
+COMPACT_MIN = 200
+COMPACT_RATIO = 0.05
+
+
+def tokenize(s: str) -> list[str]:
+    return [t for t in _TOKEN_RE.findall(str(s or "").lower()) if t not in _STOPWORDS]
+
+
+def _term_counts(s: str) -> dict[str, int]:
+    counts: dict[str, int] = {}
+    for t in tokenize(s):
+        counts[t] = counts.get(t, 0) + 1
+    return counts
+
+
+class SimilarityIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.ready = False
+        self.builds = 0
+        self.incremental_updates = 0
+        self._build_thread: threading.Thread | None = None
+        self._needs_rebuild = False
+        self._change_seq = 0
+
+        self._vocab: dict[str, int] = {}
+        self._df: list[int] = []
+        self._n_docs = 0
+        # base segment (CSR)
+        self._slot_qid = array("I")
+        self._qid_slot: dict[int, int] = {}
+        self._dead = bytearray()
+        self._t_indptr = array("I", [0])
+        self._t_slots = array("I")
+        self._t_w = array("f")
+        self._d_indptr = array("I", [0])
+        self._d_terms = array("I")
+        self._d_w = array("f")
+        self._max_w = array("f")  # per-term max weight (upper bound for pruning)
+        self._acc: list[float] = []
+        # overlay: qid -> (term ids, weights) for rows edited since the build
+        self._overlay: dict[int, tuple[array, array]] = {}
+        self._dirty: set[int] = set()
+
+    # ---- build -------------------------------------------------------------
+
+    def _idf(self, tid: int) -> float:
+        df = self._df[tid] if tid < len(self._df) else 0
+        return math.log((1 + self._n_docs) / (1 + df)) + 1.0
+
+    def _weigh(self, counts: dict[int, int]) -> tuple[array, array]:
+        pairs = [(tid, (1.0 + math.log(tf)) * self._idf(tid)) for tid, tf in counts.items()]
+        norm = math.sqrt(sum(w * w for _, w in pairs)) or 1.0
+        pairs.sort()
+        return array("I", [t for t, _ in pairs]), array("f", [w / norm for _, w in pairs])
+
+    def rebuild(self) -> None:
+        with self._lock:
+            seq = self._change_seq
+        with SessionLocal() as db:
+            texts = question_text.load_question_texts(db)
+
+        vocab: dict[str, int] = {}
+        df: list[int] = []
+        docs: list[tuple[int, dict[int, int]]] = []
+        for qid in sorted(texts):
+            counts = _term_counts(texts[qid])
+            if not counts:
+                continue
+            tcounts: dict[int, int] = {}
+            for term, tf in counts.items():
+                tid = vocab.get(term)
+                if tid is None:
+                    tid = vocab[term] = len(df)
+                    df.append(0)
+                df[tid] += 1
+                tcounts[tid] = tf
+            docs.append((qid, tcounts))
+
+        n = len(docs)
+        idf = [math.log((1 + n) / (1 + d)) + 1.0 for d in df]
+        slot_qid = array("I")
+        d_indptr = array("I", [0])
+        d_terms = array("I")
+        d_w = array("f")
+        for qid, tcounts in docs:
+            pairs = sorted((tid, (1.0 + math.log(tf)) * idf[tid]) for tid, tf in tcounts.items())
+            norm = math.sqrt(sum(w * w for _, w in pairs)) or 1.0
+            slot_qid.append(qid)
+            d_terms.extend(t for t, _ in pairs)
+            d_w.extend(w / norm for _, w in pairs)
+            d_indptr.append(len(d_terms))
+
+        # Transpose doc-major rows into term-major postings.
+        t_indptr = array("I", [0]) * (len(df) + 1)
+        for tid in d_terms:
+            t_indptr[tid + 1] += 1
+        for i in range(len(df)):
+            t_indptr[i + 1] += t_indptr[i]
+        fill = array("I", t_indptr[:-1])
+        t_slots = array("I", bytes(4 * len(d_terms)))
+        t_w = array("f", bytes(4 * len(d_terms)))
+        max_w = array("f", bytes(4 * len(df)))
+        for slot in range(n):
+            for i in range(d_indptr[slot], d_indptr[slot + 1]):
+                tid = d_terms[i]
+                w = d_w[i]
+                j = fill[tid]
+                t_slots[j] = slot
+                t_w[j] = w
+                fill[tid] = j + 1
+                if w > max_w[tid]:
+                    max_w[tid] = w
+
+        with self._lock:
+            if self._change_seq == seq:
+                self._needs_rebuild = False
+            else:
+                # 构建期间有提交：还没折叠的仍在 _dirty 里；已被查询折叠进 overlay 的，
+                # 快照里可能是旧文本，放回 _dirty 按新词表重新折叠（构建前就折叠过的多算一次，无妨）
+                self._dirty.update(self._overlay)
+            self._vocab = vocab
+            self._df = df
+            self._n_docs = n
+            self._slot_qid = slot_qid
+            self._qid_slot = {int(q): i for i, q in enumerate(slot_qid)}
+            self._dead = bytearray(n)
+            self._t_indptr, self._t_slots, self._t_w = t_indptr, t_slots, t_w
+            self._d_indptr, self._d_terms, self._d_w = d_indptr, d_terms, d_w
+            self._max_w = max_w
+            self._acc = [0.0] * n
+            self._overlay = {}
+            self.ready = True
+            self.builds += 1
+
+    def start(self) -> None:
+        self._rebuild_async()
+
+    def _rebuild_async(self) -> None:
+        with self._lock:
+            if self._build_thread is not None and self._build_thread.is_alive():
+                return
+
+            def run():
+                try:
+                    self.rebuild()
+                except Exception:
+                    with self._lock:
+                        self._needs_rebuild = True
+
+            self._build_thread = threading.Thread(target=run, name="similarity-index-build", daemon=True)
+            self._build_thread.start()
+
+    def _ensure_ready(self) -> bool:
+        if not self.ready:
+            t = self._build_thread
+            if t is not None and t.is_alive():
+                t.join()
+            if not self.ready:
+                self.rebuild()
+        return self.ready
+
+    # ---- incremental updates ---------------------------------------------
+
+    def on_text_change(self, qids) -> None:
+        with self._lock:
+            self._change_seq += 1
+            if qids is None:
+                self._needs_rebuild = True
+                self._dirty.clear()
+            else:
+                self._dirty.update(qids)
+        if qids is None and self.ready:
+            self._rebuild_async()
+
+    def _remove(self, qid: int) -> None:
+        old = self._overlay.pop(qid, None)
+        if old is not None:
+            terms = old[0]
+        else:
+            slot = self._qid_slot.get(qid)
+            if slot is None or self._dead[slot]:
+                return
+            self._dead[slot] = 1
+            terms = self._d_terms[self._d_indptr[slot] : self._d_indptr[slot + 1]]
+        for tid in terms:
+            self._df[tid] -= 1
+        self._n_docs -= 1
+
+    def _apply_dirty(self) -> None:
+        """Fold committed text edits into the overlay (called under the lock before reads)."""
+        if not self._dirty:
+            return
+        qids = sorted(self._dirty)
+        self._dirty.clear()
+        with SessionLocal() as db:
+            texts = question_text.load_question_texts(db, qids)
+        for qid in qids:
+            self._remove(qid)
+            counts = _term_counts(texts.get(qid, ""))
+            if not counts:
+                continue
+            tcounts: dict[int, int] = {}
+            for term, tf in counts.items():
+                tid = self._vocab.get(term)
+                if tid is None:
+                    tid = self._vocab[term] = len(self._df)
+                    self._df.append(0)
+                self._df[tid] += 1
+                tcounts[tid] = tf
+            self._n_docs += 1
+            terms, weights = self._overlay[qid] = self._weigh(tcounts)
+            for tid, w in zip(terms, weights):
+                while tid >= len(self._max_w):
+                    self._max_w.append(0.0)
+                if w > self._max_w[tid]:
+                    self._max_w[tid] = w
+            self.incremental_updates += 1
+        if len(self._overlay) > max(COMPACT_MIN, int(COMPACT_RATIO * len(self._slot_qid))):
+            self._rebuild_async()
+
+    def _prepare(self) -> None:
+        if self._needs_rebuild and (self._build_thread is None or not self._build_thread.is_alive()):
+            self._rebuild_async()
+        self._ensure_ready()
+        with self._lock:
+            self._apply_dirty()
+
+    # ---- queries -----------------------------------------------------------
+
+    def _vector_of(self, qid: int):
+        ov = self._overlay.get(qid)
+        if ov is not None:
+            return ov
+        slot = self._qid_slot.get(qid)
+        if slot is None or self._dead[slot]:
+            return None
+        a, b = self._d_indptr[slot], self._d_indptr[slot + 1]
+        return self._d_terms[a:b], self._d_w[a:b]
+
+    def _scores(self, terms, weights, max_terms: int | None = QUERY_TERMS) -> dict[int, float]:
+        """Dot product of a query vector with every stored vector (qid -> score > 0)."""
+        pairs = list(zip(terms, weights))
+        if max_terms is not None and len(pairs) > max_terms:
+            pairs = heapq.nlargest(max_terms, pairs, key=lambda p: p[1])
+        acc = self._acc
+        touched: list[int] = []
+        t_indptr, t_slots, t_w = self._t_indptr, self._t_slots, self._t_w
+        n_base_terms = len(t_indptr) - 1
+        for tid, qw in pairs:
+            if tid >= n_base_terms:
+                continue
+            a, b = t_indptr[tid], t_indptr[tid + 1]
+            for slot, w in zip(t_slots[a:b], t_w[a:b]):
+                if not acc[slot]:
+                    touched.append(slot)
+                acc[slot] += qw * w
+        out: dict[int, float] = {}
+        dead, slot_qid = self._dead, self._slot_qid
+        for slot in touched:
+            if not dead[slot]:
+                out[slot_qid[slot]] = acc[slot]
+            acc[slot] = 0.0
+        if self._overlay:
+            qmap = dict(pairs)
+            for oqid, (oterms, ows) in self._overlay.items():
+                s = 0.0
+                for tid, w in zip(oterms, ows):
+                    qw = qmap.get(tid)
+                    if qw is not None:
+                        s += qw * w
+                if s > 0:
+                    out[oqid] = s
+        return out
+
+    def _dot(self, qmap: dict[int, float], qid: int) -> float:
+        vec = self._vector_of(qid)
+        if vec is None:
+            return 0.0
+        get = qmap.get
+        return sum(get(t, 0.0) * w for t, w in zip(*vec))
+
+    def _top_k(self, terms, weights, k: int, *, exclude: int | None = None, min_score: float = 0.0, among=None):
+        scores = self._scores(terms, weights)
+        if exclude is not None:
+            scores.pop(exclude, None)
+        if among is not None:
+            scores = {q: s for q, s in scores.items() if q in among}
+        if len(terms) > QUERY_TERMS:
+            # 截断查询只用于选候选；候选用完整向量重算余弦
+            qmap = dict(zip(terms, weights))
+            cands = heapq.nlargest(max(RERANK_CANDIDATES, 4 * k), scores, key=scores.__getitem__)
+            scores = {q: self._dot(qmap, q) for q in cands}
+        top = heapq.nlargest(int(k), ((s, q) for q, s in scores.items() if s > min_score))
+        return [(q, round(min(1.0, s), 4)) for s, q in top]
+
+    def similar(self, qid: int, k: int = 10, *, min_score: float = 0.0, among=None) -> list[tuple[int, float]] | None:
+        """Top-k (question id, cosine) most similar to `qid`; None when `qid` has no indexed text.
+
+        `among`: optional container of question ids the neighbours must come from.
+        """
+        self._prepare()
+        with self._lock:
+            vec = self._vector_of(int(qid))
+            if vec is None:
+                return None
+            return self._top_k(*vec, k, exclude=int(qid), min_score=min_score, among=among)
+
+    def similar_to_text(self, s: str, k: int = 10, *, min_score: float = 0.0, among=None) -> list[tuple[int, float]]:
+        self._prepare()
+        with self._lock:
+            tcounts = {self._vocab[t]: tf for t, tf in _term_counts(s).items() if t in self._vocab}
+            if not tcounts:
+                return []
+            return self._top_k(*self._weigh(tcounts), k, min_score=min_score, among=among)
+
+    def clusters(self, threshold: float = 0.9, *, max_clusters: int = 500) -> list[dict]:
+        """Groups of near-duplicate questions (cosine >= threshold), via union-find.
+
+        Prefix filtering: terms are taken rarest-first until the rest of the
+        vector can add at most min(its norm, sum of weight x per-term max weight)
+        < threshold. Any qualifying neighbour must then share a prefix term, and
+        anything whose prefix score is below `threshold - bound` is skipped.
+        """
+        threshold = float(threshold)
+        self._prepare()
+        with self._lock:
+            qids = [int(q) for s, q in enumerate(self._slot_qid) if not self._dead[s]] + list(self._overlay)
+            parent: dict[int, int] = {}
+            best: dict[tuple[int, int], float] = {}
+
+            def find(x: int) -> int:
+                while parent.get(x, x) != x:
+                    parent[x] = parent.get(parent[x], parent[x])
+                    x = parent[x]
+                return x
+
+            df, max_w = self._df, self._max_w
+            for qid in qids:
+                vec = self._vector_of(qid)
+                if vec is None:
+                    continue
+                # 按文档频率从稀有到常见排序，取最短前缀使剩余部分的上界 < threshold
+                pairs = sorted(zip(*vec), key=lambda p: df[p[0]])
+                n_terms = len(pairs)
+                suf_sq = [0.0] * (n_terms + 1)
+                suf_mw = [0.0] * (n_terms + 1)
+                for i in range(n_terms - 1, -1, -1):
+                    t, w = pairs[i]
+                    suf_sq[i] = suf_sq[i + 1] + w * w
+                    suf_mw[i] = suf_mw[i + 1] + w * max_w[t]
+                cut = n_terms
+                for i in range(n_terms + 1):
+                    if min(math.sqrt(suf_sq[i]), suf_mw[i]) < threshold * CLUSTER_REST_FRACTION:
+                        cut = i
+                        break
+                head, rest = pairs[:cut], pairs[cut:]
+                rest_bound = min(math.sqrt(suf_sq[cut]), suf_mw[cut])
+                partial = self._scores([t for t, _ in head], [w for _, w in head], max_terms=None)
+                cutoff = threshold - rest_bound
+                full = None
+                for other, s in partial.items():
+                    if other <= qid or s < cutoff:
+                        continue
+                    if rest:
+                        if full is None:
+                            full = dict(pairs)
+                        ov = self._vector_of(other)
+                        if ov is None:
+                            continue
+                        s = sum(full.get(t, 0.0) * w for t, w in zip(*ov))
+                    if s >= threshold:
+                        best[(qid, other)] = s
+                        ra, rb = find(qid), find(other)
+                        if ra != rb:
+                            parent[max(ra, rb)] = min(ra, rb)
+
+        members: dict[int, set[int]] = {}
+        scores: dict[int, list[float]] = {}
+        for (a, b), s in best.items():
+            root = find(a)
+            members.setdefault(root, set()).update((a, b))
+            scores.setdefault(root, []).append(s)
+        out = [
+            {
+                "question_ids": sorted(members[root]),
+                "size": len(members[root]),
+                "min_score": round(min(1.0, min(scores[root])), 4),
+                "max_score": round(min(1.0, max(scores[root])), 4),
+            }
+            for root in members
+        ]
+        out.sort(key=lambda c: (-c["size"], -c["max_score"], c["question_ids"][0]))
+        return out[: max(1, int(max_clusters))]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "ready": self.ready,
+                "documents": self._n_docs,
+                "base_documents": len(self._slot_qid),
+                "overlay_documents": len(self._overlay),
+                "pending": len(self._dirty),
+                "terms": len(self._vocab),
+                "nonzeros": len(self._d_terms),
+                "builds": self.builds,
+                "incremental_updates": self.incremental_updates,
+            }
+
+
+similarity_index = SimilarityIndex()
+question_text.on_text_change(similarity_index.on_text_change)
@@ -120,6 +120,49 @@ export default {
           <div class="muted">说明：答案同样按“每页一题/一页一份答案”输出，只控制顺序。</div>
         </div>
 
+        <div style="height:12px"></div>
+
+        <div class="panel">
+          <div class="row" style="justify-content:space-between">
+            <strong>图片质量</strong>
+            <span class="muted">分辨率越低、编码越简单，PDF 越小</span>
+          </div>
+          <div style="height:10px"></div>
+          <div class="row" style="gap:14px; flex-wrap:wrap">
+            <label class="muted">
+              输出方式
+              <select id="exportOptRenderEngine" v-model="exportRenderEngine">
+                <option value="raster">图片</option>
+                <option value="vector">矢量（原 PDF）</option>
+              </select>
+            </label>
+            <label :class="['muted', { disabled: exportRenderEngine === 'vector' }]">
+              分辨率
+              <select id="exportOptImageDpi" v-model.number="exportImageDpi" :disabled="exportRenderEngine === 'vector'">
+                <option :value="0">原图</option>
+                <option :value="300">300 dpi</option>
+                <option :value="200">200 dpi</option>
+                <option :value="150">150 dpi</option>
+              </select>
+            </label>
+            <label :class="['muted', { disabled: exportRenderEngine === 'vector' }]">
+              编码
+              <select id="exportOptImageEncoding" v-model="exportImageEncoding" :disabled="exportRenderEngine === 'vector'">
+                <option value="color">彩色（无损）</option>
+                <option value="gray">灰度（无损）</option>
+                <option value="jpeg">JPEG</option>
+                <option value="bilevel">黑白（纯文字）</option>
+              </select>
+            </label>
+            <label class="muted" v-if="exportImageEncoding === 'jpeg' && exportRenderEngine !== 'vector'">
+              JPEG 质量
+              <input id="exportOptJpegQuality" v-model.number="exportJpegQuality" type="number" min="30" max="95" step="5" style="width:70px" />
+            </label>
+          </div>
+          <div style="height:8px"></div>
+          <div class="muted" v-if="exportRenderEngine === 'vector'">矢量：直接嵌入原 PDF 的对应区域，任意缩放都清晰、文件更小；找不到原 PDF 的题目仍用图片。</div>
+        </div>
+
         <div style="height:12px"></div>
         <div class="row" style="justify-content:flex-end">
           <button id="exportWizardCancelBtn" :disabled="exportBusy" @click="closeExportWizard">取消</button>
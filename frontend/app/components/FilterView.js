@@ -420,6 +420,8 @@ export default {
           <label class="muted" style="display:flex; gap:6px; align-items:center">
             <input id="filterExcludeMultiSection" type="checkbox" v-model="filterExcludeMultiSection" @change="onFilterChange" /> 排除多分类题目
           </label>
+          <label class="muted">关键词</label>
+          <input id="filterTextInput" v-model="filterText" type="search" placeholder="题目/答案文字" style="width:160px" @keydown.enter="onFilterChange" @change="onFilterChange" />
           <label class="muted">预设</label>
           <select id="filterPresetSelect" v-model="filterPresetSelected" @change="applyFilterPreset(filterPresetSelected)" style="min-width:180px">
             <option value="">(未选择)</option>
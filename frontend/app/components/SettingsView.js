@@ -281,7 +281,8 @@ export default {
           重复题号组 {{ maintenanceIntegrityReport.duplicate_question_no_groups || 0 }}，
           重复题号总条 {{ maintenanceIntegrityReport.duplicate_question_no_total || 0 }}，
           孤儿题框 {{ maintenanceIntegrityReport.orphan_question_boxes || 0 }}，
-          孤儿答案框 {{ maintenanceIntegrityReport.orphan_answer_boxes || 0 }}
+          孤儿答案框 {{ maintenanceIntegrityReport.orphan_answer_boxes || 0 }}，
+          疑似重复题组 {{ maintenanceIntegrityReport.possible_duplicate_groups || 0 }}
         </div>
         <div class="muted" style="margin-top:6px" v-if="maintenanceIntegrityReport && maintenanceIntegrityReport.question_no_gap_examples && maintenanceIntegrityReport.question_no_gap_examples.length">
           题号跳号示例：{{ maintenanceIntegrityReport.question_no_gap_examples.join(', ') }}
@@ -38,6 +38,8 @@ export const defaultState = () => ({
   markSavedUndoStack: [],
   markSavedRedoStack: [],
   markPersistBusy: false,
+  markSavedQueuedUndo: 0,
+  markSavedQueuedRedo: 0,
   pageQuestions: [],
   suggestedNextNo: null,
   globalSuggestedNextNo: null,
@@ -67,6 +69,7 @@ export const defaultState = () => ({
   answerQuestions: [],
   answerQIndex: -1,
   answerExistingBoxes: [],
+  answerBoxesVersion: null,
   answerNewBoxes: [],
   answerDrawing: null,
   selectedAnswerNew: null,
@@ -88,6 +91,7 @@ export const defaultState = () => ({
   filterSeasonMulti: [],
   filterFavOnly: false,
   filterExcludeMultiSection: false,
+  filterText: "",
   filterPage: 1,
   filterPageSize: 10,
   filterResults: [],
@@ -136,6 +140,10 @@ export const defaultState = () => ({
   exportIncludeNotes: false,
   exportIncludeAnswers: false,
   exportAnsPlacement: "end",
+  exportImageDpi: 0,
+  exportImageEncoding: "color",
+  exportJpegQuality: 80,
+  exportRenderEngine: "raster",
   exportFileName: "",
   exportRecommendedName: "",
   exportFromRandomMode: false,
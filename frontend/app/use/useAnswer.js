@@ -277,10 +277,12 @@ export const answerMethods = {
     }
     this.answerNewBoxes = [];
     this.answerExistingBoxes = [];
+    this.answerBoxesVersion = null;
     this.resetAnswerHistory();
     try {
       const d = await api(`/questions/${q.id}/answer`);
       if (d && d.answer && d.answer.boxes) {
+        this.answerBoxesVersion = d.answer.boxes_version || null;
         this.answerExistingBoxes = d.answer.boxes.map((b) => ({ page: b.page, bbox: b.bbox }));
         if (this.answerAlignEnabled && Array.isArray(this.answerAlignRef) && this.answerAlignRef.length === 2) {
           this.answerExistingBoxes = alignAnswerBoxesPayloadToBoundsX(this.answerExistingBoxes, this.answerAlignRef);
@@ -596,12 +598,13 @@ export const answerMethods = {
     const aligned = this.answerAlignEnabled ? alignAnswerBoxesPayloadToBoundsX(merged, bounds) : merged;
     try {
       this.setStatus(`保存答案中：题目 #${q.id}…`);
-      await api(`/questions/${q.id}/answer`, {
+      const saved = await api(`/questions/${q.id}/answer`, {
         method: "POST",
         headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ ms_paper_id: this.msPaperId, boxes: aligned }),
+        body: JSON.stringify({ ms_paper_id: this.msPaperId, boxes: aligned, version: this.answerBoxesVersion }),
       });
-      this.setStatus("已保存", "ok");
+      this.answerBoxesVersion = saved?.answer?.boxes_version || saved?.boxes_version || null;
+      this.setStatus(saved?.unchanged ? "未改动" : "已保存", "ok");
       this.answerExistingBoxes = aligned.map((b) => ({ page: b.page, bbox: b.bbox }));
       this.answerNewBoxes = [];
       this.resetAnswerHistory();
@@ -131,6 +131,7 @@ export const coreMethods = {
     this.answerQuestions = [];
     this.answerQIndex = -1;
     this.answerExistingBoxes = [];
+    this.answerBoxesVersion = null;
     this.answerNewBoxes = [];
     this.answerDrawing = null;
     this.selectedAnswerNew = null;
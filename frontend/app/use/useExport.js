@@ -19,6 +19,10 @@ export const exportMethods = {
     this.exportIncludeNotes = opts.includeNotes ?? this.exportIncludeNotes;
     this.exportIncludeAnswers = opts.includeAnswers ?? this.exportIncludeAnswers;
     this.exportAnsPlacement = opts.ansPlacement ?? this.exportAnsPlacement;
+    this.exportImageDpi = opts.imageDpi ?? this.exportImageDpi;
+    this.exportImageEncoding = opts.imageEncoding ?? this.exportImageEncoding;
+    this.exportJpegQuality = opts.jpegQuality ?? this.exportJpegQuality;
+    this.exportRenderEngine = opts.renderEngine ?? this.exportRenderEngine;
     this.exportIncludeFilterSummary = opts.includeFilterSummary ?? this.exportIncludeFilterSummary;
     this.exportSummaryFieldSection = opts.summaryFieldSection ?? this.exportSummaryFieldSection;
     this.exportSummaryFieldPaper = opts.summaryFieldPaper ?? this.exportSummaryFieldPaper;
@@ -37,6 +41,10 @@ export const exportMethods = {
       includeNotes: this.exportIncludeNotes,
       includeAnswers: this.exportIncludeAnswers,
       ansPlacement: this.exportAnsPlacement,
+      imageDpi: this.exportImageDpi,
+      imageEncoding: this.exportImageEncoding,
+      jpegQuality: this.exportJpegQuality,
+      renderEngine: this.exportRenderEngine,
       includeFilterSummary: this.exportIncludeFilterSummary,
       summaryFieldSection: this.exportSummaryFieldSection,
       summaryFieldPaper: this.exportSummaryFieldPaper,
@@ -768,6 +776,10 @@ export const exportMethods = {
         include_filter_summary: shouldIncludeSummary,
         filter_summary_lines: selectedSummaryLines,
         crop_workers: Math.max(0, Number(this.exportCropWorkers || 0)),
+        image_dpi: Math.max(0, Number(this.exportImageDpi || 0)),
+        image_encoding: this.exportImageEncoding || "color",
+        jpeg_quality: clampInt(this.exportJpegQuality ?? 80, 30, 95),
+        render_engine: this.exportRenderEngine === "vector" ? "vector" : "raster",
       };
       if (!this.exportFromRandomMode) this.persistExportWizardOptions();
       this.exportBusy = true;
@@ -38,6 +38,7 @@ export const filterMethods = {
       filterSeasonMulti: Array.isArray(this.filterSeasonMulti) ? [...this.filterSeasonMulti] : [],
       filterFavOnly: !!this.filterFavOnly,
       filterExcludeMultiSection: !!this.filterExcludeMultiSection,
+      filterText: String(this.filterText || ""),
     };
     const next = (this.filterPresets || []).filter((x) => x?.name !== name);
     next.unshift(payload);
@@ -57,6 +58,7 @@ export const filterMethods = {
     this.filterSeasonMulti = Array.isArray(p.filterSeasonMulti) ? [...p.filterSeasonMulti] : [];
     this.filterFavOnly = !!p.filterFavOnly;
     this.filterExcludeMultiSection = !!p.filterExcludeMultiSection;
+    this.filterText = String(p.filterText || "");
     this.filterPage = 1;
     this.filterPresetSelected = key;
     await this.runFilter();
@@ -302,6 +304,7 @@ export const filterMethods = {
     if (useSeasonFilter) params.set("seasons", seasons.join(","));
     if (this.filterFavOnly) params.set("favorite", "true");
     if (this.filterExcludeMultiSection) params.set("exclude_multi_section", "true");
+    if (String(this.filterText || "").trim()) params.set("q", String(this.filterText).trim());
     params.set("page", String(page || 1));
     params.set("page_size", String(pageSize || 10));
     return params;
@@ -337,6 +340,7 @@ export const filterMethods = {
       seasons,
       favorite: this.filterFavOnly ? true : null,
       exclude_multi_section: this.filterExcludeMultiSection ? true : null,
+      q: String(this.filterText || "").trim() || null,
       page: Number(page || 1),
       page_size: Number(pageSize || 10),
       ids_only: !!idsOnly,
@@ -511,6 +515,7 @@ export const filterMethods = {
       seasonMulti: Array.isArray(this.filterSeasonMulti) ? [...this.filterSeasonMulti] : [],
       favOnly: this.filterFavOnly,
       excludeMultiSection: this.filterExcludeMultiSection,
+      text: this.filterText,
       page: this.filterPage,
       pageSize: this.filterPageSize,
       questionNoInput: this.filterQuestionNoInput,
@@ -528,6 +533,7 @@ export const filterMethods = {
     this.filterSeasonMulti = Array.isArray(state.seasonMulti) ? [...state.seasonMulti] : (this.filterSeason ? [this.filterSeason] : []);
     this.filterFavOnly = !!state.favOnly;
     this.filterExcludeMultiSection = !!state.excludeMultiSection;
+    this.filterText = state.text || "";
     this.filterPage = state.page || 1;
     this.filterPageSize = state.pageSize || this.filterPageSize;
     this.filterQuestionNoInput = state.questionNoInput || "";
@@ -619,8 +625,8 @@ export const filterMethods = {
           this.setStatus(`试卷内题号超出范围：${raw}（共 ${rows.length} 题）`, "err");
           return;
         }
-        const currentIds = await this.collectAllFilteredQuestionIds();
-        if (!currentIds.includes(Number(target.id))) {
+        let pos = await this.locateQuestionInFilter({ targetId: Number(target.id) });
+        if (!pos?.in_filter) {
           // 当前筛选排除了目标题，保留试卷筛选，清空其余条件。
           this.filterSection = "";
           this.filterYear = "";
@@ -629,34 +635,27 @@ export const filterMethods = {
           this.filterSeasonMulti = [];
           this.filterFavOnly = false;
           this.filterExcludeMultiSection = false;
+          this.filterText = "";
+          pos = await this.locateQuestionInFilter({ targetId: Number(target.id) });
         }
-        const ids = await this.collectAllFilteredQuestionIds();
-        const idx = ids.indexOf(Number(target.id));
-        if (idx < 0) {
+        if (!pos?.in_filter) {
           this.setStatus(`未找到试卷内题号：${raw}`, "err");
           return;
         }
-        const page = Math.floor(idx / Math.max(1, this.filterPageSize)) + 1;
-        this.filterPage = page;
+        this.filterPage = Number(pos.page || 1);
         await this.runFilter();
         this.scrollToFilterQuestion(target.id);
         this.setStatus(`已定位试卷内题号：${raw}`, "ok");
         return;
       }
 
-      const lookupParams = new URLSearchParams();
-      lookupParams.set("question_no", raw);
-      lookupParams.set("page", "1");
-      lookupParams.set("page_size", "1");
-      const lookup = await api(`/questions?${lookupParams.toString()}`);
-      const q = lookup?.questions?.[0];
-      if (!q || q.id == null) {
+      let pos = await this.locateQuestionInFilter({ targetQuestionNo: raw });
+      if (pos?.question_id == null) {
         this.setStatus(`未找到题号：${raw}`, "err");
         return;
       }
-      const ids = await this.collectAllFilteredQuestionIds();
-      let idx = ids.indexOf(q.id);
-      if (idx < 0) {
+      const q = { id: Number(pos.question_id) };
+      if (!pos.in_filter) {
         this.setStatus("题号不在当前筛选条件，已清空筛选", "info");
         this.filterSection = "";
         this.filterPaper = "";
@@ -667,15 +666,14 @@ export const filterMethods = {
         this.filterSeasonMulti = [];
         this.filterFavOnly = false;
         this.filterExcludeMultiSection = false;
-        const allIds = await this.collectAllFilteredQuestionIds();
-        idx = allIds.indexOf(q.id);
-        if (idx < 0) {
+        this.filterText = "";
+        pos = await this.locateQuestionInFilter({ targetId: q.id });
+        if (!pos?.in_filter) {
           this.setStatus(`未找到题号：${raw}`, "err");
           return;
         }
       }
-      const page = Math.floor(idx / Math.max(1, this.filterPageSize)) + 1;
-      this.filterPage = page;
+      this.filterPage = Number(pos.page || 1);
       await this.runFilter();
       this.scrollToFilterQuestion(q.id);
       this.setStatus(`已定位题号：${raw}`, "ok");
@@ -683,6 +681,16 @@ export const filterMethods = {
       this.setStatus(String(e), "err");
     }
   },
+  async locateQuestionInFilter({ targetId = null, targetQuestionNo = null }) {
+    const payload = this.buildFilterSearchPayload({ page: 1, pageSize: this.filterPageSize });
+    if (targetId != null) payload.target_id = Number(targetId);
+    if (targetQuestionNo != null) payload.target_question_no = String(targetQuestionNo);
+    return api("/questions/position", {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify(payload),
+    });
+  },
   async collectAllFilteredQuestionIds() {
     const ids = [];
     let page = 1;
@@ -70,14 +70,16 @@ const clonePersistedBoxPayload = (boxes) => {
 
 const clonePersistedQuestionPayload = (payload) => {
   if (!payload || typeof payload !== "object") {
-    return { sections: [], notes: null, boxes: [] };
+    return { sections: [], notes: null, boxes: [], boxes_version: null };
   }
   const sections = Array.isArray(payload.sections)
     ? payload.sections.filter((s) => s != null && String(s).trim()).map((s) => String(s))
     : [];
   const notes = payload.notes == null ? null : String(payload.notes);
   const boxes = clonePersistedBoxPayload(payload.boxes);
-  return { sections, notes, boxes };
+  // 服务端上次返回的 boxes_version：重放时框没变就不重写
+  const boxes_version = payload.boxes_version ? String(payload.boxes_version) : null;
+  return { sections, notes, boxes, boxes_version };
 };
 
 export const useMark = () => {
@@ -135,21 +137,30 @@ export const markMethods = {
     if (this.markSavedUndoStack.length > MARK_SAVED_HISTORY_LIMIT) this.markSavedUndoStack.shift();
     this.markSavedRedoStack = [];
   },
-  async applySavedQuestionPayload(questionId, payload) {
-    const safeId = Number(questionId);
-    if (!Number.isFinite(safeId)) throw new Error("题目 ID 无效");
+  savedQuestionPayloadOps(questionId, payload) {
     const nextPayload = clonePersistedQuestionPayload(payload);
-    await api(`/questions/${safeId}`, {
-      method: "PATCH",
-      headers: { "Content-Type": "application/json" },
-      body: JSON.stringify({ sections: nextPayload.sections, notes: nextPayload.notes }),
-    });
-    await api(`/questions/${safeId}/boxes`, {
+    return [
+      { op: "update", id: questionId, data: { sections: nextPayload.sections, notes: nextPayload.notes } },
+      { op: "replace_boxes", id: questionId, data: { boxes: nextPayload.boxes, version: nextPayload.boxes_version } },
+    ];
+  },
+  async applyMutations(ops) {
+    return api("/mutations", {
       method: "POST",
       headers: { "Content-Type": "application/json" },
-      body: JSON.stringify({ boxes: nextPayload.boxes }),
+      body: JSON.stringify({ ops }),
     });
   },
+  async applySavedQuestionPayload(questionId, payload) {
+    const safeId = Number(questionId);
+    if (!Number.isFinite(safeId)) throw new Error("题目 ID 无效");
+    await this.applyMutations(this.savedQuestionPayloadOps(safeId, payload));
+  },
+  remapSavedHistoryQuestionId(fromId, toId) {
+    for (const entry of [...this.markSavedUndoStack, ...this.markSavedRedoStack]) {
+      if (entry && Number(entry.questionId) === Number(fromId)) entry.questionId = Number(toId);
+    }
+  },
   async refreshAfterSavedHistoryChange(paperId, focusPage = null) {
     if (this.currentPaperId !== paperId) return;
     if (typeof this.refreshPapers === "function") {
@@ -167,77 +178,125 @@ export const markMethods = {
     await this.refreshPageQuestions();
     this.drawOverlay();
   },
-  async undoSavedMark() {
-    if (this.markPersistBusy) return;
+  takeSavedHistoryEntries(stack, steps) {
+    // 连续多步撤销/重做：同一试卷的若干条记录合成一次 /mutations 请求
+    const out = [];
+    for (let k = stack.length - 1; k >= 0 && out.length < Math.max(1, steps); k--) {
+      const entry = stack[k];
+      if (!entry || entry.paperId !== this.currentPaperId) break;
+      if (entry.type !== "create" && entry.type !== "update") break;
+      out.push(entry);
+    }
+    return out;
+  },
+  async flushQueuedSavedHistory() {
+    const undo = this.markSavedQueuedUndo || 0;
+    const redo = this.markSavedQueuedRedo || 0;
+    this.markSavedQueuedUndo = 0;
+    this.markSavedQueuedRedo = 0;
+    if (undo > redo) await this.undoSavedMark(undo - redo);
+    else if (redo > undo) await this.redoSavedMark(redo - undo);
+  },
+  async undoSavedMark(steps = 1) {
+    if (this.markPersistBusy) {
+      // 上一次请求还没回来又按了撤销：先记下，回来后合并成一次请求
+      this.markSavedQueuedUndo = (this.markSavedQueuedUndo || 0) + 1;
+      return;
+    }
     if (!this.markSavedUndoStack.length) return;
-    const entry = this.markSavedUndoStack[this.markSavedUndoStack.length - 1];
-    if (!entry) return;
-    if (this.currentPaperId !== entry.paperId) {
+    const top = this.markSavedUndoStack[this.markSavedUndoStack.length - 1];
+    if (!top) return;
+    if (this.currentPaperId !== top.paperId) {
       this.setStatus("请先打开对应试卷再撤销已保存操作", "info");
       return;
     }
+    const entries = this.takeSavedHistoryEntries(this.markSavedUndoStack, steps);
+    if (!entries.length) return;
     this.markPersistBusy = true;
     try {
       this.setStatus("撤销已保存操作中…");
-      if (entry.type === "create") {
-        await api(`/questions/${entry.questionId}`, { method: "DELETE" });
-      } else if (entry.type === "update") {
-        await this.applySavedQuestionPayload(entry.questionId, entry.before);
-      } else {
-        return;
+      const ops = [];
+      for (const entry of entries) {
+        if (entry.type === "create") {
+          ops.push({ op: "delete", id: entry.questionId });
+        } else {
+          ops.push(...this.savedQuestionPayloadOps(entry.questionId, entry.before));
+        }
       }
-      this.markSavedUndoStack.pop();
-      this.markSavedRedoStack.push(entry);
-      const focusPage = entry?.before?.boxes?.[0]?.page ?? entry?.after?.boxes?.[0]?.page ?? null;
-      await this.refreshAfterSavedHistoryChange(entry.paperId, focusPage);
-      this.setStatus("已撤销", "ok");
+      await this.applyMutations(ops);
+      for (const entry of entries) {
+        this.markSavedUndoStack.pop();
+        this.markSavedRedoStack.push(entry);
+      }
+      const last = entries[entries.length - 1];
+      const focusPage = last?.before?.boxes?.[0]?.page ?? last?.after?.boxes?.[0]?.page ?? null;
+      await this.refreshAfterSavedHistoryChange(last.paperId, focusPage);
+      this.setStatus(entries.length > 1 ? `已撤销 ${entries.length} 步` : "已撤销", "ok");
     } catch (e) {
+      this.markSavedQueuedUndo = 0;
+      this.markSavedQueuedRedo = 0;
       this.setStatus(String(e), "err");
     } finally {
       this.markPersistBusy = false;
     }
+    await this.flushQueuedSavedHistory();
   },
-  async redoSavedMark() {
-    if (this.markPersistBusy) return;
+  async redoSavedMark(steps = 1) {
+    if (this.markPersistBusy) {
+      this.markSavedQueuedRedo = (this.markSavedQueuedRedo || 0) + 1;
+      return;
+    }
     if (!this.markSavedRedoStack.length) return;
-    const entry = this.markSavedRedoStack[this.markSavedRedoStack.length - 1];
-    if (!entry) return;
-    if (this.currentPaperId !== entry.paperId) {
+    const top = this.markSavedRedoStack[this.markSavedRedoStack.length - 1];
+    if (!top) return;
+    if (this.currentPaperId !== top.paperId) {
       this.setStatus("请先打开对应试卷再重做已保存操作", "info");
       return;
     }
+    const entries = this.takeSavedHistoryEntries(this.markSavedRedoStack, steps);
+    if (!entries.length) return;
     this.markPersistBusy = true;
     try {
       this.setStatus("重做已保存操作中…");
-      if (entry.type === "create") {
-        const payload = clonePersistedQuestionPayload(entry.after);
-        const created = await api(`/papers/${entry.paperId}/questions`, {
-          method: "POST",
-          headers: { "Content-Type": "application/json" },
-          body: JSON.stringify({
-            sections: payload.sections,
-            status: "confirmed",
-            notes: payload.notes,
-            boxes: payload.boxes,
-          }),
-        });
-        const nextQuestionId = created?.question?.id;
-        if (nextQuestionId != null) entry.questionId = Number(nextQuestionId);
-      } else if (entry.type === "update") {
-        await this.applySavedQuestionPayload(entry.questionId, entry.after);
-      } else {
-        return;
+      const ops = [];
+      const tempIds = new Map(); // 旧题目 ID -> 本批次 temp_id（重做“新建”会得到新 ID）
+      for (const entry of entries) {
+        const ref = tempIds.get(Number(entry.questionId)) ?? entry.questionId;
+        if (entry.type === "create") {
+          const payload = clonePersistedQuestionPayload(entry.after);
+          const tempId = `redo-${entry.questionId}`;
+          tempIds.set(Number(entry.questionId), tempId);
+          ops.push({
+            op: "create",
+            paper_id: entry.paperId,
+            temp_id: tempId,
+            data: { sections: payload.sections, status: "confirmed", notes: payload.notes, boxes: payload.boxes },
+          });
+        } else {
+          ops.push(...this.savedQuestionPayloadOps(ref, entry.after));
+        }
+      }
+      const res = await this.applyMutations(ops);
+      const idMap = res?.id_map || {};
+      for (const [oldId, tempId] of tempIds) {
+        if (idMap[tempId] != null) this.remapSavedHistoryQuestionId(oldId, idMap[tempId]);
       }
-      this.markSavedRedoStack.pop();
-      this.markSavedUndoStack.push(entry);
-      const focusPage = entry?.after?.boxes?.[0]?.page ?? entry?.before?.boxes?.[0]?.page ?? null;
-      await this.refreshAfterSavedHistoryChange(entry.paperId, focusPage);
-      this.setStatus("已重做", "ok");
+      for (const entry of entries) {
+        this.markSavedRedoStack.pop();
+        this.markSavedUndoStack.push(entry);
+      }
+      const last = entries[entries.length - 1];
+      const focusPage = last?.after?.boxes?.[0]?.page ?? last?.before?.boxes?.[0]?.page ?? null;
+      await this.refreshAfterSavedHistoryChange(last.paperId, focusPage);
+      this.setStatus(entries.length > 1 ? `已重做 ${entries.length} 步` : "已重做", "ok");
     } catch (e) {
+      this.markSavedQueuedUndo = 0;
+      this.markSavedQueuedRedo = 0;
       this.setStatus(String(e), "err");
     } finally {
       this.markPersistBusy = false;
     }
+    await this.flushQueuedSavedHistory();
   },
   async undoMark() {
     if (this.markUndoStack.length) {
@@ -863,6 +922,7 @@ export const markMethods = {
           sections: full?.sections ?? [],
           notes: full?.notes ?? null,
           boxes: clonePersistedBoxPayload(boxes),
+          boxes_version: full?.boxes_version ?? null,
         },
         true
       );
@@ -972,6 +1032,7 @@ export const markMethods = {
           : (original.section ? [original.section] : []),
         notes: original.notes ?? null,
         boxes: Array.isArray(original.boxes) ? original.boxes : [],
+        boxes_version: original.boxes_version ?? null,
       });
       let sectionsToSave = this.selectedSectionsForNewQuestion.length > 0
         ? this.selectedSectionsForNewQuestion
@@ -984,16 +1045,11 @@ export const markMethods = {
         notes = this.editingQuestionOriginal.notes ?? null;
       }
       this.setStatus(`保存题目 #${qid} 中…`);
-      await api(`/questions/${qid}`, {
-        method: "PATCH",
-        headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ sections: sectionsToSave, notes }),
-      });
-      await api(`/questions/${qid}/boxes`, {
-        method: "POST",
-        headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ boxes: boxesPayload }),
-      });
+      const saved = await this.applyMutations([
+        { op: "update", id: qid, data: { sections: sectionsToSave, notes } },
+        { op: "replace_boxes", id: qid, data: { boxes: boxesPayload, version: original.boxes_version ?? null } },
+      ]);
+      const savedQuestion = (saved?.questions || []).find((item) => Number(item?.id) === Number(qid));
       this.pushSavedMarkUndo({
         type: "update",
         paperId: this.currentPaperId,
@@ -1003,6 +1059,7 @@ export const markMethods = {
           sections: sectionsToSave,
           notes,
           boxes: boxesPayload,
+          boxes_version: savedQuestion?.boxes_version ?? null,
         }),
       });
 
@@ -1078,6 +1135,26 @@ export const markMethods = {
 
     const firstPage = boxesPayload?.[0]?.page ?? this.pages[this.currentPageIndex]?.page;
     if (this.currentPaperId != null && firstPage) setLastMarkedPageNum(this.currentPaperId, this.currentPaperCacheToken, firstPage);
+    if (Number.isFinite(createdId)) this.checkPossibleDuplicates(createdId);
+  },
+  async checkPossibleDuplicates(questionId) {
+    // 截图哈希在后台计算，保存后短暂轮询几次
+    for (let attempt = 0; attempt < 5; attempt += 1) {
+      await new Promise((resolve) => setTimeout(resolve, 800));
+      let data;
+      try {
+        data = await api(`/questions/${questionId}/possible_duplicates`);
+      } catch {
+        return;
+      }
+      if (data?.pending) continue;
+      const dups = Array.isArray(data?.results) ? data.results : [];
+      if (dups.length) {
+        const labels = dups.map((d) => `${d.paper || d.paper_id} 题号${d.question_no ?? d.id}`).join("，");
+        this.setStatus(`已保存；可能与已有题目重复：${labels}`, "info");
+      }
+      return;
+    }
   },
   clearBoxes() {
     if (this.selectedNewBox) {
@@ -46,6 +46,10 @@ export const settingsMethods = {
       this.exportIncludeNotes = exportWizardOpts.includeNotes ?? this.exportIncludeNotes;
       this.exportIncludeAnswers = exportWizardOpts.includeAnswers ?? this.exportIncludeAnswers;
       this.exportAnsPlacement = exportWizardOpts.ansPlacement ?? this.exportAnsPlacement;
+      this.exportImageDpi = exportWizardOpts.imageDpi ?? this.exportImageDpi;
+      this.exportImageEncoding = exportWizardOpts.imageEncoding ?? this.exportImageEncoding;
+      this.exportJpegQuality = exportWizardOpts.jpegQuality ?? this.exportJpegQuality;
+      this.exportRenderEngine = exportWizardOpts.renderEngine ?? this.exportRenderEngine;
       this.exportIncludeFilterSummary = exportWizardOpts.includeFilterSummary ?? this.exportIncludeFilterSummary;
       this.exportSummaryFieldSection = exportWizardOpts.summaryFieldSection ?? this.exportSummaryFieldSection;
       this.exportSummaryFieldPaper = exportWizardOpts.summaryFieldPaper ?? this.exportSummaryFieldPaper;
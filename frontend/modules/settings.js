@@ -35,8 +35,14 @@ export let exportWizardOptions = {
   summaryFieldSeason: true,
   summaryFieldFavorites: true,
   summaryFieldCount: true,
+  imageDpi: 0,
+  imageEncoding: "color",
+  jpegQuality: 80,
+  renderEngine: "raster",
 };
 
+const EXPORT_IMAGE_ENCODINGS = ["color", "gray", "jpeg", "bilevel"];
+
 // --- Loaders ---
 
 export function loadAlignLeftSetting() {
@@ -208,6 +214,10 @@ export function loadExportWizardOptions() {
       next.summaryFieldSeason = parsed.summaryFieldSeason !== false;
       next.summaryFieldFavorites = parsed.summaryFieldFavorites !== false;
       next.summaryFieldCount = parsed.summaryFieldCount !== false;
+      next.imageDpi = clampInt(parsed.imageDpi ?? 0, 0, 600);
+      next.imageEncoding = EXPORT_IMAGE_ENCODINGS.includes(parsed.imageEncoding) ? parsed.imageEncoding : "color";
+      next.jpegQuality = clampInt(parsed.jpegQuality ?? 80, 30, 95);
+      next.renderEngine = parsed.renderEngine === "vector" ? "vector" : "raster";
     }
   } catch {}
   exportWizardOptions = next;
@@ -448,6 +458,10 @@ export function saveExportWizardOptions(v) {
     summaryFieldSeason: v?.summaryFieldSeason !== false,
     summaryFieldFavorites: v?.summaryFieldFavorites !== false,
     summaryFieldCount: v?.summaryFieldCount !== false,
+    imageDpi: clampInt(v?.imageDpi ?? 0, 0, 600),
+    imageEncoding: EXPORT_IMAGE_ENCODINGS.includes(v?.imageEncoding) ? v.imageEncoding : "color",
+    jpegQuality: clampInt(v?.jpegQuality ?? 80, 30, 95),
+    renderEngine: v?.renderEngine === "vector" ? "vector" : "raster",
   };
   exportWizardOptions = next;
   try {
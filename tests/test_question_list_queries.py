@@ -0,0 +1,82 @@
+"""The per-paper question list must not issue queries per question (N+1)."""
+import sys
+from pathlib import Path
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from backend.database import Base, Paper, Question, QuestionBox, QuestionSection  # noqa: E402
+from backend.routers.questions import list_questions_for_paper  # noqa: E402
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
+    engine.dispose()
+
+
+def _seed(db: Session, n: int) -> int:
+    paper = Paper(filename=f"paper_{n}.pdf", page_count=2)
+    db.add(paper)
+    db.flush()
+    for i in range(n):
+        q = Question(paper_id=paper.id, question_no=f"{n}-{i + 1}", status="confirmed")
+        db.add(q)
+        db.flush()
+        db.add_all(
+            [
+                QuestionBox(
+                    question_id=q.id, paper_id=paper.id, page=1,
+                    bbox=[0.1, 0.05 * i, 0.9, 0.05 * i + 0.04], image_path="page_1.png",
+                ),
+                QuestionBox(
+                    question_id=q.id, paper_id=paper.id, page=2,
+                    bbox=[0.1, 0.1, 0.9, 0.2], image_path="page_2.png",
+                ),
+                QuestionSection(question_id=q.id, section_name="Algebra"),
+            ]
+        )
+    db.commit()
+    return paper.id
+
+
+def _count_statements(db: Session, fn) -> tuple[int, object]:
+    count = 0
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        nonlocal count
+        count += 1
+
+    engine = db.get_bind()
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        result = fn()
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+    return count, result
+
+
+@pytest.mark.parametrize("page", [None, 1])
+def test_list_questions_query_count_is_constant(db, page):
+    one, many = _seed(db, 1), _seed(db, 12)
+
+    def run(paper_id):
+        db.expire_all()
+        return _count_statements(
+            db, lambda: list_questions_for_paper(paper_id, section=None, status=None, page=page, db=db)
+        )
+
+    one_count, one_result = run(one)
+    many_count, many_result = run(many)
+
+    assert len(one_result["questions"]) == 1
+    assert len(many_result["questions"]) == 12
+    assert all(q["sections"] == ["Algebra"] for q in many_result["questions"])
+    assert one_count == many_count